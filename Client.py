@@ -1,9 +1,23 @@
 # Client.py
+import itertools
 import socket
 import struct
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
 
-HEADER_SIZE = 4
+from utils.protocol import (
+    PREPARE, PREPARED, ERROR, OPEN, FETCH, CLOSE, SCHEMA, ROWS, DONE, HELLO, RESULT, TEXT_FORMAT,
+    BINARY_FORMAT, BATCH, RESULTS, PING, QueryResult, decode_message, decode_prepared, decode_schema,
+    decode_rows, decode_result, decode_results, encode_execute, encode_message, encode_count,
+    encode_values
+)
+
+HEADER_SIZE = 8
 SERVER_PORT = 5371
+PING_TIMEOUT = 5.0
 
 class Client:
 
@@ -13,28 +27,415 @@ class Client:
                             socket.AF_INET, socket.SOCK_STREAM)
         else:
             self.sock = sock
+        self.result_format = BINARY_FORMAT
+        self.request_ids = itertools.count(1)
+        # Frames received while waiting for another request, by request ID
+        self.pending: dict[int, deque] = {}
+        # Handles of statements prepared on this connection, by query
+        self.statement_handles: dict[str, int] = {}
 
-    def connect(self, host = "localhost", port =  SERVER_PORT):
+    def connect(self, host = "localhost", port =  SERVER_PORT, result_format = BINARY_FORMAT):
+        """
+        Connect and negotiate how results are encoded: BINARY_FORMAT results are
+        decoded into Python rows, TEXT_FORMAT results are the formatted tables
+        shown by the REPL.
+        """
         self.sock.connect((host, port))
+        if result_format != self.result_format:
+            request_id = self.send(encode_message(HELLO, bytes([result_format])))
+            _, body = self.receive_message(request_id)
+            self.result_format = body[0]
+
+    def close(self):
+        self.sock.close()
+
+    def ping(self, timeout: float = PING_TIMEOUT) -> bool:
+        """
+        Check that the server still answers on this connection.
+        """
+        previous = self.sock.gettimeout()
+        try:
+            self.sock.settimeout(timeout)
+            kind, _ = self.receive_message(self.send(encode_message(PING)))
+            return kind == PING
+        except (OSError, RuntimeError, ValueError):
+            return False
+        finally:
+            try:
+                self.sock.settimeout(previous)
+            except OSError:
+                pass
 
-    def send(self, msg):
-        msg_length = struct.pack('>I', len(msg))
-        self.sock.sendall(msg_length + msg)
+    def send(self, msg) -> int:
+        """
+        Send a request and return its request ID, which tags every frame of its response.
+        """
+        request_id = next(self.request_ids)
+        header = struct.pack('>II', len(msg), request_id)
+        self.sock.sendall(header + msg)
         # print(f"Sent message: {msg.decode()}")
+        return request_id
+
+    def receive(self, request_id: int = None) -> str :
+        data = self.receive_frame(request_id).decode()
+        # print(f"Received message: {data}")
+        return data
 
-    def receive(self) -> str :
-        header = self.sock.recv(HEADER_SIZE)
-        if not header:
-            raise RuntimeError("Socket connection broken during header reception")
-        msg_length = struct.unpack('>I', header)[0]
+    def receive_frame(self, request_id: int = None) -> bytes:
+        """
+        Receive the next response frame of `request_id`, or the next frame of
+        any request when no ID is given. Frames of other requests that arrive
+        first are kept until they are asked for, so requests can be pipelined.
+        """
+        if request_id is None:
+            buffered = min((rid for rid, frames in self.pending.items() if frames), default=None)
+            if buffered is not None:
+                return self.pending[buffered].popleft()
+            return self.read_frame()[1]
+        if self.pending.get(request_id):
+            return self.pending[request_id].popleft()
+        while True:
+            frame_id, frame = self.read_frame()
+            if frame_id == request_id:
+                return frame
+            self.pending.setdefault(frame_id, deque()).append(frame)
+
+    def read_frame(self) -> tuple[int, bytes]:
+        header = self.receive_bytes(HEADER_SIZE, "header")
+        msg_length, request_id = struct.unpack('>II', header)
+        return request_id, self.receive_bytes(msg_length, "data")
+
+    def receive_bytes(self, count: int, part: str) -> bytes:
         chunks = []
         bytes_recd = 0
-        while bytes_recd < msg_length:
-            chunk = self.sock.recv(min(msg_length - bytes_recd, 2048))
+        while bytes_recd < count:
+            chunk = self.sock.recv(min(count - bytes_recd, 2048))
             if not chunk:
-                raise RuntimeError("Socket connection broken during data reception")
+                raise RuntimeError(f"Socket connection broken during {part} reception")
             chunks.append(chunk)
             bytes_recd += len(chunk)
-        data = b''.join(chunks).decode()
-        # print(f"Received message: {data}")
-        return data
\ No newline at end of file
+        return b''.join(chunks)
+
+    def prepare(self, query: str) -> int:
+        """
+        Prepare a query with `?` placeholders on the server and return its handle,
+        which stays valid for the lifetime of this connection.
+        """
+        request_id = self.send(encode_message(PREPARE, query.encode()))
+        kind, body = self.receive_message(request_id)
+        if kind != PREPARED:
+            raise RuntimeError(f"Unexpected reply to PREPARE: {kind}")
+        handle, _ = decode_prepared(body)
+        return handle
+
+    def execute(self, handle: int, parameters: list = ()) -> QueryResult | str:
+        """
+        Execute a prepared statement. Parameters are sent as typed values, so
+        no SQL is built on this side.
+        """
+        return self.read_result(self.send(encode_execute(handle, list(parameters))))
+
+    def query(self, query: str) -> QueryResult | str:
+        """
+        Execute a query and return its decoded result.
+        """
+        return self.read_result(self.submit(query))
+
+    def submit(self, query: str) -> int:
+        """
+        Send a query without waiting for its result, which is collected later
+        with read_result(request_id). The server executes the queries of a
+        connection in the order they were sent.
+        """
+        return self.send(query.encode())
+
+    def batch(self, queries: list[str]) -> list[QueryResult] | str:
+        """
+        Execute several queries in order in one round trip. Returns a
+        QueryResult per query in the binary format, or one text in the text format.
+        """
+        request_id = self.send(encode_message(BATCH, encode_values(list(queries))))
+        frame = self.receive_frame(request_id)
+        message = decode_message(frame)
+        if message is None:
+            return frame.decode()
+        kind, body = message
+        if kind == RESULTS:
+            return decode_results(body)
+        raise ValueError(body.decode() if kind == ERROR else f"Unexpected reply to BATCH: {kind}")
+
+    def read_result(self, request_id: int = None) -> QueryResult | str:
+        """
+        Receive an execution result: a QueryResult with Python rows in the
+        binary format, or the formatted text in the text format.
+        """
+        frame = self.receive_frame(request_id)
+        message = decode_message(frame)
+        if message is None:
+            return frame.decode()
+        kind, body = message
+        if kind == RESULT:
+            return decode_result(body)
+        raise ValueError(body.decode() if kind == ERROR else f"Unexpected reply: {kind}")
+
+    def open_cursor(self, query: str) -> list[tuple]:
+        """
+        Run a SELECT as a server-side cursor and return the (name, type, size)
+        of its columns. Rows are then pulled with fetch.
+        """
+        request_id = self.send(encode_message(OPEN, query.encode()))
+        kind, body = self.receive_message(request_id)
+        if kind != SCHEMA:
+            raise RuntimeError(f"Unexpected reply to OPEN: {kind}")
+        return decode_schema(body)
+
+    def fetch(self, count: int) -> list:
+        """
+        Fetch up to `count` rows from the open cursor. Fewer rows than asked
+        for means the result is exhausted and the cursor is closed. The
+        response is read up to the DONE or empty ROWS frame that ends it, so
+        none of its frames is left behind for a later read.
+        """
+        request_id = self.send(encode_count(FETCH, count))
+        rows = []
+        while True:
+            kind, body = self.receive_message(request_id)
+            if kind == DONE:
+                break
+            if kind != ROWS:
+                raise RuntimeError(f"Unexpected reply to FETCH: {kind}")
+            batch = decode_rows(body)
+            if not batch:
+                break
+            rows.extend(batch)
+        return rows
+
+    def close_cursor(self):
+        """
+        Close the open cursor without fetching the rest of its rows.
+        """
+        self.receive_message(self.send(encode_message(CLOSE)))
+
+    def receive_message(self, request_id: int = None) -> tuple[int, bytes]:
+        message = decode_message(self.receive_frame(request_id))
+        if message is None:
+            raise RuntimeError("Expected a protocol message")
+        kind, body = message
+        if kind == ERROR:
+            raise ValueError(body.decode())
+        return kind, body
+
+
+@dataclass
+class PoolStats:
+    acquisitions: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+    acquire_timeouts: int = 0
+    connections_opened: int = 0
+    reconnects: int = 0
+    idle_evictions: int = 0
+    failed_pings: int = 0
+
+    @property
+    def average_wait(self) -> float:
+        return self.total_wait / self.acquisitions if self.acquisitions else 0.0
+
+
+class ClientPool:
+    """
+    Thread-safe pool of Client connections to one server. It keeps between
+    `min_size` and `max_size` connections, closes connections idle for longer
+    than `idle_timeout`, and pings a connection that has been idle for more
+    than `ping_interval` before handing it out. The pool state and its stats
+    are only changed under `condition`.
+    """
+    def __init__(self, host = "localhost", port = SERVER_PORT, min_size: int = 1, max_size: int = 8,
+                 idle_timeout: float = 300.0, ping_interval: float = 30.0, request_timeout: float = None,
+                 acquire_timeout: float = None, result_format = BINARY_FORMAT):
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError("Error: Pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1.")
+        self.host = host
+        self.port = port
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self.request_timeout = request_timeout
+        self.acquire_timeout = acquire_timeout
+        self.result_format = result_format
+        self.condition = threading.Condition()
+        # (client, time it was released), most recently used last
+        self.idle: deque = deque()
+        self.size = 0
+        self.closed = False
+        self.stats = PoolStats()
+        for _ in range(min_size):
+            self.idle.append((self.open_connection(), time.monotonic()))
+            self.size += 1
+
+    def open_connection(self) -> Client:
+        client = Client()
+        try:
+            client.connect(self.host, self.port, self.result_format)
+        except Exception:
+            client.close()
+            raise
+        with self.condition:
+            self.stats.connections_opened += 1
+        return client
+
+    def acquire(self, timeout: float = None, fresh: bool = False) -> Client:
+        """
+        Take a connection from the pool, opening one if the pool is below
+        `max_size`, or waiting up to `timeout` seconds for one to be released.
+        With `fresh`, a new connection is opened, replacing an idle one if needed.
+        """
+        timeout = self.acquire_timeout if timeout is None else timeout
+        start = time.monotonic()
+        client = None
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise RuntimeError("Connection pool is closed")
+                self.evict_idle()
+                if self.idle and not fresh:
+                    client, released = self.idle.pop()
+                    break
+                if self.size < self.max_size:
+                    self.size += 1
+                    break
+                if self.idle:
+                    stale, _ = self.idle.popleft()
+                    stale.close()
+                    break
+                remaining = None if timeout is None else timeout - (time.monotonic() - start)
+                if remaining is not None and remaining <= 0:
+                    self.stats.acquire_timeouts += 1
+                    raise TimeoutError("Timed out waiting for a pooled connection")
+                self.condition.wait(remaining)
+            wait = time.monotonic() - start
+            self.stats.acquisitions += 1
+            self.stats.total_wait += wait
+            self.stats.max_wait = max(self.stats.max_wait, wait)
+
+        try:
+            if client is None:
+                return self.open_connection()
+            if time.monotonic() - released > self.ping_interval and not client.ping():
+                client.close()
+                with self.condition:
+                    self.stats.failed_pings += 1
+                    self.stats.reconnects += 1
+                return self.open_connection()
+            return client
+        except Exception:
+            self.discard()
+            raise
+
+    def release(self, client: Client, broken: bool = False):
+        """
+        Return a connection to the pool, or close it if it is broken or in an unknown state.
+        """
+        if broken or self.closed:
+            client.close()
+            self.discard()
+            return
+        with self.condition:
+            self.idle.append((client, time.monotonic()))
+            self.condition.notify()
+
+    def discard(self):
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def evict_idle(self):
+        """Close the connections idle for longer than `idle_timeout`, keeping `min_size` open."""
+        now = time.monotonic()
+        while self.idle and self.size > self.min_size and now - self.idle[0][1] > self.idle_timeout:
+            client, _ = self.idle.popleft()
+            client.close()
+            self.size -= 1
+            self.stats.idle_evictions += 1
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        client = self.acquire(timeout)
+        try:
+            yield client
+        except (OSError, RuntimeError):
+            self.release(client, broken=True)
+            raise
+        except BaseException:
+            self.release(client)
+            raise
+        else:
+            self.release(client)
+
+    def request(self, operation, timeout: float = None):
+        """
+        Run `operation(client)` on a pooled connection with a per-request
+        timeout. A connection found broken is replaced and the operation is
+        retried once on a fresh connection; a request that timed out is not
+        retried, since the server may still execute it.
+        """
+        timeout = self.request_timeout if timeout is None else timeout
+        for attempt in range(2):
+            client = self.acquire(fresh=attempt > 0)
+            try:
+                client.sock.settimeout(timeout)
+                result = operation(client)
+            except (RuntimeError, ConnectionError) as e:
+                self.release(client, broken=True)
+                broken = isinstance(e, ConnectionError) or str(e).startswith("Socket connection broken")
+                if attempt or not broken:
+                    raise
+                with self.condition:
+                    self.stats.reconnects += 1
+                continue
+            except OSError:
+                self.release(client, broken=True)
+                raise
+            except BaseException:
+                self.release(client)
+                raise
+            client.sock.settimeout(None)
+            self.release(client)
+            return result
+
+    def query(self, query: str, timeout: float = None) -> QueryResult | str:
+        return self.request(lambda client: client.query(query), timeout)
+
+    def execute(self, statement: str, parameters: list = (), timeout: float = None) -> QueryResult | str:
+        """
+        Execute a statement on a pooled connection, preparing it first on
+        connections that have not seen it yet.
+        """
+        def execute(client: Client):
+            if statement not in client.statement_handles:
+                client.statement_handles[statement] = client.prepare(statement)
+            return client.execute(client.statement_handles[statement], parameters)
+        return self.request(execute, timeout)
+
+    def batch(self, queries: list[str], timeout: float = None) -> list[QueryResult] | str:
+        return self.request(lambda client: client.batch(queries), timeout)
+
+    def get_metrics(self) -> dict:
+        with self.condition:
+            return {
+                **asdict(self.stats),
+                "average_wait": self.stats.average_wait,
+                "size": self.size,
+                "idle": len(self.idle),
+                "in_use": self.size - len(self.idle),
+            }
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            while self.idle:
+                client, _ = self.idle.popleft()
+                client.close()
+                self.size -= 1
+            self.condition.notify_all()
@@ -1,4 +1,6 @@
+import copy
 import sys
+import threading
 sys.path.append('./Concurrency_Control_Manager')
 
 from Concurrency_Control_Manager.ConcurrencyControlManager import ConcurrencyControlManager
@@ -6,113 +8,168 @@ from Concurrency_Control_Manager.models.Operation import Operation
 from Concurrency_Control_Manager.models.CCManagerEnums import OperationType, ResponseType
 from Failure_Recovery import FailureRecoveryManager
 from utils.models import ExecutionResult, Rows
+from utils.group_commit import GroupCommitLog, GROUP_COMMIT_WINDOW, GROUP_COMMIT_MAX_BATCH
+from utils.checkpoint import CHECKPOINT_INTERVAL
 from datetime import datetime
 
+WAL_PATH = "Failure_Recovery/wal.log"
+WAL_ARCHIVE_DIR = "Failure_Recovery/archive"
+
 class QueryConcurrencyController:
     operations: list[ExecutionResult]
 
-    def __init__(self):
+    def __init__(self, wal_window: float = GROUP_COMMIT_WINDOW, wal_max_batch: int = GROUP_COMMIT_MAX_BATCH,
+                 checkpoint_interval: float | None = CHECKPOINT_INTERVAL):
         self.ccm = ConcurrencyControlManager()
-        self.frm = FailureRecoveryManager.FailureRecoveryManager("Failure_Recovery/wal.log")
+        self.ccm_lock = threading.RLock()
+        self.frm = FailureRecoveryManager.FailureRecoveryManager(WAL_PATH)
+        self.wal = GroupCommitLog(self.frm, WAL_PATH, wal_window, wal_max_batch,
+                                  checkpoint_interval, WAL_ARCHIVE_DIR)
         self.is_transacting = False
         self.operations = []
         self.queries_operations = []
         self.failed_operations = []
         self.transact_id = 1
+        self.transaction_ids = []
         self.is_rollingback = False
     
+    def clone(self) -> "QueryConcurrencyController":
+        """
+        Transaction state for another session, sharing the CCM, FRM and log.
+        The CCM is not thread-safe, so every session goes through the lock of
+        the controller it was cloned from.
+        """
+        session = copy.copy(self)
+        session.is_transacting = False
+        session.operations = []
+        session.queries_operations = []
+        session.failed_operations = []
+        session.transact_id = 1
+        session.transaction_ids = []
+        session.is_rollingback = False
+        return session
+
     def begin_transaction(self):
         self.is_transacting = True
+        self.transaction_ids = []
+
+    def begin_operation(self) -> int:
+        with self.ccm_lock:
+            transact_id = self.ccm.begin_transaction()
+        if self.is_transacting:
+            self.transaction_ids.append(transact_id)
+        return transact_id
+
+    def recover(self) -> list:
+        rollback = self.wal.recover(self.transact_id, self.transaction_ids)
+        self.transaction_ids = []
+        return rollback
     
     def check_for_response_select(self, table_names: list[str]) -> list | str:
-        self.transact_id = self.ccm.begin_transaction()
-        try:
+        with self.ccm_lock:
+            self.transact_id = self.begin_operation()
+            try:
+                for res_string in table_names:
+                    ops = Operation(self.transact_id, OperationType.R, f"{res_string}")
+                    response = self.ccm.validate_object(ops)
+                    if response.responseType.name == "ALLOWED":
+                        self.ccm.log_object(ops)
+                    elif response.responseType.name == "ABORT":
+                        rollback = self.recover()
+                        self.is_rollingback = True
+                        self.failed_operations.append(ops)
+                        self.ccm.end_transaction(self.transact_id)
+                        return rollback
+                    else:
+                        return "LE WAIT"
+                self.ccm.end_transaction(self.transact_id)
+                return "OK"
+            except Exception as e:
+                print(f"BLa bla bla: {e}")
+    
+    def check_for_response_insert(self, table_names: list[str]) -> list | str:
+        with self.ccm_lock:
+            self.transact_id = self.begin_operation()
             for res_string in table_names:
-                ops = Operation(self.transact_id, OperationType.R, f"{res_string}")
+                ops = Operation(self.transact_id, OperationType.W, f"{res_string}")
                 response = self.ccm.validate_object(ops)
                 if response.responseType.name == "ALLOWED":
                     self.ccm.log_object(ops)
                 elif response.responseType.name == "ABORT":
-                    rollback = self.frm.recover(self.transact_id)
+                    rollback = self.recover()
                     self.is_rollingback = True
                     self.failed_operations.append(ops)
                     self.ccm.end_transaction(self.transact_id)
                     return rollback
-                else:
-                    return "LE WAIT"
             self.ccm.end_transaction(self.transact_id)
             return "OK"
-        except Exception as e:
-            print(f"BLa bla bla: {e}")
-    
-    def check_for_response_insert(self, table_names: list[str]) -> list | str:
-        self.transact_id = self.ccm.begin_transaction()
-        for res_string in table_names:
-            ops = Operation(self.transact_id, OperationType.W, f"{res_string}")
-            response = self.ccm.validate_object(ops)
-            if response.responseType.name == "ALLOWED":
-                self.ccm.log_object(ops)
-            elif response.responseType.name == "ABORT":
-                rollback = self.frm.recover(self.transact_id)
-                self.is_rollingback = True
-                self.failed_operations.append(ops)
-                self.ccm.end_transaction(self.transact_id)
-                return rollback
-        self.ccm.end_transaction(self.transact_id)
-        return "OK"
     
     def check_for_response_update(self, table_names: list[str]) -> list | str:
-        self.transact_id = self.ccm.begin_transaction()
-        for res_string in table_names:
-            ops = Operation(self.transact_id, OperationType.R, f"{res_string}")
-            response = self.ccm.validate_object(ops)
-            if response.responseType.name == "ALLOWED":
-                self.ccm.log_object(ops)
-            elif response.responseType.name == "ABORT":
-                rollback = self.frm.recover(self.transact_id)
-                self.is_rollingback = True
-                self.failed_operations.append(ops)
-                self.ccm.end_transaction(self.transact_id)
-                return rollback
-        for res_string in table_names:
-            ops = Operation(self.transact_id, OperationType.W, f"{res_string}")
-            response = self.ccm.validate_object(ops)
-            if response.responseType.name == "ALLOWED":
-                self.ccm.log_object(ops)
-            elif response.responseType.name == "ABORT":
-                rollback = self.frm.recover(self.transact_id)
-                self.is_rollingback = True
-                self.failed_operations.append(ops)
-                self.ccm.end_transaction(self.transact_id)
-                return rollback
-        return "OK"
+        with self.ccm_lock:
+            self.transact_id = self.begin_operation()
+            for res_string in table_names:
+                ops = Operation(self.transact_id, OperationType.R, f"{res_string}")
+                response = self.ccm.validate_object(ops)
+                if response.responseType.name == "ALLOWED":
+                    self.ccm.log_object(ops)
+                elif response.responseType.name == "ABORT":
+                    rollback = self.recover()
+                    self.is_rollingback = True
+                    self.failed_operations.append(ops)
+                    self.ccm.end_transaction(self.transact_id)
+                    return rollback
+            for res_string in table_names:
+                ops = Operation(self.transact_id, OperationType.W, f"{res_string}")
+                response = self.ccm.validate_object(ops)
+                if response.responseType.name == "ALLOWED":
+                    self.ccm.log_object(ops)
+                elif response.responseType.name == "ABORT":
+                    rollback = self.recover()
+                    self.is_rollingback = True
+                    self.failed_operations.append(ops)
+                    self.ccm.end_transaction(self.transact_id)
+                    return rollback
+            return "OK"
     
     def check_for_response_delete(self, table_names: list[str]) -> list | str:
-        self.transact_id = self.ccm.begin_transaction()
-        for res_string in table_names:
-            ops = Operation(self.transact_id, OperationType.R, f"{res_string}")
-            response = self.ccm.validate_object(ops)
-            if response.responseType.name == "ALLOWED":
-                self.ccm.log_object(ops)
-            elif response.responseType.name == "ABORT":
-                rollback = self.frm.recover(self.transact_id)
-                self.is_rollingback = True
-                self.failed_operations.append(ops)
-                self.ccm.end_transaction(self.transact_id)
-                return rollback
-        for res_string in table_names:
-            ops = Operation(self.transact_id, OperationType.W, f"{res_string}")
-            response = self.ccm.validate_object(ops)
-            if response.responseType.name == "ALLOWED":
-                self.ccm.log_object(ops)
-            elif response.responseType.name == "ABORT":
-                rollback = self.frm.recover(self.transact_id)
-                self.is_rollingback = True
-                self.failed_operations.append(ops)
-                self.ccm.end_transaction(self.transact_id)
-                return rollback
-        return "OK"
+        with self.ccm_lock:
+            self.transact_id = self.begin_operation()
+            for res_string in table_names:
+                ops = Operation(self.transact_id, OperationType.R, f"{res_string}")
+                response = self.ccm.validate_object(ops)
+                if response.responseType.name == "ALLOWED":
+                    self.ccm.log_object(ops)
+                elif response.responseType.name == "ABORT":
+                    rollback = self.recover()
+                    self.is_rollingback = True
+                    self.failed_operations.append(ops)
+                    self.ccm.end_transaction(self.transact_id)
+                    return rollback
+            for res_string in table_names:
+                ops = Operation(self.transact_id, OperationType.W, f"{res_string}")
+                response = self.ccm.validate_object(ops)
+                if response.responseType.name == "ALLOWED":
+                    self.ccm.log_object(ops)
+                elif response.responseType.name == "ABORT":
+                    rollback = self.recover()
+                    self.is_rollingback = True
+                    self.failed_operations.append(ops)
+                    self.ccm.end_transaction(self.transact_id)
+                    return rollback
+            return "OK"
     
+    def commit_operation(self):
+        """Log the COMMIT of a statement that wrote to the log outside a transaction."""
+        self.wal.write_log(ExecutionResult(
+            transaction_id=self.transact_id,
+            timestamp=datetime.now(),
+            type="COMMIT",
+            status="success",
+            query="COMMIT",
+            previous_data=Rows(data=[], rows_count=0, schema=[], columns=[]),
+            new_data=Rows(data=[], rows_count=0, schema=[], columns=[])
+        ))
+
     def end_transaction(self):
         res = ExecutionResult(
             transaction_id=self.transact_id,
@@ -123,6 +180,10 @@ class QueryConcurrencyController:
             previous_data=Rows(data=[], rows_count=0, schema=[], columns=[]),
             new_data=Rows(data=[], rows_count=0, schema=[], columns=[])
         )
-        self.frm.write_log(res)
+        self.wal.write_log(res)
+        for transact_id in self.transaction_ids:
+            self.wal.end_transaction(transact_id)
+        self.transaction_ids = []
         self.is_transacting = False
-        self.ccm.end_transaction(self.transact_id)
\ No newline at end of file
+        with self.ccm_lock:
+            self.ccm.end_transaction(self.transact_id)
\ No newline at end of file
@@ -15,44 +15,473 @@ from QueryConcurrencyController import QueryConcurrencyController
 # from Concurrency_Control_Manager.models import CCManagerEnums
 # from Concurrency_Control_Manager.models import Resource
 from utils.models import ExecutionResult, Rows
+from utils.cursor import Cursor
+from dataclasses import asdict
 from datetime import datetime
 from typing import Tuple 
-from utils.query import get_query_type, print_tree
-
+from utils.vectorized import (
+    VectorOperator, VectorScan, VectorFilter, VectorProject, VectorLimit, BatchToRows,
+    compile_mask, is_available as vectorized_available
+)
+from utils.query import (
+    get_query_type, print_tree, parse_table_reference, parse_projection, parse_sort_keys,
+    extract_aggregation, Aggregation, AggregateCall, parse_insert, parse_update, parse_delete,
+    prepare_statement, PreparedSelect, PreparedStatement
+)
+from utils.operators import (
+    Operator, TableScan, Filter, Project, Sort, SortStats, TopN, Limit,
+    NestedLoopJoin, HashJoin, SortMergeJoin, JoinStats, HashAggregate, AggregateStats,
+    output_names, schema_columns
+)
+from utils.plan_cache import (
+    PlanCache, PLAN_CACHE_SIZE, normalize_query, normalize_prepared, placeholder_literals, fill_template, bind_literals
+)
+from utils.result_cache import ResultCache, RESULT_CACHE_BYTES, strip_cache_hint
+from utils.bulk_load import (
+    COPY_BATCH_SIZE, COPY_MEMORY_BUDGET, PartialLoadError, StagedBatches, parse_copy, coerce_batches, open_csv
+)
+from utils.group_commit import GROUP_COMMIT_WINDOW, GROUP_COMMIT_MAX_BATCH
+from utils.checkpoint import CHECKPOINT_INTERVAL
+from utils.locks import LockManager, LockError, LOCK_TIMEOUT, SHARED, EXCLUSIVE
+from utils.mvcc import VersionStore, SnapshotScan, RowChange, GC_INTERVAL
+from utils.indexes import IndexCatalog, IndexScan, accepts_key, coerce_value, parse_create_index, parse_drop_index
+from utils.hash_index import HashIndexCatalog, HashLookup, JoinBuckets, compile_where, literal_assignments
+from utils.buffer_pool import BufferPool, BufferedStorage, BUFFER_POOL_PAGES
+from utils.mapped_scan import MappedScan, MappedScanStats
+from utils.predicate import (
+    parse_predicate, compile_predicate, conjuncts, disjuncts, combine_conjuncts, column_comparison,
+    Compare, ColumnRef, column_references
+)
+
+import copy
+import itertools
 import re
+import threading
+
+JOIN_NODE_TYPES = ('join', 'natural join', 'cartesian', 'cross join')
+SORT_MEMORY_BUDGET = 64 * 1024 * 1024
+JOIN_MEMORY_BUDGET = 64 * 1024 * 1024
+AGGREGATE_MEMORY_BUDGET = 64 * 1024 * 1024
+STORAGE_OPERATORS = {'<>': '!='}
+
+def table_row_count(stats, table_name: str) -> int:
+    """
+    Number of rows of a table according to StorageManager.get_stats().
+    """
+    stat = stats.get(table_name) if isinstance(stats, dict) else None
+    if stat is None:
+        return 0
+    if isinstance(stat, dict):
+        return stat.get('n_r', 0) or 0
+    return getattr(stat, 'n_r', 0) or 0
+
+def distinct_values(stats, table_name: str, column: str) -> int | None:
+    """
+    Number of distinct values of a column according to StorageManager.get_stats(), if known.
+    """
+    stat = stats.get(table_name) if isinstance(stats, dict) else None
+    values = stat.get('V_a_r') if isinstance(stat, dict) else getattr(stat, 'V_a_r', None)
+    return values.get(column) if isinstance(values, dict) else None
+
+def storage_condition(expression, columns) -> Condition | None:
+    """
+    The Storage Manager Condition for a comparison of a column with a literal,
+    or None when the expression is anything more complex.
+    """
+    comparison = column_comparison(expression, columns)
+    if comparison is None:
+        return None
+    idx, comparator, literal = comparison
+    return Condition(columns[idx].name, STORAGE_OPERATORS.get(comparator, comparator), literal.text)
+
+def find_join_keys(left: Operator, right: Operator, lhs: str, rhs: str) -> tuple[int, int] | None:
+    """
+    Column indexes for an equality between a column of `left` and one of `right`.
+    """
+    for left_name, right_name in ((lhs, rhs), (rhs, lhs)):
+        try:
+            return left.column_index(left_name), right.column_index(right_name)
+        except ValueError:
+            continue
+    return None
+
+def is_sorted_on(operator: Operator, keys: list[int]) -> bool:
+    """
+    Whether an operator is a sort whose leading keys are `keys`, all ascending.
+    """
+    if not isinstance(operator, (Sort, TopN)) or len(operator.keys) < len(keys):
+        return False
+    leading = operator.keys[:len(keys)]
+    return (
+        all(not descending for _, descending in leading)
+        and [operator.column_index(name) for name, _ in leading] == keys
+    )
+
+def referenced_columns(query_tree: QueryTree) -> set[tuple[str | None, str]] | None:
+    """
+    The columns a query tree reads in its project, sigma, sort and join nodes,
+    as (qualifier, name) pairs with no qualifier for bare names. None means
+    every column is needed: the tree has no projection, projects `*` or an
+    expression, or has a natural join.
+    """
+    references = set()
+    projected = False
+    stack = [query_tree]
+    while stack:
+        node = stack.pop()
+        node_type = node.type.lower()
+        if node_type == 'natural join':
+            return None
+        if node_type == 'project':
+            items = parse_projection(node.condition)
+            if not items:
+                return None
+            names = [name for name, _ in items]
+            projected = True
+        elif node_type == 'sort':
+            names = [name for name, _ in parse_sort_keys(node.condition)]
+        elif (node_type == 'sigma' or node_type in JOIN_NODE_TYPES) and node.condition:
+            names = column_references(parse_predicate(node.condition))
+        else:
+            names = []
+        for name in names:
+            match = re.match(r"^(?:(\w+)\.)?(\w+)$", name.strip())
+            if not match:
+                return None
+            references.add(match.groups())
+        stack.extend(node.child)
+    return references if projected else None
 
 class QueryExecutor:
-    def __init__(self, base_path: str):
+    def __init__(self, base_path: str, sort_memory_budget: int = SORT_MEMORY_BUDGET,
+                 join_memory_budget: int = JOIN_MEMORY_BUDGET,
+                 aggregate_memory_budget: int = AGGREGATE_MEMORY_BUDGET,
+                 vectorized: bool = False, plan_cache_size: int = PLAN_CACHE_SIZE,
+                 result_cache_bytes: int = RESULT_CACHE_BYTES,
+                 wal_window: float = GROUP_COMMIT_WINDOW, wal_max_batch: int = GROUP_COMMIT_MAX_BATCH,
+                 checkpoint_interval: float | None = CHECKPOINT_INTERVAL, lock_timeout: float = LOCK_TIMEOUT,
+                 snapshot_isolation: bool = False, gc_interval: float | None = GC_INTERVAL,
+                 hash_indexes: list[str] = (), buffer_pool_pages: int = BUFFER_POOL_PAGES,
+                 mmap_scans: bool = False, copy_memory_budget: int = COPY_MEMORY_BUDGET):
         self.base_path = base_path
         self.storage_manager = StorageManager(base_path)
+        self.storage_lock = threading.RLock()
+        self.buffer_pool = BufferPool(buffer_pool_pages) if buffer_pool_pages > 0 else None
+        if self.buffer_pool is not None:
+            self.storage_manager = BufferedStorage(self.storage_manager, base_path, self.buffer_pool)
         # self.conccurency_control_manager = ConcurrencyControlManager()
-        self.qcc = QueryConcurrencyController()
+        self.qcc = QueryConcurrencyController(wal_window, wal_max_batch, checkpoint_interval)
         self.is_transacting = False
         self.operations = []
         self.failed_queries = []
         self.transact_id = 0
+        self.sort_memory_budget = sort_memory_budget
+        self.sort_stats = SortStats()
+        self.join_memory_budget = join_memory_budget
+        self.join_stats = JoinStats()
+        self.aggregate_memory_budget = aggregate_memory_budget
+        self.aggregate_stats = AggregateStats()
+        self.copy_memory_budget = copy_memory_budget
+        self.vectorized = vectorized and vectorized_available()
+        if vectorized and not self.vectorized:
+            print("NumPy is not installed, falling back to row-at-a-time execution.")
+        self.plan_cache = PlanCache(plan_cache_size)
+        self.result_cache = ResultCache(result_cache_bytes)
+        self.lock_manager = LockManager(lock_timeout)
+        self.indexes = IndexCatalog(base_path, self.storage_manager, self.lock_manager)
+        self.hash_indexes = HashIndexCatalog(self.storage_manager, hash_indexes)
+        self.session_ids = itertools.count(1)
+        self.session_id = next(self.session_ids)
+        self.cursor_open = False
+        self.aborting = False
+        self.version_store = VersionStore(gc_interval) if snapshot_isolation else None
+        self.is_session = False
+        self.snapshot = None
+        self.snapshot_tables = set()
+        self.pending_writes = {}
+        self.mmap_scans = mmap_scans
+        self.scan_columns = None
+        self.mapped_scan_stats = MappedScanStats()
+
+    def clone(self) -> "QueryExecutor":
+        """
+        A new session on the same database. The storage manager, caches, lock
+        manager, log and counters are shared; transaction state, failed queries
+        and held locks belong to the session. Calls that change the storage
+        manager go through the `storage_lock` of the executor the session was
+        cloned from, as calls to the CCM go through that of its controller.
+        """
+        session = copy.copy(self)
+        session.qcc = self.qcc.clone()
+        session.is_transacting = False
+        session.operations = []
+        session.failed_queries = []
+        session.transact_id = 0
+        session.session_id = next(self.session_ids)
+        session.cursor_open = False
+        session.aborting = False
+        session.snapshot = None
+        session.snapshot_tables = set()
+        session.pending_writes = {}
+        session.scan_columns = None
+        session.is_session = True
+        return session
+
+    def close_session(self):
+        """End the session, rolling back a transaction it left open."""
+        self.cursor_open = False
+        if self.qcc.is_transacting:
+            self.abort_transaction()
+        else:
+            self.release_all_locks()
+
+    def close(self):
+        """
+        End this session. Closing the executor the sessions were cloned from
+        also stops the garbage collection thread of the version store they
+        share, so it is closed last.
+        """
+        self.close_session()
+        if not self.is_session and self.version_store is not None:
+            self.version_store.close()
 
-    def execute_select(self, query: str) -> ExecutionResult:
+    def lock_tables(self, table_names: list[str], exclusive: bool = False):
+        """
+        Lock the tables of a statement for this session, in name order. A
+        session that loses a deadlock or times out gives up all of its locks,
+        and its open transaction is rolled back, so the statement fails.
+        """
+        tables = sorted({parse_table_reference(name)[0].lower() for name in table_names})
+        try:
+            for table in tables:
+                self.lock_manager.acquire(self.session_id, table, EXCLUSIVE if exclusive else SHARED)
+        except LockError as e:
+            print(e)
+            if self.qcc.is_transacting:
+                self.abort_transaction()
+                raise type(e)(f"{e} The transaction was rolled back.") from e
+            self.release_all_locks()
+            raise
+
+    def abort_transaction(self):
+        """
+        Roll back the open transaction of this session. The writes of all of
+        its statements are undone through the log, newest first, while the
+        session still holds its locks; the locks are released afterwards and
+        later statements run outside a transaction.
+        """
+        rollback = self.qcc.recover()
+        self.qcc.is_transacting = False
+        self.aborting = True
+        try:
+            for rollback_query in rollback:
+                self.qcc.is_rollingback = True
+                query_type = get_query_type(rollback_query)
+                if (query_type == 'INSERT'):
+                    self.execute_insert(rollback_query)
+                elif (query_type == 'UPDATE'):
+                    self.execute_update(rollback_query)
+                elif (query_type == 'DELETE'):
+                    self.execute_delete(rollback_query)
+        finally:
+            self.aborting = False
+            self.qcc.is_rollingback = False
+            self.pending_writes = {}
+            self.release_all_locks()
+
+    def release_locks(self):
+        """
+        After a statement, publish the writes of the session and release its
+        locks, unless a transaction holds them until COMMIT. An open cursor
+        keeps the locks until it is closed.
+        """
+        if self.qcc.is_transacting or self.aborting:
+            return
+        self.publish_writes()
+        if not self.cursor_open:
+            self.release_all_locks()
+
+    def release_all_locks(self):
+        self.lock_manager.release_all(self.session_id)
+
+    def close_cursor(self, operator: Operator, snapshot: int | None = None):
+        operator.close()
+        if snapshot is not None:
+            self.version_store.end_snapshot(snapshot)
+        self.cursor_open = False
+        self.release_locks()
+
+    def begin_snapshot(self, table_names: list[str]) -> int:
+        """
+        Take a snapshot for a read-only query under snapshot isolation. A table
+        is loaded into the version store the first time it is read, under a
+        shared lock so that no uncommitted write is loaded with it. Tables this
+        session is writing in its open transaction are read from storage
+        instead, so the session sees its own writes.
+        """
+        tables = {parse_table_reference(name)[0].lower() for name in table_names}
+        own = {table for table, mode in self.lock_manager.held_by(self.session_id).items() if mode == EXCLUSIVE}
+        for table in sorted(tables - own):
+            if table not in self.version_store:
+                self.lock_tables([table])
+                self.version_store.load(table, self.storage_manager.get_table_data(table) or [])
+        self.release_locks()
+        self.snapshot_tables = tables - own
+        self.snapshot = self.version_store.begin_snapshot()
+        return self.snapshot
+
+    def writes_to(self, table_names: list[str]) -> bool:
+        """
+        Whether this session holds an exclusive lock on one of the tables, in
+        which case it reads its own uncommitted writes.
+        """
+        held = self.lock_manager.held_by(self.session_id)
+        return any(held.get(parse_table_reference(name)[0].lower()) == EXCLUSIVE for name in table_names)
+
+    def versioned(self, table_name: str) -> bool:
+        """Whether the writes to a table have to be published to the version store."""
+        return self.version_store is not None and table_name.lower() in self.version_store
+
+    def record_write(self, table_name: str, change: RowChange | None):
+        """
+        Remember a write of this session until it is published. Without a
+        `change`, the table is read back from storage when it is published.
+        """
+        table = table_name.lower()
+        if change is None:
+            self.pending_writes[table] = None
+        elif self.pending_writes.setdefault(table, []) is not None:
+            self.pending_writes[table].append(change)
+
+    def record_insert(self, table_name: str, rows: list[list]):
+        if not self.versioned(table_name):
+            return
+        types = [attr[1] for attr in self.storage_manager.get_table_schema(table_name).get_metadata()]
+        rows = [[coerce_value(value, dtype) for value, dtype in zip(row, types)] for row in rows]
+        self.record_write(table_name, RowChange(rows=rows))
+
+    def record_update(self, table_name: str, update_values: dict[str, str], where_clause: str):
+        if not self.versioned(table_name):
+            return
+        metadata = self.storage_manager.get_table_schema(table_name).get_metadata()
+        assignments = literal_assignments(metadata, update_values)
+        predicate = compile_where(self.storage_manager, table_name, where_clause)
+        if assignments is None or predicate is None:
+            self.record_write(table_name, None)
+        else:
+            self.record_write(table_name, RowChange(predicate, assignments))
+
+    def record_delete(self, table_name: str, where_clause: str):
+        if not self.versioned(table_name):
+            return
+        predicate = compile_where(self.storage_manager, table_name, where_clause)
+        self.record_write(table_name, RowChange(predicate) if predicate is not None else None)
+
+    def publish_writes(self):
+        """
+        Publish the committed writes of this session to the version store, at
+        one timestamp for all of their tables.
+        """
+        writes, self.pending_writes = self.pending_writes, {}
+        if self.version_store is None or not writes:
+            return
+        changes, reloads = {}, {}
+        for table, table_changes in writes.items():
+            if table_changes is not None:
+                changes[table] = table_changes
+                continue
+            try:
+                reloads[table] = self.storage_manager.get_table_data(table) or []
+            except Exception:
+                self.version_store.drop(table)
+        self.version_store.publish(changes, reloads)
+        # Results cached from older snapshots since the writes are stale once they are published
+        for table in writes:
+            self.result_cache.invalidate(table)
+
+    def scan_table(self, table_name: str, alias: str = None) -> Operator:
+        if self.snapshot is not None and table_name.lower() in self.snapshot_tables:
+            return SnapshotScan(self.storage_manager, self.version_store, table_name.lower(), self.snapshot, alias)
+        if self.mmap_scans:
+            scan = MappedScan(self.storage_manager, self.base_path, table_name, alias, self.mapped_scan_stats)
+        else:
+            scan = TableScan(self.storage_manager, table_name, alias)
+        if self.scan_columns is not None and not self.hash_indexes.on_table(table_name):
+            # Tables with hash indexes keep every column: joins probe the full rows held by the index
+            scan.project([
+                idx for idx, col in enumerate(scan.columns)
+                if (col.table, col.name) in self.scan_columns or (None, col.name) in self.scan_columns
+            ])
+        return scan
+
+    def get_metrics(self) -> dict:
+        """
+        Counters collected by the executor, for tuning memory budgets and caches.
+        """
+        return {
+            "sort": asdict(self.sort_stats),
+            "join": asdict(self.join_stats),
+            "aggregate": asdict(self.aggregate_stats),
+            "plan_cache": {**asdict(self.plan_cache.stats), "size": len(self.plan_cache)},
+            "result_cache": {
+                **asdict(self.result_cache.stats),
+                "hit_rate": self.result_cache.stats.hit_rate,
+                "size": len(self.result_cache),
+            },
+            "wal": self.qcc.wal.get_metrics(),
+            "locks": asdict(self.lock_manager.stats),
+            "mvcc": asdict(self.version_store.stats) if self.version_store is not None else None,
+            "hash_indexes": self.hash_indexes.get_stats(),
+            "buffer_pool": self.buffer_pool.get_metrics() if self.buffer_pool is not None else None,
+            "mapped_scans": asdict(self.mapped_scan_stats) if self.mmap_scans else None,
+        }
+
+    def execute_select(self, query: str, stream: bool = False, bound: tuple = None) -> ExecutionResult:
+        """
+        Execute a SELECT. With `stream`, the rows are not collected: the result
+        carries a Cursor to fetch them from, and `new_data` only the schema.
+        Under snapshot isolation the query reads a snapshot of the committed
+        rows, without table locks or validation by the Concurrency Control
+        Manager. A prepared SELECT passes its parameters `bound` into its
+        prepared parts, see `execute_prepared`; `query` is then only reported.
+        """
+        snapshot = None
+        streaming = False
         try:
-            optimizer = QueryOptimizer(query, self.storage_manager.get_stats())
-            parsed_result = optimizer.parse()
             type = get_query_type(query)
+            if bound is None:
+                select_query, use_cache = strip_cache_hint(query)
+                use_cache = use_cache and self.result_cache.enabled
+                cache_key = normalize_query(select_query) if use_cache else None
+            else:
+                aggregation, use_cache, plan_key, cache_key = bound
+                use_cache = use_cache and self.result_cache.enabled
+            cached = self.result_cache.get(cache_key) if use_cache else None
+
+            if cached is not None:
+                table_name = cached.table_names
+            else:
+                if bound is None:
+                    planned_query, aggregation = extract_aggregation(select_query)
+                    query_tree = self.plan_query(planned_query)
+                else:
+                    query_tree = self.plan_query(None, plan_key)
+                table_name = self.get_table_names(query_tree)
+                generation = self.result_cache.generation(table_name) if use_cache else None
+
+            mvcc = self.version_store is not None
+            if not mvcc:
+                self.lock_tables(table_name)
+            elif cached is None:
+                snapshot = self.begin_snapshot(table_name)
 
-            # table_name = self.get_table_names(parsed_result.query_tree)
             # operations = self.convert_to_operation_select(table_name, self.transact_id)
 
             # if self.is_transacting:
             #     for operation in operations:
             #         self.operations.append(operation)
 
-            print_tree(parsed_result.query_tree)
-            optimized_tree = optimizer.optimize(parsed_result)
-
-            table_name = self.get_table_names(optimized_tree.query_tree) 
-            print("table name:", table_name)
-            print_tree(optimized_tree.query_tree)
-
-            if (not self.qcc.is_rollingback):
+            if (not mvcc and not self.qcc.is_rollingback):
                 response = self.qcc.check_for_response_select(table_name)
                 self.qcc.is_rollingback = False
                 if (response != "OK"):
@@ -79,7 +508,19 @@ class QueryExecutor:
                                 self.execute_delete(rollback_query)
                     return res
 
-            result_data, schema, columns = self.execute_query(optimized_tree.query_tree)
+            cursor = None
+            if cached is not None:
+                result_data, schema, columns = list(cached.rows), cached.schema, cached.columns
+                if stream:
+                    cursor, result_data = Cursor(result_data), []
+            elif stream:
+                operator, schema, columns = self.open_query(query_tree, aggregation)
+                cursor, result_data = Cursor(operator, lambda: self.close_cursor(operator, snapshot)), []
+                self.cursor_open = streaming = True
+            else:
+                result_data, schema, columns = self.execute_query(query_tree, aggregation)
+                if use_cache and not self.writes_to(table_name):
+                    self.result_cache.put(cache_key, result_data, schema, columns, table_name, generation)
 
             timestamp = datetime.now()
             previous_data = Rows(data=[], rows_count=0, schema=[], columns={})
@@ -92,7 +533,8 @@ class QueryExecutor:
                 status="success",
                 query=query,
                 previous_data=previous_data,
-                new_data=new_data
+                new_data=new_data,
+                cursor=cursor
             )
 
             return res
@@ -108,23 +550,102 @@ class QueryExecutor:
                 new_data=Rows(data=[], rows_count=0, columns=[])
             )
 
-    def execute_insert(self, query: str) -> ExecutionResult:
+        finally:
+            self.snapshot = None
+            if snapshot is not None and not streaming:
+                self.version_store.end_snapshot(snapshot)
+            self.release_locks()
+
+    def plan_query(self, query: str | None, key: tuple = None) -> QueryTree:
+        """
+        Parse and optimize a SELECT into a Query Tree. Plans are cached under the
+        query text with its literals replaced by placeholders, so a repeated
+        statement only has its literals bound into the cached tree.
+
+        A prepared SELECT passes no text, only the (template, literals) `key`.
+        On a miss its template is planned with placeholder literals, which
+        binds to the parameters whether or not the optimizer could parse them.
+        """
+        stats = None
+
+        def get_stats():
+            # Only read when the plan cache misses or a table of the plan was written
+            nonlocal stats
+            if stats is None:
+                stats = self.storage_manager.get_stats()
+            return stats
+
+        row_count = lambda table: table_row_count(get_stats(), table)
+        template, literals = key or normalize_query(query)
+        query_tree = self.plan_cache.get(template, literals, row_count)
+        if query_tree is not None:
+            return query_tree
+
+        planned_literals = literals if query is not None else placeholder_literals(literals)
+        if query is None:
+            query = fill_template(template, planned_literals)
+        optimizer = QueryOptimizer(query, get_stats())
+        parsed_result = optimizer.parse()
+        print_tree(parsed_result.query_tree)
+        optimized_tree = optimizer.optimize(parsed_result)
+
+        table_name = self.get_table_names(optimized_tree.query_tree)
+        print("table name:", table_name)
+        print_tree(optimized_tree.query_tree)
+
+        tables = [parse_table_reference(name)[0].lower() for name in table_name]
+        self.plan_cache.put(template, planned_literals, optimized_tree.query_tree, tables, row_count)
+        query_tree = bind_literals(optimized_tree.query_tree, planned_literals, literals)
+        if query_tree is None:
+            # The optimizer rewrote a placeholder, so plan the query with the parameters written in
+            return self.plan_query(fill_template(template, literals))
+        return query_tree
+
+    def prepare(self, query: str) -> PreparedStatement:
+        """
+        Parse a statement with `?` placeholders once. A SELECT is split into
+        its aggregation and the query the optimizer plans, and both get their
+        cache templates, so executing it only binds the parameters.
+        """
+        statement = prepare_statement(query)
+        if statement.query_type == "SELECT":
+            select_query, use_cache = strip_cache_hint(query)
+            planned_query, aggregation = extract_aggregation(select_query)
+            plan_template, plan_slots = normalize_prepared(planned_query)
+            if plan_slots.count(None) != statement.parameter_count:
+                raise ValueError("Error: Parameters of an aggregate query can only be used in its WHERE clause.")
+            statement.select = PreparedSelect(
+                aggregation, use_cache, plan_template, plan_slots, *normalize_prepared(select_query)
+            )
+        return statement
+
+    def execute_prepared(self, statement: PreparedStatement, parameters: list, stream: bool = False) -> ExecutionResult:
+        """
+        Execute a prepared SELECT, INSERT, UPDATE or DELETE with its parameters
+        bound into the parts parsed by `prepare`. The query the result reports
+        has the parameters written in as literals.
+        """
+        statement.check_parameters(parameters)
+        query = statement.render(parameters)
+        if statement.query_type == "SELECT":
+            plan_key, cache_key = statement.select.bind(parameters)
+            bound = (statement.select.aggregation, statement.select.use_cache, plan_key, cache_key)
+            return self.execute_select(query, stream, bound)
+        if statement.query_type == "INSERT":
+            return self.execute_insert(query, (statement.table_name, statement.bind_rows(parameters)))
+        if statement.query_type == "UPDATE":
+            return self.execute_update(query, (
+                statement.table_name, statement.bind_assignments(parameters), statement.bind_where(parameters)
+            ))
+        if statement.query_type == "DELETE":
+            return self.execute_delete(query, (statement.table_name.lower(), statement.bind_where(parameters)))
+        raise ValueError(f"Error: Cannot execute a prepared {statement.query_type} statement.")
+
+    def execute_insert(self, query: str, parsed: tuple = None) -> ExecutionResult:
         try:
-            if not query.startswith("INSERT INTO"):
-                raise ValueError("Error: Invalid INSERT query.")
-            
-            parts = query.split("INSERT INTO")[1].split("VALUES")
-            table_name = parts[0].strip()
-            values_str = parts[1].strip()[1:-1]
-            
-            rows = values_str.split('),')
-            values_list = []
-            for row in rows:
-                row_values = row.strip().strip('()').split(',')
-                values_list.append([v.strip() for v in row_values])
-            
-            if not values_list:
-                raise ValueError(f"Error: No valid data to insert into '{table_name}'.")
+            table_name, values_list = parsed or parse_insert(query)
+
+            self.lock_tables([table_name], exclusive=True)
             
             if (not self.qcc.is_rollingback):
                 response = self.qcc.check_for_response_insert(list(table_name))
@@ -152,7 +673,13 @@ class QueryExecutor:
                                 self.execute_delete(rollback_query)
                     return res
             
-            self.storage_manager.insert_into_table(table_name, values_list)
+            with self.storage_lock:
+                self.storage_manager.insert_into_table(table_name, values_list)
+            self.result_cache.invalidate(table_name)
+            self.plan_cache.note_write(table_name)
+            self.indexes.insert_rows(table_name, values_list)
+            self.hash_indexes.insert_rows(table_name, values_list)
+            self.record_insert(table_name, values_list)
             schema = self.storage_manager.get_table_schema(table_name)
             columns = [attr[0] for attr in schema.get_metadata()]
             
@@ -175,7 +702,7 @@ class QueryExecutor:
             )
 
             if (self.qcc.is_transacting):
-                self.qcc.frm.write_log(res)
+                self.qcc.wal.write_log(res)
             
             return res
         
@@ -190,6 +717,9 @@ class QueryExecutor:
                 new_data=Rows(data=[], rows_count=0, schema=[], columns=[]),
             )
 
+        finally:
+            self.release_locks()
+
 
     def execute_create(self, query: str) -> ExecutionResult:
         try:
@@ -200,6 +730,7 @@ class QueryExecutor:
             
             table_name = schema_match.group(1).strip()
             schema_str = schema_match.group(2).strip()
+            self.lock_tables([table_name], exclusive=True)
 
             attributes = []
             for attribute_str in schema_str.split(','):
@@ -213,7 +744,9 @@ class QueryExecutor:
                 else:
                     raise ValueError(f"Error: Invalid attribute definition '{attribute_str}'")
 
-            self.storage_manager.create_table(table_name, Schema(attributes))
+            with self.storage_lock:
+                self.storage_manager.create_table(table_name, Schema(attributes))
+            self.plan_cache.invalidate(table_name)
             
             timestamp = datetime.now()
             schema = self.storage_manager.get_table_schema(table_name)
@@ -242,44 +775,28 @@ class QueryExecutor:
                 new_data=Rows(data=[], rows_count=0, schema=[], columns=[]),
             )
 
-    def execute_update(self, query: str) -> ExecutionResult:
-        try:
-            update_match = re.match(r"UPDATE\s+(\w+)\s+SET\s+(.+)\s+WHERE\s+(.+)", query, re.IGNORECASE)
-
-            if not update_match:
-                raise ValueError("Error: Invalid UPDATE query.")
+        finally:
+            self.release_locks()
 
-            table_name = update_match.group(1)
-            set_clause = update_match.group(2)
-            where_clause = update_match.group(3)
 
-            update_values = {}
-            for set_part in set_clause.split(','):
-                set_part = set_part.strip()
-                match = re.match(r"(\w+)\s*=\s*(.+)", set_part)
-                if not match:
-                    raise ValueError("Error: Invalid SET clause. Ensure it follows the correct format 'column = value'.")
-                column_name = match.group(1)
-                value = match.group(2).strip()
-                update_values[column_name] = value
+    def execute_update(self, query: str, parsed: tuple = None) -> ExecutionResult:
+        try:
+            table_name, update_values, where_clause = parsed or parse_update(query)
+            self.lock_tables([table_name], exclusive=True)
 
             try:
                 if where_clause:
-                    comparison_operators = ['<=', '>=', '!=', '==', '=', '<', '>']
-
-                    for op in comparison_operators:
-                        if op in where_clause:
-                            parts = where_clause.split(op)
-
-                            operand1 = parts[0].strip()
-                            operand2 = parts[1].strip()
-
-                            condition = Condition(operand1, op, operand2)
-
-                            rows_affected = self.storage_manager.update_table(table_name, update_values, condition)
-                            break
+                    condition, = self.build_storage_conditions(table_name, where_clause, allow_or=False)
+                    with self.storage_lock:
+                        rows_affected = self.storage_manager.update_table(table_name, update_values, condition)
                 else:
-                    rows_affected = self.storage_manager.update_table(table_name, update_values)
+                    with self.storage_lock:
+                        rows_affected = self.storage_manager.update_table(table_name, update_values)
+                self.result_cache.invalidate(table_name)
+                self.plan_cache.note_write(table_name)
+                self.indexes.update_rows(table_name, update_values, where_clause)
+                self.hash_indexes.update_rows(table_name, update_values, where_clause)
+                self.record_update(table_name, update_values, where_clause)
 
             except Exception as e:
                 print(f"Error: {e}")
@@ -334,7 +851,7 @@ class QueryExecutor:
             )
 
             if (self.qcc.is_transacting):
-                self.qcc.frm.write_log(res)
+                self.qcc.wal.write_log(res)
 
             return res
 
@@ -350,24 +867,16 @@ class QueryExecutor:
                 new_data=Rows(data=[], rows_count=0, schema=[], columns=[]),
             )
 
-    def execute_delete(self, query: str) -> ExecutionResult:
-        try:
-            delete_match = re.match(r"DELETE FROM\s+(\w+)\s+WHERE\s+(.+)", query, re.IGNORECASE)
-
-            if not delete_match:
-                raise ValueError("Error: Invalid DELETE query.")
+        finally:
+            self.release_locks()
 
-            table_name = delete_match.group(1).strip().lower()
-            where_clause = delete_match.group(2).strip()
 
-            match = re.match(r"(\w+)\s*([=<>!]+)\s*(.+)", where_clause)
-            if not match:
-                raise ValueError("Error: Invalid WHERE clause. Ensure it follows the correct format 'column operator value'.")
+    def execute_delete(self, query: str, parsed: tuple = None) -> ExecutionResult:
+        try:
+            table_name, where_clause = parsed or parse_delete(query)
+            self.lock_tables([table_name], exclusive=True)
 
-            where_column = match.group(1).strip().lower()
-            operator = match.group(2).strip()
-            where_value = match.group(3).strip()
-            condition = Condition(where_column, operator, where_value)
+            conditions = self.build_storage_conditions(table_name, where_clause, allow_or=True)
             schema = self.storage_manager.get_table_schema(table_name)
             
             if (self.qcc.is_rollingback):
@@ -396,7 +905,15 @@ class QueryExecutor:
                                 self.execute_delete(rollback_query)
                     return res
 
-            rows_affected = self.storage_manager.delete_table_record(table_name, condition)
+            with self.storage_lock:
+                rows_affected = sum(
+                    self.storage_manager.delete_table_record(table_name, condition) for condition in conditions
+                )
+            self.result_cache.invalidate(table_name)
+            self.plan_cache.note_write(table_name)
+            self.indexes.delete_rows(table_name, where_clause)
+            self.hash_indexes.delete_rows(table_name, where_clause)
+            self.record_delete(table_name, where_clause)
             print(f"{rows_affected} row(s) deleted from '{table_name}'.")
 
             columns = [attr[0] for attr in schema.get_metadata()]
@@ -420,7 +937,7 @@ class QueryExecutor:
             )
 
             if (self.qcc.is_transacting):
-                self.qcc.frm.write_log(res)
+                self.qcc.wal.write_log(res)
 
             return res
 
@@ -436,6 +953,139 @@ class QueryExecutor:
                 new_data=Rows(data=[], rows_count=0, schema=[], columns=[]),
             )
 
+        finally:
+            self.release_locks()
+
+
+    def execute_copy(self, query: str) -> ExecutionResult:
+        """
+        Load a CSV file into a table. The whole file is converted once and the
+        converted batches are kept, in memory up to `copy_memory_budget` and
+        in a spill file past it, so a bad row fails the COPY without loading
+        the rows before it. Only a failure of the Storage Manager during the
+        load leaves a partial load behind; the error result then carries the
+        number of rows inserted.
+        """
+        try:
+            table_name, path, header = parse_copy(query)
+            first_line = 2 if header else 1
+            metadata = self.storage_manager.get_table_schema(table_name).get_metadata()
+            with open_csv(path, header) as reader:
+                batches = coerce_batches(reader, metadata, first_line=first_line)
+                staged = StagedBatches(batches, self.copy_memory_budget, self.base_path)
+            with staged:
+                rows_count = self.load_batches(table_name, staged)
+
+            schema = self.storage_manager.get_table_schema(table_name)
+            columns = [attr[0] for attr in schema.get_metadata()]
+            print(f"{rows_count} row(s) copied into '{table_name}'.")
+
+            return ExecutionResult(
+                transaction_id=self.qcc.transact_id,
+                timestamp=datetime.now(),
+                type="COPY",
+                status="success",
+                query=query,
+                previous_data=Rows(data=[], rows_count=0, schema=[], columns=[]),
+                new_data=Rows(data=[], rows_count=rows_count, schema=schema, columns=columns)
+            )
+
+        except Exception as e:
+            print(f"Error: {e}")
+            return ExecutionResult(
+                transaction_id=self.qcc.transact_id,
+                timestamp=datetime.now(),
+                type="COPY",
+                status="error",
+                query=query,
+                previous_data=Rows(data=[], rows_count=0, schema=[], columns=[]),
+                new_data=Rows(data=[], rows_count=getattr(e, "rows_loaded", 0), schema=[], columns=[]),
+            )
+
+    def copy_from(self, table_name: str, rows, batch_size: int = COPY_BATCH_SIZE, first_line: int = 1) -> int:
+        """
+        Bulk insert rows of strings into a table. The rows are converted once
+        against the table schema and loaded in batches of `batch_size` as they
+        are converted, so a bad row or a failed insert leaves the earlier
+        batches loaded. Returns the number of rows inserted.
+        """
+        metadata = self.storage_manager.get_table_schema(table_name).get_metadata()
+        return self.load_batches(table_name, coerce_batches(rows, metadata, batch_size, first_line))
+
+    def load_batches(self, table_name: str, batches) -> int:
+        """
+        Insert converted batches into a table, handing each to the Storage
+        Manager as one insert with one log record. Outside a transaction the
+        load is logged as a transaction of its own and committed once the last
+        batch is in, or once a failure stopped the load, since the batches
+        inserted before it stay loaded. A load stopped after some rows went in
+        raises a PartialLoadError that carries the number of rows inserted.
+        """
+        self.lock_tables([table_name], exclusive=True)
+        try:
+            schema = self.storage_manager.get_table_schema(table_name)
+            columns = [attr[0] for attr in schema.get_metadata()]
+
+            if (not self.qcc.is_rollingback):
+                response = self.qcc.check_for_response_insert([table_name])
+                self.qcc.is_rollingback = False
+                if (response != "OK"):
+                    raise RuntimeError(f"Error: COPY into '{table_name}' was not allowed by the Concurrency Control Manager.")
+
+            rows_count = 0
+            try:
+                for batch in batches:
+                    with self.storage_lock:
+                        self.storage_manager.insert_into_table(table_name, batch)
+                    self.result_cache.invalidate(table_name)
+                    self.plan_cache.note_write(table_name)
+                    self.indexes.insert_rows(table_name, batch)
+                    self.hash_indexes.insert_rows(table_name, batch)
+                    self.record_insert(table_name, batch)
+                    rows_count += len(batch)
+
+                    self.qcc.wal.write_log(ExecutionResult(
+                        transaction_id=self.qcc.transact_id,
+                        timestamp=datetime.now(),
+                        type="INSERT",
+                        status="success",
+                        query=f"COPY {table_name}",
+                        previous_data=Rows(data=[], rows_count=0, schema=[], columns=[]),
+                        new_data=Rows(data=batch, rows_count=len(batch), schema=schema, columns=columns)
+                    ))
+            except Exception as e:
+                if rows_count == 0:
+                    raise
+                raise PartialLoadError(f"{e} {rows_count} row(s) were inserted before the error.", rows_count) from e
+            finally:
+                if rows_count and not self.qcc.is_transacting:
+                    self.qcc.commit_operation()
+
+            return rows_count
+
+        finally:
+            self.release_locks()
+
+    def build_storage_conditions(self, table_name: str, where_clause: str, allow_or: bool) -> list[Condition]:
+        """
+        Compile the WHERE clause of an UPDATE or DELETE into Storage Manager
+        Conditions. The Storage Manager applies one comparison at a time, so each
+        OR term must compare a column with a literal. Deleting the rows of each
+        term in turn deletes their union; an UPDATE cannot be split that way.
+        """
+        columns = schema_columns(self.storage_manager.get_table_schema(table_name), table_name)
+        terms = disjuncts(parse_predicate(where_clause))
+        if len(terms) > 1 and not allow_or:
+            raise ValueError("Error: OR conditions are not supported in UPDATE.")
+
+        conditions = []
+        for term in terms:
+            condition = storage_condition(term, columns)
+            if condition is None:
+                raise ValueError(f"Error: WHERE clause '{where_clause}' must compare a column with a value.")
+            conditions.append(condition)
+        return conditions
+
     def execute_drop(self, query: str) -> ExecutionResult:
         try:
             drop_match = re.match(r"DROP TABLE\s+(\w+)", query, re.IGNORECASE)
@@ -444,7 +1094,16 @@ class QueryExecutor:
                 raise ValueError("Error: Invalid DROP TABLE statement.")
 
             table_name = drop_match.group(1).strip().lower()
-            self.storage_manager.delete_table(table_name)
+            self.lock_tables([table_name], exclusive=True)
+            with self.storage_lock:
+                self.storage_manager.delete_table(table_name)
+            self.indexes.drop_table(table_name)
+            self.hash_indexes.drop_table(table_name)
+            if self.version_store is not None:
+                self.version_store.drop(table_name)
+                self.pending_writes.pop(table_name.lower(), None)
+            self.plan_cache.invalidate(table_name)
+            self.result_cache.invalidate(table_name)
 
             timestamp = datetime.now()
             new_data = Rows(data=[], rows_count=0, schema=[], columns=[])
@@ -469,6 +1128,79 @@ class QueryExecutor:
                 previous_data=Rows(data=[], rows_count=0, schema=[], columns=[]),
                 new_data=Rows(data=[], rows_count=0, schema=[], columns=[]),
             )
+
+        finally:
+            self.release_locks()
+
+
+    def execute_create_index(self, query: str) -> ExecutionResult:
+        """
+        Build a B+-tree index with `CREATE INDEX name ON table (column)`.
+        """
+        try:
+            index_name, table_name, column = parse_create_index(query)
+            self.lock_tables([table_name], exclusive=True)
+            tree = self.indexes.create(index_name, table_name, column)
+            print(f"Index '{index_name}' on {table_name}({column}) built with {tree.count} entries.")
+
+            return ExecutionResult(
+                transaction_id=self.qcc.transact_id,
+                timestamp=datetime.now(),
+                type="CREATE INDEX",
+                status="success",
+                query=query,
+                previous_data=Rows(data=[], rows_count=0, schema=[], columns=[]),
+                new_data=Rows(data=[], rows_count=tree.count, schema=[], columns=[])
+            )
+
+        except Exception as e:
+            print(f"Error: {e}")
+            return ExecutionResult(
+                transaction_id=self.qcc.transact_id,
+                timestamp=datetime.now(),
+                type="CREATE INDEX",
+                status="error",
+                query=query,
+                previous_data=Rows(data=[], rows_count=0, schema=[], columns=[]),
+                new_data=Rows(data=[], rows_count=0, schema=[], columns=[]),
+            )
+
+        finally:
+            self.release_locks()
+
+    def execute_drop_index(self, query: str) -> ExecutionResult:
+        try:
+            index_name = parse_drop_index(query)
+            tree = self.indexes.indexes.get(index_name)
+            if tree is not None:
+                self.lock_tables([tree.meta["table"]], exclusive=True)
+            self.indexes.drop(index_name)
+
+            return ExecutionResult(
+                transaction_id=self.qcc.transact_id,
+                timestamp=datetime.now(),
+                type="DROP INDEX",
+                status="success",
+                query=query,
+                previous_data=Rows(data=[], rows_count=0, schema=[], columns=[]),
+                new_data=Rows(data=[], rows_count=0, schema=[], columns=[])
+            )
+
+        except Exception as e:
+            print(f"Error: {e}")
+            return ExecutionResult(
+                transaction_id=self.qcc.transact_id,
+                timestamp=datetime.now(),
+                type="DROP INDEX",
+                status="error",
+                query=query,
+                previous_data=Rows(data=[], rows_count=0, schema=[], columns=[]),
+                new_data=Rows(data=[], rows_count=0, schema=[], columns=[]),
+            )
+
+        finally:
+            self.release_locks()
+
     def execute_begin_transaction(self):
         self.qcc.begin_transaction()
         # res = ExecutionResult(
@@ -484,6 +1216,7 @@ class QueryExecutor:
 
     def execute_commit(self):
         self.qcc.end_transaction()
+        self.release_locks()
         # res = ExecutionResult(
         #     transaction_id=self.qcc.transact_id,
         #     timestamp=datetime.now(),
@@ -495,269 +1228,359 @@ class QueryExecutor:
         # )
         # return res
 
-    def execute_query(self, query_tree: QueryTree) -> Tuple[list, list, map]:
+    def execute_query(self, query_tree: QueryTree, aggregation: Aggregation = None) -> Tuple[list, Schema, list | dict]:
         """
         Execute the query based on the optimized query tree and return the result as a list
         along with the schema.
         """
+        operator, schema, columns = self.open_query(query_tree, aggregation)
         try:
-            result_data = []
-            schema = []
-            columns = {}
-
-            if query_tree.type == 'limit':
-                limit_value = int(query_tree.condition)
-                if query_tree.child and query_tree.child[0].type == 'table':
-                    table_name = query_tree.child[0].val
-                    table_data = self.storage_manager.get_table_data(table_name)
-                    if table_data:
-                        schema = self.storage_manager.get_table_schema(table_name)
-                        result_data = table_data[:limit_value]
-                        columns = [attr[0] for attr in schema.get_metadata()]
-                    else:
-                        print(f"No data found in table '{table_name}'.")
-                elif query_tree.child and query_tree.child[0].type == 'sort':
-                    table_name = query_tree.child[0].child[0].val
-                    table_data = self.storage_manager.get_table_data(table_name)
-                    if table_data:
-                        schema = self.storage_manager.get_table_schema(table_name)
-                        columns = [attr[0] for attr in schema.get_metadata()]
-                        sort_condition = query_tree.child[0].condition.split()
-                        sort_column = sort_condition[0]
-                        sort_order = sort_condition[1].lower() if len(sort_condition) > 1 else "asc"
-                        column_indices = {attr[0]: idx for idx, attr in enumerate(schema.get_metadata())}
-                        if sort_column in column_indices:
-                            column_index = column_indices[sort_column]
-                            reverse = sort_order == "desc"
-                            result_data = sorted(table_data, key=lambda x: x[column_index], reverse=reverse)[:limit_value]
-                        else:
-                            print(f"Error: Column '{sort_column}' does not exist in table '{table_name}'.")
-                    else:
-                        print(f"No data found in table '{table_name}'.")
-                elif query_tree.child and query_tree.child[0].type == 'sigma':
-                    table_name = query_tree.child[0].child[0].val
-                    where_clause = query_tree.child[0].condition
-                    match = re.match(r"(\w+)\s*([=<>!]+)\s*(.+)", where_clause)
-                    if match:
-                        column_name = match.group(1)
-                        operator = match.group(2)
-                        value = match.group(3)
-                        result_data = self.storage_manager.get_table_data(table_name, Condition(column_name, operator, value))[:limit_value]
-                        schema = self.storage_manager.get_table_schema(table_name)
-                        columns = [attr[0] for attr in schema.get_metadata()]
-                    else:
-                        print("Error: Invalid WHERE clause.")
-                else:
-                    print("Error: No valid table node found under limit node.")
-            
-            elif query_tree.type == 'project':
-                if query_tree.child and query_tree.child[0].type == 'table':
-                    table_name = query_tree.child[0].val
-                    table_data = self.storage_manager.get_table_data(table_name)
-                elif query_tree.child and query_tree.child[0].type == 'limit':
-                    limit_value = int(query_tree.child[0].condition)
-                    if query_tree.child[0].child and query_tree.child[0].child[0].type == 'table':
-                        table_name = query_tree.child[0].child[0].val
-                        table_data = self.storage_manager.get_table_data(table_name)
-                        if table_data:
-                            schema = self.storage_manager.get_table_schema(table_name)
-                            result_data = table_data[:limit_value]
-                        else:
-                            print(f"No data found in table '{table_name}'.")
-                    elif query_tree.child[0].child and query_tree.child[0].child[0].type == 'sort':
-                        table_name = query_tree.child[0].child[0].child[0].val
-                        table_data = self.storage_manager.get_table_data(table_name)
-                        if table_data:
-                            schema = self.storage_manager.get_table_schema(table_name)
-                            columns = [attr[0] for attr in schema.get_metadata()]
-                            sort_condition = query_tree.child[0].child[0].condition.split()
-                            sort_column = sort_condition[0]
-                            sort_order = sort_condition[1].lower() if len(sort_condition) > 1 else "asc"
-                            column_indices = {attr[0]: idx for idx, attr in enumerate(schema.get_metadata())}
-                            if sort_column in column_indices:
-                                column_index = column_indices[sort_column]
-                                reverse = sort_order == "desc"
-                                result_data = sorted(table_data, key=lambda x: x[column_index], reverse=reverse)[:limit_value]
-                                print("result_data:", result_data)
-                            else:
-                                print(f"Error: Column '{sort_column}' does not exist in table '{table_name}'.")
-                        else:
-                            print(f"No data found in table '{table_name}'.")
-                    elif query_tree.child[0].child and query_tree.child[0].child[0].type == 'sigma':
-                        table_name = query_tree.child[0].child[0].child[0].val
-                        where_clause = query_tree.child[0].child[0].condition
-                        match = re.match(r"(\w+)\s*([=<>!]+)\s*(.+)", where_clause)
-                        if match:
-                            column_name = match.group(1)
-                            operator = match.group(2)
-                            value = match.group(3)
-                            result_data = self.storage_manager.get_table_data(table_name, Condition(column_name, operator, value))[:limit_value]
-                            schema = self.storage_manager.get_table_schema(table_name)
-                            columns = [attr[0] for attr in schema.get_metadata()]
-                        else:
-                            print("Error: Invalid WHERE clause.")
-                    else:
-                        print("Error: No valid table node found under limit node.")
-                        return [], [], {}
-                elif query_tree.child and query_tree.child[0].type == 'sigma':
-                    table_name = query_tree.child[0].child[0].val
-                    column_selected = query_tree.condition
-                    where_clause = query_tree.child[0].condition
-
-                    try:
-                        if where_clause:
-                            comparison_operators = ['<=', '>=', '!=', '==', '=', '<', '>']
-
-                            for op in comparison_operators:
-                                if op in where_clause:
-                                    parts = where_clause.split(op)
-
-                                    operand1 = parts[0].strip()
-                                    operand2 = parts[1].strip()
-
-                                    condition = Condition(operand1, op, operand2)
-
-                                    table_data = self.storage_manager.get_table_data(table_name, condition)
-
-                                    break
-                        else:
-                            table_data = self.storage_manager.get_table_data(table_name)
-
-                        if (len(table_data) == 0):
-                            print(f"No data found in table '{table_name}'.")
-                            return [], [], {}
-                        
-                        schema = self.storage_manager.get_table_schema(table_name)
-                        all_columns = [attr[0] for attr in schema.get_metadata()]
-
-                        if column_selected.strip() == "*":
-                            columns = all_columns
-                        else:
-                            column_names = [col.strip() for col in column_selected.split(",")]
-                            if not set(column_names).issubset(all_columns):
-                                print(f"Error: Some specified columns do not exist in table '{table_name}'.")
-                                return [], [], {}
-                    except Exception as e:
-                        print(f"Error: {e}")
-                        return [], [], {}
-                
-                elif query_tree.child and query_tree.child[0].type == 'sort':
-                    table_name = query_tree.child[0].child[0].val
-                    table_data = self.storage_manager.get_table_data(table_name)
-                    if table_data:
-                        schema = self.storage_manager.get_table_schema(table_name)
-
-                        column_indices = {attr[0]: idx for idx, attr in enumerate(schema.get_metadata())}
-
-                        sort_condition = query_tree.child[0].condition.split()
-                        sort_column = sort_condition[0]
-                        sort_order = sort_condition[1].lower() if len(sort_condition) > 1 else "asc"
-
-                        if sort_column in column_indices:
-                            column_index = column_indices[sort_column]
-
-                            reverse = sort_order == "desc"
-
-                            result_data = sorted(table_data, key=lambda x: x[column_index], reverse=reverse)
-
-                            columns = [attr[0] for attr in schema.get_metadata()]
-                            # print("result_data:", result_data)
-                        else:
-                            print(f"Error: Column '{sort_column}' does not exist in table '{table_name}'.")
-                    else:
-                        print(f"No data found in table '{table_name}'.")
-
-                # Parse columns and aliases
-                columns = query_tree.condition.split(',')
-                column_mapping = {}
-                for col in columns:
-                    match = re.match(r'\s*(\S+)\s+AS\s+(\S+)\s*', col.strip(), re.IGNORECASE)
-                    if match:
-                        original = match.group(1).strip() 
-                        alias = match.group(2).strip() 
-                        column_mapping[original] = alias
-                    else:
-                        column_mapping[col.strip()] = col.strip()
-
-                columns = column_mapping
-                if table_data:
-                    schema = self.storage_manager.get_table_schema(table_name)
-                    if query_tree.child and query_tree.child[0].type == 'limit':
-                        limit_value = int(query_tree.child[0].condition)
-                        result_data = sorted(table_data, key=lambda x: x[column_index], reverse=reverse)[:limit_value]
-                    elif query_tree.child and query_tree.child[0].type == 'sort':
-                        result_data = sorted(table_data, key=lambda x: x[column_index], reverse=reverse)
-                    else:
-                        result_data = table_data
-                    
-                else:
-                    print(f"No data found in table '{table_name}'.")
-
-            elif query_tree.type == 'table':
-                table_name = query_tree.val
-                table_data = self.storage_manager.get_table_data(table_name)
-                if table_data:
-                    schema = self.storage_manager.get_table_schema(table_name)
-                    columns = [attr[0] for attr in schema.get_metadata()]
-                    result_data = table_data
-                else:
-                    print(f"No data found in table '{table_name}'.")
+            result_data = list(operator)
+        finally:
+            operator.close()
 
-            elif query_tree.type == 'sigma':
-                table_name = query_tree.child[0].val
-                where_clause = query_tree.condition
-    
-                match = re.match(r"(\w+)\s*([=<>!]+)\s*(.+)", where_clause)
-                if match:
-                    column_name = match.group(1)
-                    operator = match.group(2)
-                    value = match.group(3)
+        return result_data, schema, columns
+
+    def open_query(self, query_tree: QueryTree, aggregation: Aggregation = None) -> Tuple[Operator, Schema, list | dict]:
+        """
+        Build the operator pipeline of a query along with the schema and columns
+        of its result, without pulling any rows. The caller must close the operator.
+        """
+        self.scan_columns = referenced_columns(query_tree) if aggregation is None else None
+        try:
+            operator = self.build_operator(query_tree)
+        finally:
+            self.scan_columns = None
+        if aggregation is not None:
+            operator = self.build_aggregate(operator, aggregation)
+
+        names = output_names(operator.columns)
+        schema = Schema([Attribute(name, col.dtype, col.size) for name, col in zip(names, operator.columns)])
+        if any(col.alias for col in operator.columns):
+            columns = {name: col.alias or name for name, col in zip(names, operator.columns)}
+        else:
+            columns = names
+
+        return operator, schema, columns
+
+    def build_operator(self, query_tree: QueryTree) -> Operator:
+        """
+        Recursively turn a query tree into a pipeline of pull-based operators.
+        Rows are only produced as the root operator is iterated.
+        """
+        node_type = query_tree.type.lower()
+
+        if self.vectorized:
+            vector_operator = self.build_vector_operator(query_tree)
+            if vector_operator is not None:
+                return BatchToRows(vector_operator)
+
+        if node_type == 'table':
+            table_name, alias = parse_table_reference(query_tree.val)
+            return self.scan_table(table_name, alias)
+
+        if node_type == 'limit':
+            top_n = self.build_top_n(query_tree)
+            if top_n is not None:
+                return top_n
+
+        if node_type in JOIN_NODE_TYPES:
+            return self.build_join(query_tree, query_tree.condition)
+
+        if node_type == 'sigma' and len(query_tree.child) == 1 and query_tree.child[0].type.lower() in JOIN_NODE_TYPES:
+            # Fold a selection over a join into the join so equality conditions become join keys
+            join_tree = query_tree.child[0]
+            condition = " AND ".join(f"({cond})" for cond in (join_tree.condition, query_tree.condition) if cond)
+            return self.build_join(join_tree, condition)
+
+        children = [self.build_operator(child) for child in query_tree.child]
+        if not children:
+            raise ValueError(f"Error: No input found under {node_type} node.")
+
+        if node_type == 'sigma':
+            return self.build_filter(children[0], query_tree.condition)
+
+        elif node_type == 'project':
+            items = parse_projection(query_tree.condition)
+            if not items:
+                return children[0]
+            if isinstance(children[0], MappedScan) and children[0].predicate is None:
+                children[0].project([children[0].column_index(name) for name, _ in items])
+            return Project(children[0], items)
+
+        elif node_type == 'sort':
+            return Sort(
+                children[0], parse_sort_keys(query_tree.condition),
+                self.sort_memory_budget, self.base_path, self.sort_stats
+            )
 
-                    print("column_name:", column_name)
-                    print("operator:", operator)
-                    print("value:", value)
+        elif node_type == 'limit':
+            return Limit(children[0], int(query_tree.condition))
 
-                    result_data = self.storage_manager.get_table_data(table_name, Condition(column_name, operator, value))
-                    schema = self.storage_manager.get_table_schema(table_name)
-                    columns = [attr[0] for attr in schema.get_metadata()]
-                else:
-                    print("Error: Invalid WHERE clause.")
-                    return [], [], {}
-                
-            elif query_tree.type == 'sort':
-                if query_tree.child and query_tree.child[0].type == 'table':
-                    table_name = query_tree.child[0].val
-                    table_data = self.storage_manager.get_table_data(table_name)
-                    if table_data:
-                        schema = self.storage_manager.get_table_schema(table_name)
-
-                        column_indices = {attr[0]: idx for idx, attr in enumerate(schema.get_metadata())}
-
-                        sort_condition = query_tree.condition.split()
-                        sort_column = sort_condition[0]
-                        sort_order = sort_condition[1].lower() if len(sort_condition) > 1 else "asc"
-
-                        if sort_column in column_indices:
-                            column_index = column_indices[sort_column]
-
-                            reverse = sort_order == "desc"
-
-                            result_data = sorted(table_data, key=lambda x: x[column_index], reverse=reverse)
-
-                            columns = [attr[0] for attr in schema.get_metadata()]
-                            print("result_data:", result_data)
-                        else:
-                            print(f"Error: Column '{sort_column}' does not exist in table '{table_name}'.")
-                    else:
-                        print(f"No data found in table '{table_name}'.")
-                else:
-                    print("Error: No valid table node found under sort node.")
+        raise ValueError(f"Error: Unsupported query tree node '{query_tree.type}'.")
 
-            return result_data, schema, columns
+    def build_aggregate(self, child: Operator, aggregation: Aggregation) -> Operator:
+        """
+        Apply GROUP BY, DISTINCT and aggregate functions on top of the rows of
+        `child`, followed by the ORDER BY and LIMIT of the query.
+        """
+        items = aggregation.items or [
+            (f"{col.table}.{col.name}" if col.table else col.name, None) for col in child.columns
+        ]
+        calls = {}
+        for expression, _ in items:
+            if isinstance(expression, AggregateCall):
+                calls.setdefault(expression.name, expression)
+
+        group_by = aggregation.group_by
+        if aggregation.distinct and not calls and not group_by:
+            group_by = [expression for expression, _ in items]
+        group_indices = [child.column_index(name) for name in group_by]
+        for expression, _ in items:
+            if not isinstance(expression, AggregateCall) and child.column_index(expression) not in group_indices:
+                raise ValueError(f"Error: Column '{expression}' must appear in the GROUP BY clause.")
+
+        operator = HashAggregate(
+            child, group_indices,
+            [
+                (call.function, None if call.argument is None else child.column_index(call.argument), call.distinct)
+                for call in calls.values()
+            ],
+            list(calls), self.aggregate_memory_budget, self.base_path, self.aggregate_stats
+        )
+        operator = Project(operator, [
+            (expression.name if isinstance(expression, AggregateCall) else expression, alias)
+            for expression, alias in items
+        ])
+
+        if aggregation.order_by and aggregation.limit is not None:
+            return TopN(operator, aggregation.order_by, aggregation.limit)
+        if aggregation.order_by:
+            operator = Sort(operator, aggregation.order_by, self.sort_memory_budget, self.base_path, self.sort_stats)
+        if aggregation.limit is not None:
+            operator = Limit(operator, aggregation.limit)
+        return operator
+
+    def build_top_n(self, limit_tree: QueryTree) -> Operator | None:
+        """
+        Fuse a limit sitting over a sort (optionally with a projection in between,
+        which keeps row order) into a single top-N operator.
+        """
+        if len(limit_tree.child) != 1:
+            return None
+        child = limit_tree.child[0]
+        project = None
+        if child.type.lower() == 'project' and len(child.child) == 1:
+            project, child = child, child.child[0]
+        if child.type.lower() != 'sort' or len(child.child) != 1:
+            return None
+
+        count = int(limit_tree.condition)
+        top_n = TopN(self.build_operator(child.child[0]), parse_sort_keys(child.condition), count)
+        if project is not None:
+            items = parse_projection(project.condition)
+            if items:
+                return Project(top_n, items)
+        return top_n
+
+    def build_vector_operator(self, query_tree: QueryTree) -> VectorOperator | None:
+        """
+        Build the vectorized pipeline for a subtree made only of table, sigma,
+        project and limit nodes. Returns None for anything else, in which case
+        the subtree runs on the row operators.
+        """
+        node_type = query_tree.type.lower()
+        if node_type == 'table':
+            table_name, alias = parse_table_reference(query_tree.val)
+            return VectorScan(self.scan_table(table_name, alias))
+
+        if node_type not in ('sigma', 'project', 'limit') or len(query_tree.child) != 1:
+            return None
+        child = self.build_vector_operator(query_tree.child[0])
+        if child is None:
+            return None
+
+        if node_type == 'sigma':
+            try:
+                return VectorFilter(child, compile_mask(parse_predicate(query_tree.condition), child.columns))
+            except ValueError:
+                return None
+        elif node_type == 'project':
+            items = parse_projection(query_tree.condition)
+            return VectorProject(child, items) if items else child
+        return VectorLimit(child, int(query_tree.condition))
+
+    def build_filter(self, child: Operator, where_clause: str) -> Operator:
+        """
+        Filter the rows of `child` with the compiled WHERE condition. On a plain
+        table scan, one comparison of a column with a literal that is ANDed with
+        the rest is answered from an index (see `choose_index`), or is
+        otherwise pushed down into the Storage Manager as a Condition. On a
+        memory-mapped scan the whole condition is evaluated inside the scan.
+        """
+        remaining = conjuncts(parse_predicate(where_clause))
+        fused = isinstance(child, MappedScan) and child.predicate is not None
+        if isinstance(child, TableScan) and child.condition is None and not fused:
+            index_scan, remaining = self.choose_index(child, remaining)
+            if index_scan is not None:
+                child = index_scan
+            elif isinstance(child, MappedScan):
+                if remaining:
+                    child.filter(combine_conjuncts(remaining))
+                return child
+            else:
+                for term in remaining:
+                    condition = storage_condition(term, child.columns)
+                    if condition is not None:
+                        child.condition = condition
+                        remaining = [other for other in remaining if other is not term]
+                        break
+
+        if not remaining:
+            return child
+        return Filter(child, compile_predicate(combine_conjuncts(remaining), child.columns))
+
+    def choose_index(self, scan: TableScan, terms: list) -> tuple[Operator | None, list]:
+        """
+        Pick an index for one term that compares an indexed column with a
+        literal. Equality on a column with a hash index is always answered by
+        a hash lookup; otherwise the first term on a B+-tree indexed column
+        that the statistics say is selective becomes an index scan. Returns
+        the index operator and the terms it does not cover.
+        """
+        for term in terms:
+            comparison = column_comparison(term, scan.columns)
+            if comparison is None or comparison[1] not in ('=', '=='):
+                continue
+            idx, _, literal = comparison
+            column = scan.columns[idx]
+            index = self.hash_indexes.find(scan.table_name, column.name)
+            if index is not None and accepts_key(index.dtype, literal.value):
+                lookup = HashLookup(self.storage_manager, self.hash_indexes, index, literal.value, column.table)
+                return lookup, [other for other in terms if other is not term]
+
+        if not self.indexes.on_table(scan.table_name):
+            return None, terms
+        stats = self.storage_manager.get_stats()
+        row_count = table_row_count(stats, scan.table_name)
+        for term in terms:
+            comparison = column_comparison(term, scan.columns)
+            if comparison is None or comparison[1] not in IndexScan.BOUNDS:
+                continue
+            idx, comparator, literal = comparison
+            column = scan.columns[idx]
+            tree = self.indexes.find(scan.table_name, column.name)
+            if tree is None:
+                continue
+            if accepts_key(tree.meta["dtype"], literal.value):
+                distinct = distinct_values(stats, scan.table_name, column.name)
+                if self.indexes.is_selective(tree, comparator, literal.value, row_count, distinct):
+                    index_scan = IndexScan(self.storage_manager, tree, scan.table_name, comparator, literal.value, column.table)
+                    return index_scan, [other for other in terms if other is not term]
+            tree.release()
+        return None, terms
+
+    def build_join(self, join_tree: QueryTree, condition: str) -> Operator:
+        """
+        Join the two inputs of a join node. Equality conditions between the inputs
+        become join keys for a hash or sort-merge join; any other condition is
+        applied as a filter on the joined rows. A natural join matches every column
+        name the inputs share and keeps only one copy of each.
+        """
+        node_type = join_tree.type.lower()
+        if len(join_tree.child) != 2:
+            raise ValueError(f"Error: {node_type} node needs exactly two inputs.")
+        left_tree, right_tree = join_tree.child
+        left = self.build_operator(left_tree)
+        right = self.build_operator(right_tree)
+
+        left_keys, right_keys, residual = [], [], []
+        if node_type == 'natural join':
+            right_names = {col.name for col in right.columns}
+            for col in left.columns:
+                if col.name in right_names:
+                    left_keys.append(left.column_index(f"{col.table}.{col.name}"))
+                    right_keys.append(right.column_index(col.name))
+
+        for term in conjuncts(parse_predicate(condition) if condition else None):
+            if (
+                isinstance(term, Compare) and term.operator in ('=', '==')
+                and isinstance(term.left, ColumnRef) and isinstance(term.right, ColumnRef)
+            ):
+                keys = find_join_keys(left, right, term.left.name, term.right.name)
+                if keys:
+                    left_keys.append(keys[0])
+                    right_keys.append(keys[1])
+                    continue
+            residual.append(term)
+
+        if left_keys:
+            joined = self.build_equi_join(left_tree, right_tree, left, right, left_keys, right_keys)
+        else:
+            joined = NestedLoopJoin(left, right)
+
+        if residual:
+            joined = Filter(joined, compile_predicate(combine_conjuncts(residual), joined.columns))
+
+        if node_type == 'natural join':
+            duplicates = {len(left.columns) + idx for idx in right_keys}
+            items = [
+                (f"{col.table}.{col.name}" if col.table else col.name, None)
+                for idx, col in enumerate(joined.columns) if idx not in duplicates
+            ]
+            return Project(joined, items)
+        return joined
+
+    def build_equi_join(self, left_tree: QueryTree, right_tree: QueryTree, left: Operator, right: Operator,
+                        left_keys: list[int], right_keys: list[int]) -> Operator:
+        """
+        Pick the join algorithm. Inputs that both come out of a sort on the join
+        keys are merged; otherwise a hash join builds on the input that the
+        Storage Manager statistics say is smaller, unless only the other input
+        is a whole table with a hash index on its join key.
+        """
+        if is_sorted_on(left, left_keys) and is_sorted_on(right, right_keys):
+            return SortMergeJoin(left, right, left_keys, right_keys, self.join_stats)
+
+        stats = self.storage_manager.get_stats()
+        build_left = self.estimate_rows(left_tree, stats) < self.estimate_rows(right_tree, stats)
+        build_table = None
+        for on_left in (build_left, not build_left):
+            build_table = self.prebuilt_join_table(*((left, left_keys) if on_left else (right, right_keys)))
+            if build_table is not None:
+                build_left = on_left
+                break
+        return HashJoin(
+            left, right, left_keys, right_keys, build_left,
+            self.join_memory_budget, self.base_path, self.join_stats, build_table=build_table
+        )
+
+    def prebuilt_join_table(self, operator: Operator, keys: list[int]) -> JoinBuckets | None:
+        """
+        The buckets of the hash index on the join key when `operator` reads a
+        whole table, so a hash join can probe them instead of building its own.
+        A scan with a condition, a fused WHERE or a projection does not qualify.
+        """
+        if not isinstance(operator, TableScan) or not operator.is_full_scan() or len(keys) != 1:
+            return None
+        index = self.hash_indexes.find(operator.table_name, operator.columns[keys[0]].name)
+        return None if index is None else self.hash_indexes.join_table(index)
 
-        except Exception as e:
-            print(f"Error executing query: {e}")
-            return [], [], {}
+    def estimate_rows(self, query_tree: QueryTree, stats) -> int:
+        """
+        Estimate how many rows a subtree produces from the table row counts.
+        """
+        node_type = query_tree.type.lower()
+        if node_type == 'table':
+            table_name, _ = parse_table_reference(query_tree.val)
+            return table_row_count(stats, table_name)
+
+        estimates = [self.estimate_rows(child, stats) for child in query_tree.child] or [0]
+        if node_type == 'limit':
+            return min(int(query_tree.condition), estimates[0])
+        if node_type in JOIN_NODE_TYPES:
+            return max(estimates)
+        return estimates[0]
 
     def get_table_names(self, query_tree: QueryTree) -> list[str]:
         """
@@ -1,14 +1,17 @@
+import copy
+
 from QueryExecutor import QueryExecutor
-from utils.query import get_query_type
+from utils.query import get_query_type, PreparedStatement
 
 class QueryProcessor:
-    def __init__(self, base_path: str):
+    def __init__(self, base_path: str, **executor_options):
         self.base_path = base_path
-        self.query_executor = QueryExecutor(base_path)
+        self.query_executor = QueryExecutor(base_path, **executor_options)
 
-    def process_query(self, query: str):
+    def process_query(self, query: str, stream: bool = False):
         """
         Process the query by determining its type and delegating execution.
+        With `stream`, a SELECT returns a cursor over its rows instead of a list.
         """
         try:
             query_type = get_query_type(query)
@@ -31,17 +34,23 @@ class QueryProcessor:
                     self.query_executor.failed_queries.remove(ops)
             
             if query_type == "SELECT":
-                success = self.query_executor.execute_select(query)
+                success = self.query_executor.execute_select(query, stream)
             elif query_type == "INSERT":
                 success = self.query_executor.execute_insert(query)
             elif query_type == "CREATE":
                 success = self.query_executor.execute_create(query)
+            elif query_type == "CREATE INDEX":
+                success = self.query_executor.execute_create_index(query)
             elif query_type == "UPDATE":
                 success = self.query_executor.execute_update(query)
             elif query_type == "DELETE":
                 success = self.query_executor.execute_delete(query)
             elif query_type == "DROP":
                 success = self.query_executor.execute_drop(query)
+            elif query_type == "DROP INDEX":
+                success = self.query_executor.execute_drop_index(query)
+            elif query_type == "COPY":
+                success = self.query_executor.execute_copy(query)
             elif query_type == "BEGIN TRANSACTION":
                 self.query_executor.execute_begin_transaction()
                 success = True
@@ -74,3 +83,49 @@ class QueryProcessor:
         except Exception as e:
             print(f"Error processing query: {e}")
             return False
+
+    def open_session(self) -> "QueryProcessor":
+        """
+        A processor for one client connection. Sessions share the database,
+        caches and log, but each has its own transaction state, so concurrent
+        clients no longer mix up transaction IDs and failed queries. Conflicting
+        statements are serialized by table locks instead.
+        """
+        session = copy.copy(self)
+        session.query_executor = self.query_executor.clone()
+        return session
+
+    def close(self):
+        """
+        Release the locks still held by this session. Closing the processor
+        the sessions were opened from also stops its background threads.
+        """
+        self.query_executor.close()
+
+    def copy_from(self, table_name: str, rows) -> int:
+        """
+        Bulk insert rows of strings, e.g. from csv.reader, into a table. Returns the number of rows inserted.
+        """
+        return self.query_executor.copy_from(table_name, rows)
+
+    def prepare(self, query: str) -> PreparedStatement:
+        """
+        Parse a query with `?` placeholders once, for repeated execution.
+        """
+        return self.query_executor.prepare(query)
+
+    def execute_prepared(self, statement: PreparedStatement, parameters: list, stream: bool = False):
+        """
+        Execute a prepared statement. The parameters are bound as values into
+        the statement parsed by `prepare`, never into its text, and SELECTs
+        reuse the cached plan of the statement. Statements of other types
+        take no parameters and are processed as text.
+        """
+        statement.check_parameters(parameters)
+        if statement.query_type not in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+            return self.process_query(statement.query, stream)
+        try:
+            return self.query_executor.execute_prepared(statement, parameters, stream)
+        except Exception as e:
+            print(f"Error processing query: {e}")
+            return False
@@ -1,81 +1,339 @@
 #Server.py
-import socket
-import threading
+import asyncio
+import itertools
 import struct
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 
 from QueryProcessor import QueryProcessor
 from utils.result import ExecutionResult, get_execution_result
+from utils.cursor import Cursor
+from utils.protocol import (
+    PREPARE, EXECUTE, ERROR, OPEN, FETCH, CLOSE, DONE, HELLO, BATCH, RESULT, PING, TEXT_FORMAT, BINARY_FORMAT,
+    decode_message, decode_execute, decode_count, decode_values, encode_message, encode_prepared,
+    encode_schema, encode_rows, encode_count, encode_result_body, encode_results
+)
 
 SERVER_PORT = 5371
 BASE_PATH = "./Storage_Manager/storage"
 # BASE_PATH = "./db-test"
-HEADER_SIZE = 4
+HEADER_SIZE = 8
+WORKER_COUNT = 4
+MAX_IN_FLIGHT = 64
+PIPELINE_DEPTH = 128
+CURSOR_BATCH_SIZE = 1024
+BUSY_MESSAGE = "Error: Server is busy, try again later."
+
+@dataclass
+class ServerStats:
+    connections: int = 0
+    queries: int = 0
+    rejected: int = 0
+    peak_in_flight: int = 0
+
+@dataclass
+class Connection:
+    session: QueryProcessor
+    statements: dict = field(default_factory=dict)
+    cursor: Cursor | None = None
+    result_format: int = BINARY_FORMAT
+
+    def close_cursor(self) -> int:
+        cursor, self.cursor = self.cursor, None
+        if cursor is None:
+            return 0
+        cursor.close()
+        return cursor.rows_fetched
+
+    def close(self):
+        self.close_cursor()
+        self.session.close()
 
 class Server:
-    def __init__(self):
+    def __init__(self, workers: int = WORKER_COUNT, max_in_flight: int = MAX_IN_FLIGHT,
+                 reject_when_busy: bool = False, base_path: str = BASE_PATH):
         self.clients = {}
+        self.client_ids = itertools.count(1)
         self.host = "localhost"
         self.port = SERVER_PORT
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.query_processor = QueryProcessor(BASE_PATH)
+        self.query_processor = QueryProcessor(base_path)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query")
+        self.max_in_flight = max_in_flight
+        self.reject_when_busy = reject_when_busy
+        self.in_flight = 0
+        self.admission = None
+        self.stats = ServerStats()
 
     def start(self):
-        self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen()
-        print(">>> KawulaSQL Server is running at localhost:" + str(SERVER_PORT))
-
-        while True:
-            client_socket, address = self.server_socket.accept()
-            client_id = len(self.clients) + 1
-            self.clients[client_id] = client_socket
-            print(f"New client connected: Client {client_id} at {address}")
-            
-            thread = threading.Thread(target=self.serve_client, args=(client_id, client_socket))
-            thread.start()
-
-    def send(self, conn, msg):
-        msg_length = struct.pack('>I', len(msg))
-        conn.sendall(msg_length + msg)
-
-    def receive(self, conn) -> str:
-        header = conn.recv(HEADER_SIZE)
-        if not header:
-            raise RuntimeError("Socket connection broken during header reception")
-        msg_length = struct.unpack('>I', header)[0]
-        chunks = []
-        bytes_recd = 0
-        while bytes_recd < msg_length:
-            chunk = conn.recv(min(msg_length - bytes_recd, 2048))  # Receive in chunks
-            if not chunk:
-                raise RuntimeError("Socket connection broken during data reception")
-            chunks.append(chunk)
-            bytes_recd += len(chunk)
-        return b''.join(chunks).decode()
-
-
-    def serve_client(self, client_id, client_socket):
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.query_processor.close()
+
+    async def serve(self):
+        self.admission = asyncio.Semaphore(self.max_in_flight)
+        server = await asyncio.start_server(self.serve_client, self.host, self.port)
+        print(">>> KawulaSQL Server is running at localhost:" + str(self.port))
+        async with server:
+            await server.serve_forever()
+
+    async def send(self, writer, request_id: int, msg):
+        header = struct.pack('>II', len(msg), request_id)
+        writer.write(header + msg)
+        await writer.drain()
+
+    async def receive_frame(self, reader) -> tuple[int, bytes] | None:
+        """
+        Read one frame as (request ID, payload), or return None when the client closed the connection.
+        """
+        try:
+            header = await reader.readexactly(HEADER_SIZE)
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                raise RuntimeError("Socket connection broken during header reception")
+            return None
+        msg_length, request_id = struct.unpack('>II', header)
+        try:
+            return request_id, await reader.readexactly(msg_length)
+        except asyncio.IncompleteReadError:
+            raise RuntimeError("Socket connection broken during data reception")
+
+    async def serve_client(self, reader, writer):
+        """
+        Read the requests of a connection as they arrive, up to PIPELINE_DEPTH
+        ahead of the one being executed, so a client can pipeline requests
+        instead of waiting for each response.
+        """
+        client_id = next(self.client_ids)
+        self.clients[client_id] = writer
+        self.stats.connections += 1
+        print(f"New client connected: Client {client_id} at {writer.get_extra_info('peername')}")
+
+        connection = Connection(self.query_processor.open_session())
+        requests = asyncio.Queue(maxsize=PIPELINE_DEPTH)
+        responder = asyncio.create_task(self.answer_requests(writer, requests, connection))
         try:
             while True:
-                query_request = self.receive(client_socket)
-                try:
-                    result = self.query_processor.process_query(query_request)
-                    if isinstance(result, ExecutionResult):
-                        try:
-                            response = get_execution_result(result)
-                            self.send(client_socket, response.encode())
-                        except Exception as e:
-                            print(f"Error while sending to client: {str(e)}")
-                    else:
-                        print("Unexpected result type.")
-                except Exception as e:
-                    print(f"Error processing query: {str(e)}")
+                request = await self.receive_frame(reader)
+                if request is None:
+                    break
+                await requests.put(request)
         except ConnectionResetError:
-            print(f"Client {client_id} disconnected")
+            pass
         except Exception as e:
-            print(f"Error while receiving from client: {str(e)}")
+            print(f"Error while serving client {client_id}: {str(e)}")
         finally:
-            client_socket.close()
+            await requests.put(None)
+            await responder
+            print(f"Client {client_id} disconnected")
             del self.clients[client_id]
+            writer.close()
+            await asyncio.get_running_loop().run_in_executor(self.executor, connection.close)
+
+    async def answer_requests(self, writer, requests: asyncio.Queue, connection: Connection):
+        """
+        Execute the requests of one connection in the order they were sent and
+        write their responses tagged with their request IDs. After a write
+        fails, the remaining requests are drained without being executed.
+        """
+        failed = False
+        while (request := await requests.get()) is not None:
+            if failed:
+                continue
+            request_id, frame = request
+            try:
+                async for response in self.dispatch(frame, connection):
+                    await self.send(writer, request_id, response)
+            except Exception as e:
+                print(f"Error while answering client: {str(e)}")
+                failed = True
+                writer.close()
+
+    async def dispatch(self, frame: bytes, connection: Connection):
+        """
+        Run one request on the worker pool and yield its response frames as they
+        are produced. At most `max_in_flight` requests are admitted at a time.
+        Past that, a request either waits for a slot, which stops reading from
+        its connection, or is rejected right away when the server was started
+        with `reject_when_busy`.
+        """
+        if decode_message(frame) == (PING, b''):
+            # Liveness checks bypass admission and the worker pool
+            yield encode_message(PING)
+            return
+        if self.reject_when_busy and self.admission.locked():
+            self.stats.rejected += 1
+            yield self.busy_response(frame)
+            return
+
+        async with self.admission:
+            self.in_flight += 1
+            self.stats.queries += 1
+            self.stats.peak_in_flight = max(self.stats.peak_in_flight, self.in_flight)
+            try:
+                loop = asyncio.get_running_loop()
+                responses = self.handle_frame(frame, connection)
+                while (response := await loop.run_in_executor(self.executor, next, responses, None)) is not None:
+                    yield response
+            finally:
+                self.in_flight -= 1
+
+    def busy_response(self, frame: bytes) -> bytes:
+        if decode_message(frame) is not None:
+            return encode_message(ERROR, BUSY_MESSAGE.encode())
+        return BUSY_MESSAGE.encode()
+
+    def handle_frame(self, frame: bytes, connection: Connection):
+        """
+        Execute a SQL query or protocol message, yielding its response frames.
+        Each step runs on a worker thread. A query that cannot be decoded, or
+        whose result cannot be encoded, is answered with ERROR like a failing
+        message, so the requests pipelined behind it still run.
+        """
+        message = decode_message(frame)
+        if message is not None:
+            yield from self.handle_message(*message, connection)
+            return
+        try:
+            response = self.format_result(self.process_query(frame.decode(), connection), connection)
+        except Exception as e:
+            print(f"Error handling query: {str(e)}")
+            response = encode_message(ERROR, f"Error: {e}".encode())
+        yield response
+
+    def process_query(self, query: str, connection: Connection):
+        try:
+            return connection.session.process_query(query)
+        except Exception as e:
+            print(f"Error processing query: {str(e)}")
+            return False
+
+    def format_result(self, result, connection: Connection) -> bytes:
+        """
+        Encode an execution result in the format negotiated by the connection:
+        the binary format, or the text table printed by the REPL. Every request
+        gets a response, including those without an ExecutionResult.
+        """
+        if connection.result_format == BINARY_FORMAT:
+            return encode_message(RESULT, self.encode_execution_result(result))
+        if isinstance(result, ExecutionResult):
+            return get_execution_result(result).encode()
+        return f"Status: {'success' if result else 'error'}\n".encode()
+
+    def encode_execution_result(self, result) -> bytes:
+        if not isinstance(result, ExecutionResult):
+            return encode_result_body("success" if result else "error", "UNKNOWN", None, 0, [], [])
+        data = result.new_data
+        columns, rows, rows_count = [], [], 0
+        if isinstance(data, int):
+            rows_count = data
+        elif data is not None:
+            rows, rows_count = data.data, data.rows_count
+            if hasattr(data.schema, "get_metadata"):
+                metadata = data.schema.get_metadata()
+                aliases = list(data.columns.values()) if isinstance(data.columns, dict) else [name for name, _, _ in metadata]
+                columns = [(alias, dtype, size) for alias, (_, dtype, size) in zip(aliases, metadata)]
+        return encode_result_body(result.status, result.type, result.transaction_id, rows_count, columns, rows)
+
+    def execute_batch(self, queries: list[str], connection: Connection) -> bytes:
+        """
+        Execute the statements of a batch in order and combine their results
+        into one response. Every statement gets its own status: one that fails,
+        or whose result cannot be encoded, is reported as an error and the
+        statements after it still run.
+        """
+        binary = connection.result_format == BINARY_FORMAT
+        encode = self.encode_execution_result if binary else lambda result: self.format_result(result, connection)
+        responses = []
+        for query in queries:
+            try:
+                responses.append(encode(self.process_query(query, connection)))
+            except Exception as e:
+                print(f"Error processing query: {str(e)}")
+                responses.append(encode(False))
+        return encode_results(responses) if binary else b"\n".join(responses)
+
+    def handle_message(self, kind: int, body: bytes, connection: Connection):
+        """
+        Handle a protocol message. HELLO selects the result format of the
+        connection. Statement handles are numbered per connection and stay valid
+        until the connection closes. A connection has at most one
+        open cursor; opening another closes the previous one. A malformed body
+        or a failing statement is answered with ERROR, so the requests
+        pipelined behind it still run.
+        """
+        try:
+            if kind == PREPARE:
+                statement = connection.session.prepare(body.decode())
+                handle = len(connection.statements) + 1
+                connection.statements[handle] = statement
+                yield encode_prepared(handle, statement.parameter_count)
+            elif kind == EXECUTE:
+                handle, parameters = decode_execute(body)
+                if handle not in connection.statements:
+                    raise ValueError(f"Error: Unknown statement handle {handle}.")
+                result = connection.session.execute_prepared(connection.statements[handle], parameters)
+                yield self.format_result(result, connection)
+            elif kind == BATCH:
+                queries, _ = decode_values(body)
+                yield self.execute_batch(queries, connection)
+            elif kind == HELLO:
+                if body not in (bytes([TEXT_FORMAT]), bytes([BINARY_FORMAT])):
+                    raise ValueError("Error: Unsupported result format.")
+                connection.result_format = body[0]
+                yield encode_message(HELLO, body)
+            elif kind == OPEN:
+                connection.close_cursor()
+                yield self.open_cursor(body.decode(), connection)
+            elif kind == FETCH:
+                yield from self.fetch(decode_count(body), connection)
+            elif kind == CLOSE:
+                yield encode_count(DONE, connection.close_cursor())
+            else:
+                raise ValueError(f"Error: Unknown message kind {kind}.")
+        except ValueError as e:
+            yield encode_message(ERROR, str(e).encode())
+        except struct.error as e:
+            yield encode_message(ERROR, f"Error: Malformed message body: {e}".encode())
+        except Exception as e:
+            print(f"Error handling message: {str(e)}")
+            yield encode_message(ERROR, f"Error: {e}".encode())
+
+    def open_cursor(self, query: str, connection: Connection) -> bytes:
+        """
+        Run a SELECT without collecting its rows and answer with the schema of the result.
+        """
+        result = connection.session.process_query(query, stream=True)
+        if not isinstance(result, ExecutionResult) or result.cursor is None:
+            raise ValueError(f"Error: Query '{query}' cannot be opened as a cursor.")
+        connection.cursor = result.cursor
+        columns = result.new_data.columns
+        aliases = list(columns.values()) if isinstance(columns, dict) else columns
+        return encode_schema([
+            (alias, dtype, size)
+            for alias, (_, dtype, size) in zip(aliases, result.new_data.schema.get_metadata())
+        ])
+
+    def fetch(self, count: int, connection: Connection):
+        """
+        Send up to `count` rows of the open cursor in frames of CURSOR_BATCH_SIZE
+        rows. The response ends with DONE once the cursor is exhausted and
+        with an empty ROWS frame while it is still open, so the client reads
+        it to its end without counting rows.
+        """
+        cursor = connection.cursor
+        if cursor is None:
+            raise ValueError("Error: No open cursor.")
+        remaining = count
+        while remaining > 0 and not cursor.done:
+            rows = cursor.fetch(min(remaining, CURSOR_BATCH_SIZE))
+            remaining -= len(rows)
+            if rows:
+                yield encode_rows(rows)
+        if cursor.done:
+            yield encode_count(DONE, connection.close_cursor())
+        else:
+            yield encode_rows([])
 
 if __name__ == "__main__":
     server = Server()
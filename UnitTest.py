@@ -1,9 +1,24 @@
 import unittest
 import shutil
+import os
 import sys
 import io
+import itertools
+import re
+import struct
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
 
 from QueryProcessor import QueryProcessor
+from Server import Server, Connection
+from Client import ClientPool
+from utils import protocol
+from utils.bulk_load import COPY_BATCH_SIZE, PartialLoadError
+from utils.mapped_scan import MappedScan
+from utils.predicate import parse_predicate
+from utils.table_file import TableFormatError, decode_rows, read_header, table_path
 
 class SuppressPrints:
     def __enter__(self):
@@ -29,7 +44,19 @@ class TestQuery(unittest.TestCase):
             "SELECT * FROM student LIMIT 100;",
             "SELECT * FROM student WHERE total_cred >= 500;", 
             "SELECT * FROM student WHERE id < 100;", 
+            "SELECT * FROM student WHERE id < 10;",
+            "SELECT SQL_NO_CACHE * FROM student LIMIT 5;",
             "SELECT * FROM student ORDER BY total_cred;",
+            "SELECT id, name FROM student WHERE total_cred >= 100 ORDER BY total_cred DESC LIMIT 5;",
+            "SELECT name AS n FROM student LIMIT 3;",
+            "SELECT id, name FROM student ORDER BY dept_name ASC, total_cred DESC LIMIT 10;",
+            "SELECT * FROM student, department WHERE student.dept_name = department.dept_name;",
+            "SELECT name, building FROM student, department WHERE student.dept_name = department.dept_name AND total_cred > 100;",
+            "SELECT COUNT(*) FROM student;",
+            "SELECT dept_name, COUNT(*) AS n, AVG(total_cred) FROM student GROUP BY dept_name ORDER BY n DESC LIMIT 3;",
+            "SELECT DISTINCT dept_name FROM student;",
+            "SELECT * FROM student WHERE total_cred >= 100 AND (dept_name = 'Physics' OR id IN (1, 2, 3));",
+            "SELECT name FROM student WHERE name LIKE 'J%' AND total_cred BETWEEN 80 AND 120;",
         ]
 
         self.write_case = [
@@ -37,11 +64,14 @@ class TestQuery(unittest.TestCase):
             "UPDATE student SET age = age * 2 WHERE age <= 18;",
 
             "CREATE TABLE test1 (int int, float float, char char, varchar varchar(250));",
+            "CREATE INDEX test1_int ON test1 (int);",
 
             "INSERT INTO test1 VALUES (1, 1.5, 'aaa', 'bbb');",
+            "INSERT INTO test1 VALUES (2, 2.5, 'c', 'd, e'), (3, 3.5, 'f', 'g');",
 
             "DELETE FROM test1;",
 
+            "DROP INDEX test1_int;",
             "DROP TABLE test1;",
         ]
 
@@ -54,15 +84,19 @@ class TestQuery(unittest.TestCase):
             "SELECT * FROM WHERE total_cred >= 500;", 
             "SELECT * FROM student, none;",
             "SELECT * FROM student AS s, lecturer AS s WHERE s.id = s.id;", 
-            "SELECT name FROM student ORDER BY;"
+            "SELECT name, COUNT(*) FROM student GROUP BY dept_name;",
+            "SELECT name FROM student ORDER BY;",
 
             "CREATE TABLE test2;",
 
             "INSERT INTO student;",
 
+            "COPY student FROM 'missing.csv';",
+
             "DELETE student;",
 
             "DROP FROM student;",
+            "DROP INDEX none;",
         ]
 
     def tearDown(self):
@@ -89,5 +123,394 @@ class TestQuery(unittest.TestCase):
 
                 self.assertTrue(result.status == "error", f"Expected False from query: {query}")
 
+def plan(node_type, val="", condition="", child=()):
+    """A query tree node, for plans the optimizer would produce."""
+    return SimpleNamespace(type=node_type, val=val, condition=condition, child=list(child))
+
+class TestExecutor(unittest.TestCase):
+    def setUp(self):
+        shutil.copytree('./db-test', 'db-test-copy', dirs_exist_ok=True)
+        self.base_path = "./db-test-copy"
+
+    def tearDown(self):
+        shutil.rmtree('./db-test-copy', ignore_errors=True)
+
+    def execute(self, query_tree, **options):
+        executor = QueryProcessor(self.base_path, **options).query_executor
+        with SuppressPrints():
+            rows, _, _ = executor.execute_query(query_tree)
+        return sorted(map(str, rows)), executor
+
+    def test_filtered_scan_is_not_joined_through_hash_index(self):
+        query_tree = plan("join", condition="student.dept_name = department.dept_name", child=[
+            plan("sigma", condition="student.total_cred > 100", child=[plan("table", "student")]),
+            plan("table", "department"),
+        ])
+        expected, _ = self.execute(query_tree)
+        for mmap_scans in (False, True):
+            rows, executor = self.execute(query_tree, hash_indexes=["student.dept_name"], mmap_scans=mmap_scans)
+            self.assertEqual(rows, expected)
+            self.assertEqual(executor.join_stats.prebuilt_joins, 0)
+
+    def copy(self, query_processor, lines):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+            f.write("id,name,dept_name,total_cred\n" + "".join(line + "\n" for line in lines))
+        self.addCleanup(os.remove, f.name)
+        with SuppressPrints():
+            return query_processor.process_query(f"COPY student FROM '{f.name}' HEADER;")
+
+    def count(self, query_processor, where=""):
+        with SuppressPrints():
+            return query_processor.process_query(f"SELECT id FROM student{where};").new_data.rows_count
+
+    def test_copy_with_a_bad_line_loads_nothing(self):
+        query_processor = QueryProcessor(self.base_path)
+        before = self.count(query_processor)
+        # The bad line comes after a full batch of good ones
+        lines = [f"{i},s{i},Physics,10" for i in range(100, 100 + COPY_BATCH_SIZE)] + ["99,s,Physics,ten"]
+        result = self.copy(query_processor, lines)
+        self.assertEqual(result.status, "error")
+        self.assertEqual(result.new_data.rows_count, 0)
+        self.assertEqual(self.count(query_processor), before)
+
+    def test_copy_past_its_memory_budget_loads_every_row_once(self):
+        query_processor = QueryProcessor(self.base_path, copy_memory_budget=1)
+        before = self.count(query_processor)
+        result = self.copy(query_processor, [f"{i},s{i},Physics,10" for i in range(100, 110)])
+        self.assertEqual((result.status, result.new_data.rows_count), ("success", 10))
+        self.assertEqual(self.count(query_processor), before + 10)
+        # The COPY is logged and committed as a transaction of its own
+        self.assertEqual(query_processor.query_executor.qcc.wal.get_metrics()["active_transactions"], 0)
+
+    def test_copy_from_reports_a_partial_load(self):
+        executor = QueryProcessor(self.base_path).query_executor
+        with SuppressPrints(), self.assertRaises(PartialLoadError) as raised:
+            executor.copy_from("student", [["100", "a", "Physics", "10"], ["101", "b", "Physics", "ten"]], batch_size=1)
+        self.assertEqual(raised.exception.rows_loaded, 1)
+
+    def test_copy_stores_quotes_as_insert_does(self):
+        query_processor = QueryProcessor(self.base_path)
+        result = self.copy(query_processor, ["100,O'Brien,Physics,10"])
+        self.assertEqual((result.status, result.new_data.rows_count), ("success", 1))
+        self.assertEqual(self.count(query_processor, " WHERE name = 'O''Brien'"), 1)
+
+    def test_prepared_statements_bind_any_string(self):
+        query_processor = QueryProcessor(self.base_path)
+        insert = query_processor.prepare("INSERT INTO student VALUES (?, ?, 'Physics', ?);")
+        update = query_processor.prepare("UPDATE student SET name = ? WHERE id = ?;")
+        select = query_processor.prepare("SELECT id FROM student WHERE name = ?;")
+        delete = query_processor.prepare("DELETE FROM student WHERE name = ?;")
+        with SuppressPrints():
+            self.assertEqual(query_processor.execute_prepared(insert, [100, "O'Brien", 10]).status, "success")
+            self.assertEqual(query_processor.execute_prepared(select, ["O'Brien"]).new_data.data, [[100]])
+            self.assertEqual(query_processor.execute_prepared(update, ["Smith, Jane\nJr", 100]).status, "success")
+            self.assertEqual(query_processor.execute_prepared(select, ["O'Brien"]).new_data.data, [])
+            self.assertEqual(query_processor.execute_prepared(select, ["Smith, Jane\nJr"]).new_data.data, [[100]])
+            self.assertEqual(query_processor.execute_prepared(delete, ["Smith, Jane\nJr"]).status, "success")
+        self.assertEqual(query_processor.query_executor.plan_cache.stats.misses, 1)
+        self.assertEqual(self.count(query_processor, " WHERE id = 100"), 0)
+
+class UndoLog:
+    """A Failure Recovery Manager that rolls back the rows INSERTed by a transaction."""
+    def __init__(self):
+        self.records = []
+
+    def write_log(self, record):
+        self.records.append(record)
+
+    def recover(self, transaction_id):
+        return [
+            re.sub(r"INSERT INTO (\w+) VALUES \((\d+),.*", r"DELETE FROM \1 WHERE id = \2;", record.query)
+            for record in reversed(self.records)
+            if record.transaction_id == transaction_id and record.type == "INSERT"
+        ]
+
+class TestLocks(unittest.TestCase):
+    def setUp(self):
+        shutil.copytree('./db-test', 'db-test-copy', dirs_exist_ok=True)
+        self.query_processor = QueryProcessor("./db-test-copy", lock_timeout=0.2)
+
+    def tearDown(self):
+        shutil.rmtree('./db-test-copy', ignore_errors=True)
+
+    def test_lock_timeout_aborts_the_transaction(self):
+        a, b = self.query_processor.open_session(), self.query_processor.open_session()
+        executor = a.query_executor
+        with SuppressPrints():
+            a.process_query("BEGIN TRANSACTION;")
+            a.process_query("UPDATE student SET total_cred = 5 WHERE id = 1;")
+            b.process_query("BEGIN TRANSACTION;")
+            b.process_query("DELETE FROM department WHERE dept_name = 'Nowhere';")
+            result = a.process_query("SELECT * FROM department;")
+        self.assertEqual(result.status, "error")
+        self.assertFalse(executor.qcc.is_transacting)
+        self.assertEqual(executor.lock_manager.held_by(executor.session_id), {})
+
+        # b can now read the table a was writing
+        with SuppressPrints():
+            result = b.process_query("SELECT * FROM student;")
+        self.assertEqual(result.status, "success")
+
+    def test_aborted_writes_are_not_published(self):
+        query_processor = QueryProcessor("./db-test-copy", lock_timeout=0.2, snapshot_isolation=True, gc_interval=None)
+        a, b = query_processor.open_session(), query_processor.open_session()
+        query = "SELECT total_cred FROM student WHERE id = 1;"
+        with SuppressPrints():
+            before = b.process_query(query).new_data.data
+            a.process_query("BEGIN TRANSACTION;")
+            a.process_query("UPDATE student SET total_cred = 5 WHERE id = 1;")
+            b.process_query("BEGIN TRANSACTION;")
+            b.process_query("DELETE FROM department WHERE dept_name = 'Nowhere';")
+            a.process_query("SELECT * FROM department;")
+            after = b.process_query(query).new_data.data
+        self.assertNotEqual(before, [[5]])
+        self.assertEqual(after, before)
+
+    def test_autocommit_writes_are_published(self):
+        query_processor = QueryProcessor("./db-test-copy", snapshot_isolation=True, gc_interval=None)
+        a, b = query_processor.open_session(), query_processor.open_session()
+        query = "SELECT id, total_cred FROM student WHERE id <= 2;"
+        with SuppressPrints():
+            b.process_query(query)
+            a.process_query("UPDATE student SET total_cred = 5 WHERE id = 1;")
+            a.process_query("DELETE FROM student WHERE id = 2;")
+            rows = b.process_query(query).new_data.data
+        self.assertEqual(rows, [[1, 5]])
+
+    def test_sessions_get_unique_transaction_ids(self):
+        ccm = self.query_processor.query_executor.qcc.ccm
+        begin_transaction, given = ccm.begin_transaction, []
+        def record():
+            transact_id = begin_transaction()
+            given.append(transact_id)
+            return transact_id
+        ccm.begin_transaction = record
+        sessions = [self.query_processor.open_session() for _ in range(4)]
+        seen = [[] for _ in sessions]
+        def run(session, ids):
+            for table in ("student", "department") * 10:
+                session.process_query(f"SELECT * FROM {table};")
+                ids.append(session.query_executor.qcc.transact_id)
+        threads = [threading.Thread(target=run, args=pair) for pair in zip(sessions, seen)]
+        with SuppressPrints():
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(given), 4 * 20)
+        self.assertEqual(len(set(given)), len(given))
+        self.assertEqual(sorted(itertools.chain.from_iterable(seen)), sorted(given))
+
+    def test_abort_rolls_back_every_statement(self):
+        session = self.query_processor.open_session()
+        session.query_executor.qcc.wal.frm = UndoLog()
+        query = "SELECT id FROM student WHERE id >= 100;"
+        with SuppressPrints():
+            session.process_query("BEGIN TRANSACTION;")
+            session.process_query("INSERT INTO student VALUES (100, 'a', 'Physics', 10);")
+            session.process_query("INSERT INTO student VALUES (101, 'b', 'Physics', 10);")
+            self.assertEqual(session.process_query(query).new_data.rows_count, 2)
+            session.query_executor.abort_transaction()
+            self.assertEqual(session.process_query(query).new_data.data, [])
+
+    def test_closing_the_processor_stops_the_gc_thread(self):
+        query_processor = QueryProcessor("./db-test-copy", snapshot_isolation=True, gc_interval=0.01)
+        gc_thread = query_processor.query_executor.version_store.gc_thread
+        query_processor.open_session().close()
+        self.assertTrue(gc_thread.is_alive())
+        query_processor.close()
+        self.assertFalse(gc_thread.is_alive())
+
+    def test_closing_a_session_aborts_its_transaction(self):
+        session = self.query_processor.open_session()
+        executor = session.query_executor
+        with SuppressPrints():
+            session.process_query("BEGIN TRANSACTION;")
+            session.process_query("UPDATE student SET total_cred = 5 WHERE id = 1;")
+            session.close()
+        self.assertFalse(executor.qcc.is_transacting)
+        self.assertEqual(executor.lock_manager.held_by(executor.session_id), {})
+
+class TestMappedScan(unittest.TestCase):
+    def setUp(self):
+        shutil.copytree('./db-test', 'db-test-copy', dirs_exist_ok=True)
+        self.base_path = "./db-test-copy"
+        self.query_processor = QueryProcessor(self.base_path)
+        self.storage_manager = self.query_processor.query_executor.storage_manager
+        with open(table_path(self.base_path, "information_schema"), "rb") as f:
+            data = f.read()
+        self.tables = [row[0] for row in decode_rows(data, read_header(data))]
+
+    def tearDown(self):
+        shutil.rmtree('./db-test-copy', ignore_errors=True)
+
+    def scan(self, table, base_path=None):
+        return MappedScan(self.storage_manager, base_path or self.base_path, table)
+
+    def test_rows_match_storage_manager(self):
+        for table in self.tables:
+            expected = self.storage_manager.get_table_data(table)
+            self.assertEqual(list(self.scan(table)), expected, table)
+
+            last = len(expected[0]) - 1
+            scan = self.scan(table)
+            scan.project([last, 0])
+            self.assertEqual(list(scan), [[row[0], row[last]] for row in expected], table)
+
+    def test_filtered_rows_match_storage_manager(self):
+        for table in self.tables:
+            expected = self.storage_manager.get_table_data(table)
+            for idx, column in enumerate(self.scan(table).columns):
+                value = expected[-1][idx]
+                matching = [row for row in expected if row[idx] == value]
+
+                scan = self.scan(table)
+                scan.filter(parse_predicate(f"{column.name} = {value}"))
+                self.assertEqual(list(scan), matching, (table, column.name))
+
+                other = (idx + 1) % len(expected[0])
+                scan = self.scan(table)
+                scan.project([idx, other])
+                scan.filter(parse_predicate(f"{column.name} = {value}"))
+                self.assertEqual(
+                    list(scan), [[row[min(idx, other)], row[max(idx, other)]] for row in matching], (table, column.name)
+                )
+                self.assertEqual(scan.stats.filtered, len(expected) - len(matching))
+
+    def test_select_matches_plain_scans(self):
+        mapped = QueryProcessor(self.base_path, mmap_scans=True)
+        with SuppressPrints():
+            for query in ["SELECT id, name FROM student WHERE total_cred >= 100;", "SELECT * FROM department;"]:
+                self.assertEqual(
+                    mapped.process_query(query).new_data.data,
+                    self.query_processor.process_query(query).new_data.data, query
+                )
+        metrics = mapped.query_executor.get_metrics()["mapped_scans"]
+        self.assertEqual((metrics["scans"], metrics["fallbacks"]), (2, 0))
+
+    def test_falls_back_on_missing_file_and_bad_header(self):
+        expected = self.storage_manager.get_table_data("student")
+        with tempfile.TemporaryDirectory() as directory:
+            scan = self.scan("student", directory)
+            self.assertEqual(list(scan), expected)
+            with open(table_path(directory, "student"), "wb") as f:
+                f.write(b"\0" * 64)
+            self.assertEqual(list(scan), expected)
+        self.assertEqual(scan.stats.fallbacks, 2)
+
+    def test_damaged_row_block_raises(self):
+        with open(table_path(self.base_path, "student"), "rb") as f:
+            data = bytearray(f.read())
+        data[read_header(data).data_start] = ord("X")
+        with tempfile.TemporaryDirectory() as directory:
+            with open(table_path(directory, "student"), "wb") as f:
+                f.write(data)
+            with self.assertRaises(TableFormatError):
+                list(self.scan("student", directory))
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        shutil.copytree('./db-test', 'db-test-copy', dirs_exist_ok=True)
+        self.server = Server(workers=1, base_path="./db-test-copy")
+        self.connection = Connection(self.server.query_processor.open_session())
+
+    def tearDown(self):
+        self.connection.close()
+        self.server.executor.shutdown()
+        shutil.rmtree('./db-test-copy', ignore_errors=True)
+
+    def request(self, kind, body=b""):
+        frame = protocol.encode_message(kind, body)
+        with SuppressPrints():
+            return [protocol.decode_message(reply) for reply in self.server.handle_frame(frame, self.connection)]
+
+    def test_malformed_body_is_answered_with_error(self):
+        for kind in (protocol.EXECUTE, protocol.FETCH):
+            (reply,) = self.request(kind, b"\x00")
+            self.assertEqual(reply[0], protocol.ERROR)
+
+    def test_failing_query_is_answered_with_error(self):
+        with SuppressPrints():
+            (reply,) = self.server.handle_frame(b"SELECT \xff;", self.connection)
+            self.assertEqual(protocol.decode_message(reply)[0], protocol.ERROR)
+            self.server.format_result = lambda result, connection: 1 / 0
+            (reply,) = self.server.handle_frame(b"SELECT id FROM student;", self.connection)
+        self.assertEqual(protocol.decode_message(reply), (protocol.ERROR, b"Error: division by zero"))
+
+    def test_fetch_always_answers(self):
+        (reply,) = self.request(protocol.OPEN, b"SELECT id FROM student;")
+        self.assertEqual(reply[0], protocol.SCHEMA)
+        (reply,) = self.request(protocol.FETCH, struct.pack(">I", 0))
+        self.assertEqual((reply[0], protocol.decode_rows(reply[1])), (protocol.ROWS, []))
+        replies = self.request(protocol.FETCH, struct.pack(">I", 9))
+        self.assertEqual([len(protocol.decode_rows(body)) for _, body in replies], [9, 0])
+        replies = self.request(protocol.FETCH, struct.pack(">I", 1000))
+        self.assertEqual([kind for kind, _ in replies], [protocol.ROWS, protocol.DONE])
+        self.assertEqual(len(protocol.decode_rows(replies[0][1])), 40)
+
+    def test_batch_reports_each_statement(self):
+        queries = ["SELECT id FROM student WHERE id = 1;", "SELECT * FROM none;", "SELECT id FROM student WHERE id = 2;"]
+        (reply,) = self.request(protocol.BATCH, protocol.encode_values(queries))
+        results = protocol.decode_results(reply[1])
+        self.assertEqual([result.status for result in results], ["success", "error", "success"])
+        self.assertEqual([result.rows for result in results], [[[1]], [], [[2]]])
+
+class TestClientPool(unittest.TestCase):
+    port = 5471
+
+    @classmethod
+    def setUpClass(cls):
+        shutil.copytree('./db-test', 'db-test-pool', dirs_exist_ok=True)
+        cls.server = Server(workers=2, base_path="./db-test-pool")
+        cls.server.port = cls.port
+        threading.Thread(target=cls.server.start, daemon=True).start()
+        time.sleep(0.3)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree('./db-test-pool', ignore_errors=True)
+
+    def test_concurrent_requests(self):
+        pool = ClientPool(port=self.port, min_size=1, max_size=3)
+        results, threads = [], []
+        def work():
+            for id in (1, 2, 3, 5, 6):
+                results.append(pool.execute("SELECT id FROM student WHERE id = ?;", [id]).rows)
+        with SuppressPrints():
+            threads = [threading.Thread(target=work) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        metrics = pool.get_metrics()
+        pool.close()
+
+        self.assertEqual(sorted(results), sorted([[id]] for id in (1, 2, 3, 5, 6) for _ in range(8)))
+        self.assertEqual(metrics["acquisitions"], 40)
+        self.assertEqual(metrics["connections_opened"], metrics["size"])
+        self.assertLessEqual(metrics["size"], 3)
+        self.assertEqual(metrics["in_use"], 0)
+
+    def test_fetch_reads_its_whole_response(self):
+        pool = ClientPool(port=self.port, min_size=0, max_size=1)
+        client = pool.acquire()
+        with SuppressPrints():
+            client.open_cursor("SELECT id FROM student;")
+            self.assertEqual(len(client.fetch(49)), 49)
+            self.assertEqual(client.fetch(10), [])
+        self.assertFalse(any(client.pending.values()))
+        pool.release(client)
+        pool.close()
+
+    def test_acquire_timeout(self):
+        pool = ClientPool(port=self.port, min_size=0, max_size=1)
+        client = pool.acquire()
+        with self.assertRaises(TimeoutError):
+            pool.acquire(timeout=0.05)
+        pool.release(client)
+        self.assertIs(pool.acquire(timeout=0.05), client)
+        self.assertEqual(pool.get_metrics()["acquire_timeouts"], 1)
+        pool.close()
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
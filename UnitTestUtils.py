@@ -0,0 +1,754 @@
+import io
+import os
+import shutil
+import threading
+import time
+import unittest
+import tempfile
+from contextlib import redirect_stdout
+from datetime import datetime
+from types import SimpleNamespace
+
+from utils.btree import BPlusTree
+from utils.buffer_pool import BufferPool, BufferedStorage, FileChangedError
+from utils.bulk_load import StagedBatches, coerce_batches
+from utils.cursor import Cursor
+from utils.group_commit import GroupCommitLog
+from utils.hash_index import HashIndexCatalog
+from utils.indexes import IndexCatalog
+from utils.locks import DeadlockError, LockError, LockManager, EXCLUSIVE, SHARED
+from utils.models import ExecutionResult
+from utils.mvcc import RowChange, VersionStore
+from utils.operators import (
+    AggregateStats, Column, HashAggregate, HashJoin, JoinStats, Limit, Operator, Sort, SortMergeJoin, SortStats,
+    TopN
+)
+from utils.plan_cache import PlanCache, normalize_query
+from utils.predicate import compile_predicate, parse_predicate
+from utils.protocol import (
+    RESULT, decode_message, decode_result, decode_values, encode_result, encode_values
+)
+from utils.query import extract_aggregation, prepare_statement
+from utils.result_cache import ResultCache
+from utils.spill import SpillFile
+from utils.table_file import TableFormatError, decode_chunks, decode_rows, read_header
+from utils import vectorized
+
+class Values(Operator):
+    """A table of rows given in the test."""
+    def __init__(self, names, rows, table="t", types=None):
+        super().__init__([Column(table, name, dtype) for name, dtype in zip(names, types or [None] * len(names))])
+        self.rows = rows
+
+    def __iter__(self):
+        return iter([list(row) for row in self.rows])
+
+class Table:
+    """A Storage Manager holding one table in memory."""
+    def __init__(self, metadata, rows):
+        self.metadata = metadata
+        self.rows = rows
+
+    def get_table_schema(self, table_name):
+        return SimpleNamespace(get_metadata=lambda: self.metadata)
+
+    def get_table_data(self, table_name, condition=None):
+        return [list(row) for row in self.rows]
+
+class TestSpillFile(unittest.TestCase):
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            spill_file = SpillFile(directory)
+            rows = [[i, f"'{i}'", None] for i in range(2500)]
+            spill_file.write_all(rows)
+            self.assertEqual(spill_file.rows_written, 2500)
+            self.assertGreater(spill_file.bytes_written, 0)
+            self.assertEqual(list(spill_file), rows)
+            self.assertEqual(list(spill_file), rows)
+            spill_file.close()
+            self.assertFalse(os.path.exists(spill_file.path))
+
+class TestTopN(unittest.TestCase):
+    def test_top_n_and_limit(self):
+        rows = [[i % 5, i] for i in range(20)]
+        self.assertEqual(list(TopN(Values(["k", "v"], rows), [("k", True), ("v", False)], 3)), [[4, 4], [4, 9], [4, 14]])
+        self.assertEqual(list(Limit(Values(["k", "v"], rows), 2)), rows[:2])
+
+class TestJoins(unittest.TestCase):
+    def setUp(self):
+        self.left = [[i % 10, f"l{i}"] for i in range(100)] + [[None, "l-null"]]
+        self.right = [[i, f"r{i}"] for i in range(0, 20, 2)] + [[2, "r2b"], [None, "r-null"]]
+        self.expected = sorted(l + r for l in self.left for r in self.right if l[0] is not None and l[0] == r[0])
+
+    def join(self, **options):
+        stats = JoinStats()
+        operator = HashJoin(Values(["k", "a"], self.left, "l"), Values(["k", "b"], self.right, "r"), [0], [0],
+                            stats=stats, **options)
+        try:
+            return sorted(operator), stats
+        finally:
+            operator.close()
+
+    def test_hash_join(self):
+        for build_left in (False, True):
+            rows, stats = self.join(build_left=build_left)
+            self.assertEqual(rows, self.expected)
+            self.assertEqual((stats.hash_joins, stats.partitions_spilled), (1, 0))
+
+    def test_spilled_hash_join(self):
+        with tempfile.TemporaryDirectory() as directory:
+            rows, stats = self.join(memory_budget=1, spill_dir=directory, partitions=4)
+            self.assertEqual(rows, self.expected)
+            self.assertEqual(stats.partitions_spilled, 8)
+            self.assertGreater(stats.bytes_written, 0)
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_prebuilt_build_table(self):
+        table = {}
+        for row in self.right:
+            if row[0] is not None:
+                table.setdefault((row[0],), []).append(row)
+        rows, stats = self.join(build_table=table)
+        self.assertEqual(rows, self.expected)
+        self.assertEqual(stats.prebuilt_joins, 1)
+
+    def test_sort_merge_join(self):
+        left = sorted((row for row in self.left if row[0] is not None), key=lambda row: row[0])
+        right = sorted(self.right, key=lambda row: (row[0] is not None, row[0]))
+        stats = JoinStats()
+        rows = list(SortMergeJoin(Values(["k", "a"], left, "l"), Values(["k", "b"], right, "r"), [0], [0], stats))
+        self.assertEqual(sorted(rows), self.expected)
+        self.assertEqual(stats.merge_joins, 1)
+
+class TestHashAggregate(unittest.TestCase):
+    calls = [("COUNT", None, False), ("SUM", 1, False), ("AVG", 1, False), ("MIN", 1, False),
+             ("MAX", 1, False), ("COUNT", 1, True)]
+    names = ["count", "sum", "avg", "min", "max", "distinct"]
+
+    def setUp(self):
+        self.rows = [[f"'g{i % 7}'", i % 3] for i in range(140)] + [["'g0'", None]]
+
+    def expected(self):
+        groups = {}
+        for key, value in self.rows:
+            groups.setdefault(key, []).append(value)
+        result = []
+        for key, values in groups.items():
+            present = [value for value in values if value is not None]
+            result.append([key, len(values), sum(present), sum(present) / len(present), min(present), max(present),
+                           len(set(present))])
+        return sorted(result)
+
+    def aggregate(self, rows, group_indices, **options):
+        stats = AggregateStats()
+        operator = HashAggregate(Values(["g", "v"], rows, types=["varchar", "int"]), group_indices, self.calls,
+                                 self.names, stats=stats, **options)
+        try:
+            return sorted(operator), stats
+        finally:
+            operator.close()
+
+    def test_groups(self):
+        rows, stats = self.aggregate(self.rows, [0])
+        self.assertEqual(rows, self.expected())
+        self.assertEqual((stats.aggregations, stats.groups, stats.partitions_spilled), (1, 7, 0))
+
+    def test_spilled_groups(self):
+        with tempfile.TemporaryDirectory() as directory:
+            rows, stats = self.aggregate(self.rows, [0], memory_budget=1, spill_dir=directory, partitions=4)
+        self.assertEqual(rows, self.expected())
+        self.assertGreater(stats.partitions_spilled, 0)
+        self.assertEqual(stats.groups, 7)
+
+    def test_empty_input_without_group_by(self):
+        rows, _ = self.aggregate([], [])
+        self.assertEqual(rows, [[0, None, None, None, None, 0]])
+
+class TestExtractAggregation(unittest.TestCase):
+    def test_keywords_inside_literals(self):
+        query, aggregation = extract_aggregation(
+            "SELECT dept_name, COUNT(*) FROM student WHERE name = 'x GROUP BY y' GROUP BY dept_name LIMIT 2;"
+        )
+        self.assertEqual(query, "SELECT * FROM student WHERE name = 'x GROUP BY y';")
+        self.assertEqual((aggregation.group_by, aggregation.limit), (["dept_name"], 2))
+        query = "SELECT name FROM student WHERE name = 'a GROUP BY b ORDER BY c LIMIT 1';"
+        self.assertEqual(extract_aggregation(query), (query, None))
+
+class TestSort(unittest.TestCase):
+    def setUp(self):
+        self.spill_dir = tempfile.TemporaryDirectory()
+        # Keys repeat so that the stability of the merge shows in the payload order
+        self.rows = [[i % 7, i] for i in range(64)]
+
+    def tearDown(self):
+        self.spill_dir.cleanup()
+
+    def sort(self, max_fan_in):
+        stats = SortStats()
+        operator = Sort(Values(["k", "v"], self.rows), [("k", False)], 1, self.spill_dir.name, stats, max_fan_in)
+        return list(operator), stats
+
+    def test_in_memory(self):
+        rows = list(Sort(Values(["k", "v"], self.rows), [("k", False)]))
+        self.assertEqual(rows, sorted(self.rows, key=lambda row: row[0]))
+
+    def test_spilled_merge_passes(self):
+        # A budget of one byte spills every row as its own run: 64 runs
+        rows, single_pass = self.sort(64)
+        self.assertEqual(rows, sorted(self.rows, key=lambda row: row[0]))
+        self.assertEqual((single_pass.runs_spilled, single_pass.merge_passes), (64, 1))
+
+        # 64 runs with a fan-in of 4 take two passes (64 -> 16 -> 4) and the final merge
+        rows, stats = self.sort(4)
+        self.assertEqual(rows, sorted(self.rows, key=lambda row: row[0]))
+        self.assertEqual((stats.runs_spilled, stats.merge_passes), (64 + 16 + 4, 3))
+        # Each pass rewrites the input once: no more than the initial runs per pass
+        self.assertLessEqual(stats.bytes_written, 3 * single_pass.bytes_written)
+
+class TestBulkLoad(unittest.TestCase):
+    attributes = [("id", "int", 4), ("name", "varchar", 10), ("gpa", "float", 4)]
+
+    def test_batches(self):
+        rows = [[str(i), f"s{i}", "3.5"] for i in range(5)] + [["5", "O'Brien", "4"]]
+        batches = list(coerce_batches(rows, self.attributes, batch_size=4))
+        self.assertEqual([len(batch) for batch in batches], [4, 2])
+        self.assertEqual(batches[0][0], [0, "'s0'", 3.5])
+        # Stored the way INSERT stores it, which is what WHERE name = 'O''Brien' matches
+        self.assertEqual(batches[1][1], [5, "'O'Brien'", 4.0])
+
+    def test_bad_lines(self):
+        cases = [
+            ([["1", "a", "1.0"], ["x", "b", "1.0"]], "line 3"),
+            ([["1", "a", "1.0"], ["2", "b"]], "Line 3"),
+            ([["1", "a" * 11, "1.0"]], "line 2"),
+        ]
+        for rows, line in cases:
+            with self.assertRaisesRegex(ValueError, line):
+                list(coerce_batches(rows, self.attributes, first_line=2))
+
+    def test_staged_batches_spill_past_the_budget(self):
+        rows = [[str(i), f"s{i}", "3.5"] for i in range(10)]
+        expected = list(coerce_batches(rows, self.attributes, batch_size=4))
+        with tempfile.TemporaryDirectory() as directory:
+            for budget, spilled in ((1 << 20, False), (1, True)):
+                with StagedBatches(coerce_batches(rows, self.attributes, batch_size=4), budget, directory) as staged:
+                    self.assertEqual(staged.spilled, spilled)
+                    self.assertEqual(list(staged), expected)
+            self.assertEqual(os.listdir(directory), [])
+
+class LineLog:
+    """A Failure Recovery Manager that appends one line per record."""
+    def __init__(self, path):
+        self.path = path
+        self.reopened = 0
+
+    def write_log(self, record):
+        with open(self.path, "a") as f:
+            f.write(f"{record.transaction_id} {record.type}\n")
+
+    def reopen(self):
+        self.reopened += 1
+
+    def recover(self, transaction_id):
+        return []
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "wal.log")
+        self.archive = os.path.join(directory.name, "archive")
+        open(self.path, "w").close()
+        self.frm = LineLog(self.path)
+        self.log = GroupCommitLog(self.frm, self.path, checkpoint_interval=None, archive_dir=self.archive)
+        self.addCleanup(self.log.close)
+
+    def write(self, transaction_id, record_type):
+        self.log.write_log(ExecutionResult(transaction_id, datetime.now(), record_type, "success", record_type, None, None))
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_cut_keeps_active_transactions(self):
+        self.write(1, "INSERT")
+        self.write(1, "COMMIT")
+        self.write(2, "INSERT")
+        self.log.checkpoint()
+        self.assertEqual(self.read(self.path), "2 INSERT\n")
+        self.assertEqual(self.read(os.path.join(self.archive, "wal.1.log")), "1 INSERT\n1 COMMIT\n")
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+        self.assertEqual(self.frm.reopened, 1)
+
+        # Records appended after the cut land in the new log
+        self.write(2, "COMMIT")
+        self.assertEqual(self.read(self.path), "2 INSERT\n2 COMMIT\n")
+
+    def test_open_transaction_is_reported(self):
+        self.write(1, "INSERT")
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.log.checkpoint()
+            self.log.checkpoint()
+        self.assertEqual(output.getvalue(), "")
+        metrics = self.log.get_metrics()
+        self.assertEqual((metrics["pinning_transaction"], metrics["pinned_bytes"]), (1, len("1 INSERT\n")))
+        self.assertEqual(metrics["pinned_checkpoints"], 2)
+
+    def test_log_is_not_cut_without_reopen(self):
+        self.frm.reopen = None
+        self.write(1, "INSERT")
+        self.write(1, "COMMIT")
+        self.log.checkpoint()
+        self.assertEqual(self.read(self.path), "1 INSERT\n1 COMMIT\n")
+        self.assertEqual(self.log.get_metrics()["uncut_checkpoints"], 1)
+
+    def test_recover_rolls_back_every_statement_newest_first(self):
+        self.frm.recover = lambda transaction_id: [f"undo {transaction_id}"]
+        self.write(1, "INSERT")
+        self.write(3, "UPDATE")
+        self.write(4, "DELETE")
+        self.assertEqual(self.log.recover(4, [1, 2, 3, 4]), ["undo 4", "undo 3", "undo 1"])
+        self.assertEqual(self.log.get_metrics()["active_transactions"], 0)
+        self.assertEqual(self.log.recover(5, [5]), [])
+
+    def test_failed_checkpoint_is_reported(self):
+        def fail():
+            raise ValueError("no space")
+        log = GroupCommitLog(self.frm, self.path, checkpoint_interval=0.01)
+        log.checkpoint = fail
+        self.addCleanup(log.close)
+        deadline = time.monotonic() + 5
+        while not log.get_metrics()["failed_checkpoints"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(log.writer.is_alive())
+        self.assertEqual(log.get_metrics()["last_checkpoint_error"], "ValueError: no space")
+
+class TestVersionStore(unittest.TestCase):
+    def setUp(self):
+        self.store = VersionStore(gc_interval=None)
+        self.store.load("student", [[1, 10], [2, 20]])
+        self.store.load("department", [["a"]])
+
+    def test_commit_is_published_at_one_timestamp(self):
+        before = self.store.begin_snapshot()
+        self.store.publish({
+            "student": [
+                RowChange(rows=[[3, 30]]),
+                RowChange(lambda row: row[0] == 1, {1: 11}),
+                RowChange(lambda row: row[0] == 2),
+            ],
+            "department": [RowChange(rows=[["b"]])],
+        })
+        after = self.store.begin_snapshot()
+        self.assertEqual(after, before + 1)
+        self.assertEqual(self.store.read("student", before), [[1, 10], [2, 20]])
+        self.assertEqual(sorted(self.store.read("student", after)), [[1, 11], [3, 30]])
+        self.assertEqual(self.store.read("department", after), [["a"], ["b"]])
+
+    def test_row_written_twice_in_a_commit(self):
+        self.store.publish({"student": [RowChange(rows=[[3, 30]]), RowChange(lambda row: row[0] == 3, {1: 31})]})
+        self.assertEqual(sorted(self.store.read("student", self.store.begin_snapshot())), [[1, 10], [2, 20], [3, 31]])
+
+    def test_reload(self):
+        self.store.publish({}, {"student": [[2, 20], [4, 40]]})
+        self.assertEqual(sorted(self.store.read("student", self.store.begin_snapshot())), [[2, 20], [4, 40]])
+
+class TestBPlusTree(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        meta = {"name": "t_k", "table": "t", "column": "k", "position": 0, "dtype": "int"}
+        self.rows = [[key, f"'{key}'"] for key in range(200)]
+        BPlusTree.build(os.path.join(self.directory, "t_k.idx"), [(row[0], row) for row in self.rows], meta, order=4).close()
+        self.catalog = IndexCatalog(self.directory, None)
+
+    def test_range(self):
+        tree = self.catalog.find("t", "k")
+        self.assertEqual(list(tree.range(10, 12)), self.rows[10:13])
+        self.assertEqual(list(tree.range(high=2, high_inclusive=False)), self.rows[:2])
+        self.assertEqual(tree.bounds(), (0, 199))
+        tree.release()
+
+    def test_scan_outlives_a_rebuild(self):
+        tree = self.catalog.find("t", "k")
+        scan = tree.range()
+        first = next(scan)
+        rebuilt = self.catalog.compact(tree)
+        self.assertIsNot(self.catalog.find("t", "k"), tree)
+        self.assertEqual([first, *scan], self.rows)
+        tree.release()
+        with self.assertRaises(OSError):
+            os.fstat(tree.fd)
+        rebuilt.release()
+
+    def test_inserts_and_compaction(self):
+        tree = self.catalog.find("t", "k")
+        for key in range(200, 300):
+            tree.insert_many([(key, [key, f"'{key}'"])], order=4)
+        grown = tree.size
+        self.assertEqual(list(tree.range()), [[key, f"'{key}'"] for key in range(300)])
+        compacted = self.catalog.compact(tree)
+        tree.release()
+        self.assertLess(compacted.size, grown)
+        self.assertEqual(list(compacted.range()), [[key, f"'{key}'"] for key in range(300)])
+
+        # The header names the new root after a reopen
+        reopened = BPlusTree(compacted.path)
+        self.assertEqual((reopened.count, reopened.dirty), (300, False))
+        reopened.close()
+
+    def test_remove_where(self):
+        tree = self.catalog.find("t", "k")
+        removed = tree.remove_where(lambda row: row[0] % 3 == 0, low=30, high=120)
+        self.assertEqual(removed, [row for row in self.rows if 30 <= row[0] <= 120 and row[0] % 3 == 0])
+        # Whole leaves and subtrees are dropped
+        self.assertEqual(len(tree.remove_where(lambda row: row[0] < 100)), 100 - len(range(30, 100, 3)))
+        expected = [row for row in self.rows[100:] if not (row[0] <= 120 and row[0] % 3 == 0)]
+        self.assertEqual((list(tree.range()), tree.count), (expected, len(expected)))
+        self.assertEqual(list(tree.range(150, 152)), self.rows[150:153])
+        self.assertEqual(tree.bounds(), (100, 199))
+        tree.insert_many([(5, [5, "'5'"])], order=4)
+        self.assertEqual(list(tree.range(high=101)), [[5, "'5'"], *self.rows[100:102]])
+        self.assertEqual(len(tree.remove_where(lambda row: True)), len(expected) + 1)
+        self.assertEqual((list(tree.range()), tree.bounds()), ([], (None, None)))
+        tree.release()
+
+    def test_updates_and_deletes_are_maintained(self):
+        storage = Table([("k", "int", 4), ("v", "varchar", 10)], self.rows)
+        catalog = IndexCatalog(self.directory, storage)
+        catalog.delete_rows("t", "k >= 190 OR v = '3'")
+        catalog.update_rows("t", {"k": "500"}, "k = 7")
+        tree = catalog.find("t", "k")
+        self.assertEqual(list(tree.range(500, 500)), [[500, "'7'"]])
+        self.assertEqual([row[0] for row in tree.range(low=185)], [185, 186, 187, 188, 189, 500])
+        self.assertEqual(list(tree.range(3, 3)), [])
+        self.assertFalse(tree.dirty)
+        tree.release()
+
+    def test_dirty_index_is_rebuilt_in_the_background(self):
+        storage = Table([("k", "int", 4), ("v", "varchar", 10)], self.rows[:10])
+        catalog = IndexCatalog(self.directory, storage)
+        catalog.update_rows("t", {"k": "k + 1"}, "k = 1")
+        self.assertIsNone(catalog.find("t", "k"))
+        rebuild = catalog.rebuilding.get("t_k")
+        if rebuild is not None:
+            rebuild.join()
+        tree = catalog.find("t", "k")
+        self.assertEqual(list(tree.range()), self.rows[:10])
+        tree.release()
+
+class TestBufferPool(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.path = os.path.join(self.directory, "pages")
+        with open(self.path, "wb") as f:
+            f.write(b"a" * 16 + b"b" * 16 + b"c" * 4)
+
+    def version(self, path):
+        status = os.stat(path)
+        return status.st_mtime_ns, status.st_size
+
+    def test_hits_and_eviction(self):
+        pool = BufferPool(3, page_size=16)
+        self.assertEqual(list(pool.scan_file(self.path)), [b"a" * 16, b"b" * 16, b"c" * 4])
+        list(pool.scan_file(self.path))
+        self.assertEqual((pool.stats.hits, pool.stats.misses), (3, 3))
+
+        # A scan pins a window of pages at a time, so a file larger than the pool goes through it
+        small = BufferPool(2, page_size=16)
+        self.assertEqual(len(list(small.scan_file(self.path))), 3)
+        self.assertEqual((len(small), small.stats.evictions), (2, 1))
+        self.assertEqual(small.get_metrics()["pinned"], 0)
+
+        # Pages beyond a pool full of pinned frames are read without being kept
+        frames = small.pin_pages(self.path, self.version(self.path), 0, 3)
+        self.assertEqual([frame.data for frame in frames], [b"a" * 16, b"b" * 16, b"c" * 4])
+        self.assertEqual(len(small), 2)
+        small.unpin(frames)
+
+    def test_page_is_read_outside_the_pool_lock(self):
+        pool = BufferPool(3, page_size=16)
+        version = self.version(self.path)
+        with pool.lock:
+            pool.versions[self.path] = version
+            frame, reserved = pool.pin(self.path, 0)
+        self.assertTrue(reserved)
+        pinned = []
+        reader = threading.Thread(target=lambda: pinned.append(pool.pin_pages(self.path, version, 0, 3)))
+        reader.start()
+        # The reader waits on the latch of the reserved frame, not on the pool lock
+        reader.join(0.2)
+        self.assertTrue(reader.is_alive())
+        pool.load([frame], self.path)
+        reader.join()
+        self.assertIs(pinned[0][0], frame)
+        self.assertEqual(frame.data, b"a" * 16)
+
+    def test_table_is_decoded_page_by_page(self):
+        shutil.copy(os.path.join("db-test", "student_table.bin"), self.directory)
+        with open(os.path.join(self.directory, "student_table.bin"), "rb") as f:
+            data = f.read()
+        expected = decode_rows(data, read_header(data))
+        for size in (1, 7, 64, len(data)):
+            chunks = [data[start:start + size] for start in range(0, len(data), size)]
+            self.assertEqual(list(decode_chunks(chunks)), expected)
+        with self.assertRaises(TableFormatError):
+            list(decode_chunks([data[:read_header(data).data_end - 1]]))
+
+        storage = BufferedStorage(None, self.directory, BufferPool(2, page_size=64))
+        self.assertEqual(storage.read_table("student"), expected)
+        self.assertEqual(storage.read_table("student", lambda row: row[0] == expected[1][0]), [expected[1]])
+        self.assertEqual(storage.pool.get_metrics()["pinned"], 0)
+        self.assertLessEqual(len(storage.pool), 2)
+
+        # A write while the pages are read makes the read go to the Storage Manager
+        scan = storage.pool.scan_file(os.path.join(self.directory, "student_table.bin"))
+        next(scan)
+        storage.pool.mark_dirty(os.path.join(self.directory, "student_table.bin"))
+        with self.assertRaises(FileChangedError):
+            list(scan)
+
+@unittest.skipUnless(vectorized.is_available(), "NumPy is not installed")
+class TestVectorized(unittest.TestCase):
+    def test_matches_the_row_engine(self):
+        rows = [[i, f"'n{i % 4}'", None if i % 5 == 0 else i / 2] for i in range(50)]
+        names, types = ["id", "name", "score"], ["int", "varchar", "float"]
+        condition = "t.id > 10 AND (t.name = 'n1' OR t.score IS NULL)"
+        source = Values(names, rows, types=types)
+        expected = [row for row in rows if compile_predicate(parse_predicate(condition), source.columns)(row)]
+
+        scan = vectorized.VectorScan(source, batch_size=7)
+        filtered = vectorized.VectorFilter(scan, vectorized.compile_mask(parse_predicate(condition), scan.columns))
+        projected = vectorized.VectorProject(filtered, [("t.id", None), ("t.score", "s")])
+        result = list(vectorized.BatchToRows(vectorized.VectorLimit(projected, 5)))
+        self.assertEqual(result, [[row[0], row[2]] for row in expected][:5])
+        self.assertEqual(projected.columns[1].alias, "s")
+
+class TestPlanCache(unittest.TestCase):
+    def tree(self, condition):
+        return SimpleNamespace(type="sigma", val="", condition=condition,
+                               child=[SimpleNamespace(type="table", val="student", condition="", child=[])])
+
+    def test_normalize(self):
+        self.assertEqual(
+            normalize_query("select  name from student where id = 3 and name = 'A b';"),
+            ("SELECT name FROM student WHERE id = ? AND name = ?", ("3", "'A b'"))
+        )
+
+    def test_rebinds_literals(self):
+        cache = PlanCache(2)
+        rows = {"student": 100}
+        template, literals = normalize_query("SELECT * FROM student WHERE id = 3;")
+        cache.put(template, literals, self.tree("student.id = 3"), ["student"], rows.get)
+        cache.note_write("student")
+        bound = cache.get(*normalize_query("SELECT * FROM student WHERE id = 7;"), rows.get)
+        self.assertEqual(bound.condition, "student.id = 7")
+        self.assertIsNotNone(cache.get(*normalize_query("SELECT * FROM student WHERE id = 8;"), None))
+        self.assertEqual(bound.child[0].val, "student")
+        self.assertEqual((cache.stats.hits, cache.stats.misses, cache.stats.drift_checks), (2, 0, 1))
+
+    def test_invalidation_and_eviction(self):
+        cache = PlanCache(2, stats_tolerance=0.5)
+        rows = {"student": 1000, "department": 10}
+        for query, table in [("SELECT * FROM student;", "student"), ("SELECT * FROM department;", "department")]:
+            cache.put(*normalize_query(query), self.tree(""), [table], rows.get)
+        rows["student"] = 2000
+        # Without a write the row counts are not read again
+        self.assertIsNotNone(cache.get(*normalize_query("SELECT * FROM student;"), None))
+        cache.note_write("student")
+        self.assertIsNone(cache.get(*normalize_query("SELECT * FROM student;"), rows.get))
+        self.assertEqual((cache.stats.invalidations, cache.stats.drift_checks), (1, 1))
+        cache.invalidate("DEPARTMENT")
+        self.assertEqual(len(cache), 0)
+        for i in range(3):
+            cache.put(*normalize_query(f"SELECT * FROM t{i};"), self.tree(""), [f"t{i}"], lambda table: 0)
+        self.assertEqual((len(cache), cache.stats.evictions), (2, 1))
+
+class TestCursor(unittest.TestCase):
+    def test_fetch_and_close(self):
+        closed = []
+        cursor = Cursor(iter(range(5)), lambda: closed.append(True))
+        self.assertEqual(cursor.fetch(2), [0, 1])
+        self.assertEqual(cursor.fetch(2), [2, 3])
+        self.assertFalse(cursor.done)
+        self.assertEqual(cursor.fetch(2), [4])
+        self.assertTrue(cursor.done)
+        self.assertEqual(cursor.fetch(2), [])
+        cursor.close()
+        self.assertEqual((cursor.rows_fetched, closed), (5, [True]))
+
+class TestGroupCommit(unittest.TestCase):
+    def test_concurrent_records_share_a_sync(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "wal.log")
+            log = GroupCommitLog(LineLog(path), path, window=0.05, checkpoint_interval=None)
+            writers = [
+                threading.Thread(target=log.write_log, args=(
+                    ExecutionResult(i, datetime.now(), "INSERT", "success", "INSERT", None, None),
+                )) for i in range(8)
+            ]
+            for writer in writers:
+                writer.start()
+            for writer in writers:
+                writer.join()
+            log.close()
+            metrics = log.get_metrics()
+            with open(path) as f:
+                self.assertEqual(len(f.readlines()), 8)
+        self.assertEqual(metrics["records"], 8)
+        self.assertEqual(metrics["fsyncs"], metrics["groups"])
+        self.assertLess(metrics["groups"], 8)
+        self.assertEqual(metrics["active_transactions"], 8)
+        with self.assertRaises(RuntimeError):
+            log.write_log(ExecutionResult(9, datetime.now(), "INSERT", "success", "INSERT", None, None))
+
+class TestLockManager(unittest.TestCase):
+    def test_shared_and_exclusive(self):
+        locks = LockManager(timeout=0.1)
+        locks.acquire(1, "student", SHARED)
+        locks.acquire(2, "student", SHARED)
+        with self.assertRaises(LockError):
+            locks.acquire(1, "student", EXCLUSIVE)
+        locks.release_all(2)
+        locks.acquire(1, "student", EXCLUSIVE)
+        self.assertEqual(locks.held_by(1), {"student": EXCLUSIVE})
+        self.assertEqual(locks.stats.timeouts, 1)
+
+    def test_deadlock(self):
+        locks = LockManager(timeout=5)
+        locks.acquire(1, "a", EXCLUSIVE)
+        locks.acquire(2, "b", EXCLUSIVE)
+        waiter = threading.Thread(target=locks.acquire, args=(1, "b", EXCLUSIVE))
+        waiter.start()
+        while 1 not in locks.waiting:
+            time.sleep(0.01)
+        with self.assertRaises(DeadlockError):
+            locks.acquire(2, "a", SHARED)
+        locks.release_all(2)
+        waiter.join()
+        self.assertEqual(locks.held_by(1), {"a": EXCLUSIVE, "b": EXCLUSIVE})
+        self.assertEqual((locks.stats.deadlocks, locks.stats.waits), (1, 1))
+
+class TestHashIndex(unittest.TestCase):
+    def setUp(self):
+        self.storage = Table([("id", "int", 4), ("dept", "varchar", 10)],
+                             [[1, "'a'"], [2, "'b'"], [3, "'a'"]])
+        self.catalog = HashIndexCatalog(self.storage, ["student.dept"])
+
+    def test_lookup_and_maintenance(self):
+        index = self.catalog.find("student", "dept")
+        self.assertEqual(self.catalog.lookup(index, "a"), [[1, "'a'"], [3, "'a'"]])
+        self.catalog.insert_rows("student", [["4", "'b'"]])
+        self.assertEqual(self.catalog.lookup(index, "b"), [[2, "'b'"], [4, "'b'"]])
+        self.catalog.update_rows("student", {"dept": "'c'"}, "id = 2")
+        self.assertEqual(self.catalog.lookup(index, "c"), [[2, "'c'"]])
+        self.catalog.delete_rows("student", "dept = 'a'")
+        self.assertEqual(self.catalog.lookup(index, "a"), [])
+        self.assertEqual(self.catalog.get_stats()["indexes"]["student.dept"]["rows"], 2)
+
+    def test_expression_update_resets_the_index(self):
+        index = self.catalog.find("student", "dept")
+        self.catalog.update_rows("student", {"id": "id + 1"}, "id = 1")
+        self.assertFalse(index.built)
+        self.assertEqual((self.catalog.stats.builds, self.catalog.stats.invalidations), (1, 1))
+
+    def test_join_table_probes_the_live_buckets(self):
+        index = self.catalog.find("student", "dept")
+        table = self.catalog.join_table(index)
+        self.catalog.insert_rows("student", [[5, "'a'"]])
+        matches = table.get(("a",))
+        self.assertEqual(matches, [[1, "'a'"], [3, "'a'"], [5, "'a'"]])
+        matches.clear()
+        self.assertEqual(len(self.catalog.lookup(index, "a")), 3)
+        self.assertIsNone(table.get(("z",)))
+
+        # A reset while the join runs leaves it the buckets it started with
+        self.catalog.update_rows("student", {"id": "id + 1"}, "id = 1")
+        self.assertEqual(len(table.get(("a",))), 3)
+
+class TestPreparedStatement(unittest.TestCase):
+    def test_render(self):
+        statement = prepare_statement("SELECT * FROM student WHERE name = ? AND id = ? AND dept_name <> '?';")
+        self.assertEqual(statement.parameter_count, 2)
+        self.assertEqual(
+            statement.render(["O'Brien, Jane", 2]),
+            "SELECT * FROM student WHERE name = 'O''Brien, Jane' AND id = 2 AND dept_name <> '?';"
+        )
+        with self.assertRaises(ValueError):
+            statement.check_parameters(["Jane"])
+
+    def test_writes_bind_values_into_the_parsed_statement(self):
+        insert = prepare_statement("INSERT INTO student VALUES (?, ?, 'Physics', ?);")
+        self.assertEqual(insert.bind_rows([1, "O'Brien", None]), [["1", "'O'Brien'", "'Physics'", "NULL"]])
+
+        update = prepare_statement("UPDATE student SET name = ?, total_cred = 3 WHERE id = ? AND name = ?;")
+        self.assertEqual(update.bind_assignments(["Smith, Jane", 1, "a\nb"]), {"name": "'Smith, Jane'", "total_cred": "3"})
+        where = compile_predicate(update.bind_where(["Smith, Jane", 1, "a\nb"]),
+                                  [Column("student", "id", "int"), Column("student", "name", "varchar")])
+        self.assertTrue(where([1, "'a\nb'"]))
+        self.assertFalse(where([1, "'a'"]))
+
+        delete = prepare_statement("DELETE FROM student WHERE name = ?;")
+        self.assertEqual(delete.bind_where(["O'Brien"]).right.text, "'O'Brien'")
+
+    def test_parameters_must_stand_for_values(self):
+        for query in ["UPDATE student SET total_cred = ? + 1 WHERE id = 1;", "CREATE TABLE ? (id int);"]:
+            with self.assertRaises(ValueError, msg=query):
+                prepare_statement(query)
+
+class TestResultCache(unittest.TestCase):
+    def test_hits_and_invalidation(self):
+        cache = ResultCache(1 << 20)
+        cache.put(("q", ()), [[1]], None, ["id"], ["student s"])
+        self.assertEqual(cache.get(("q", ())).rows, [[1]])
+        cache.invalidate("department")
+        self.assertIsNotNone(cache.get(("q", ())))
+        cache.invalidate("STUDENT")
+        self.assertIsNone(cache.get(("q", ())))
+        self.assertEqual((cache.stats.hits, cache.stats.misses, cache.stats.invalidations), (2, 1, 1))
+        self.assertEqual(cache.stats.bytes_cached, 0)
+
+    def test_put_after_concurrent_write_is_dropped(self):
+        cache = ResultCache(1 << 20)
+        generation = cache.generation(["student", "department"])
+        # A writer commits while the query runs
+        cache.invalidate("department")
+        cache.put(("q", ()), [[1]], None, ["id"], ["student", "department"], generation)
+        self.assertIsNone(cache.get(("q", ())))
+
+        generation = cache.generation(["student", "department"])
+        cache.put(("q", ()), [[1]], None, ["id"], ["student", "department"], generation)
+        self.assertIsNotNone(cache.get(("q", ())))
+
+    def test_eviction(self):
+        cache = ResultCache(1)
+        cache.put(("q", ()), [[1]], None, ["id"], ["student"])
+        self.assertEqual(len(cache), 0)
+
+class TestProtocol(unittest.TestCase):
+    def test_values_round_trip(self):
+        values = [None, 0, -1, 2 ** 63 - 1, -2 ** 63, 2 ** 70, -2 ** 70, 1.5, "", "Jane, 'Smith'"]
+        decoded, offset = decode_values(encode_values(values))
+        self.assertEqual(decoded, values)
+        self.assertEqual([type(value) for value in decoded], [type(value) for value in values])
+        self.assertEqual(offset, len(encode_values(values)))
+
+    def test_result_round_trip(self):
+        columns = [("id", "int", 4), ("total", "int", 4), ("avg", "float", 4), ("name", "varchar", 50)]
+        rows = [[1, 2 ** 70, 1.5, "'a'"], [None, 3, None, None], [3, -4, 2.0, "'c'"]]
+        kind, body = decode_message(encode_result("success", "SELECT", 7, len(rows), columns, rows))
+        result = decode_result(body)
+        self.assertEqual(kind, RESULT)
+        self.assertEqual((result.status, result.type, result.transaction_id, result.rows_count), ("success", "SELECT", 7, 3))
+        self.assertEqual(result.columns, columns)
+        self.assertEqual([row[0] for row in result.rows], [1, None, 3])
+        self.assertEqual([row[2] for row in result.rows], [1.5, None, 2.0])
+        self.assertEqual([row[3] for row in result.rows], ["'a'", None, "'c'"])
+        self.assertEqual([row[1] for row in result.rows], [2 ** 70, 3, -4])
+
+if __name__ == '__main__':
+    unittest.main()
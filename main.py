@@ -1,5 +1,6 @@
 # main.py
 from Client import Client
+from utils.protocol import TEXT_FORMAT
 
 if __name__ == "__main__":
     client = Client()
@@ -8,26 +9,25 @@ if __name__ == "__main__":
     host, port = address.split(':')
 
     try:
-        client.connect(host, int(port))
+        client.connect(host, int(port), TEXT_FORMAT)
         print("Connected to address " + address)
         print("Welcome to KawulaSQL!")
         print("Enter your SQL query or type 'exit' to quit.\n")
 
         while True:
             query = input("Please enter your SQL query: ").strip()
-            dummy = "SELECT * FROM department;"
 
             if query.lower() == "exit":
                 print("Exiting KawulaSQL. Goodbye!")
                 break
             try:
-                client.send(query.encode())
-                client.send(dummy.encode())
+                request_id = client.send(query.encode())
             except Exception as e:
                 print(f"Error while sending to server: {str(e)}")
+                continue
 
             try:
-                response = client.receive()
+                response = client.receive(request_id)
 
                 print(response)
 
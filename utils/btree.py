@@ -0,0 +1,278 @@
+# btree.py
+import bisect
+import os
+import pickle
+import struct
+import threading
+
+from utils.checkpoint import sync_directory
+
+BTREE_ORDER = 64
+COMPACTION_FACTOR = 4
+COMPACTION_MIN_SIZE = 1 << 20
+BTREE_MAGIC = b"KWBTREE1"
+HEADER_FORMAT = ">8sQQBI"
+HEADER_SIZE = 512
+NODE_HEADER = struct.Struct(">I")
+
+
+class Leaf:
+    def __init__(self, keys: list, values: list):
+        self.keys = keys
+        self.values = values
+
+
+class Internal:
+    def __init__(self, keys: list, children: list[int]):
+        self.keys = keys
+        self.children = children
+
+
+class BPlusTree:
+    """
+    A B+-tree of (key, value) entries stored in one file. Nodes are written
+    copy-on-write: an insert appends the new versions of the leaf and of its
+    ancestors and then points the header at the new root, so readers never see
+    a half-updated node; `remove_where` rewrites the leaves it changes the
+    same way. Duplicate keys are allowed. `build` writes a fresh,
+    compact tree from sorted entries.
+
+    The header holds the root offset, the number of entries, a dirty flag and
+    the metadata passed to `build`. The flag is set while an insert is in
+    progress and by `mark_dirty`; a dirty tree must be rebuilt before use.
+    The new nodes of an insert are synced before the header that points at
+    them, so after a crash the header names either the old root or a root
+    whose nodes are all on disk.
+
+    Scans `pin` the tree while they read it. `close` only closes the file
+    once the last scan has released it, so a tree can be replaced by a
+    rebuilt one while older scans finish on the old file.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.RLock()
+        self.fd = os.open(path, os.O_RDWR)
+        magic, self.root, self.count, dirty, meta_length = struct.unpack_from(
+            HEADER_FORMAT, os.pread(self.fd, HEADER_SIZE, 0)
+        )
+        if magic != BTREE_MAGIC:
+            os.close(self.fd)
+            raise ValueError(f"Error: '{path}' is not an index file.")
+        self.dirty = bool(dirty)
+        offset = struct.calcsize(HEADER_FORMAT)
+        self.meta = pickle.loads(os.pread(self.fd, meta_length, offset))
+        self.size = os.fstat(self.fd).st_size
+        self.opened_size = self.size
+        self.pins = 0
+        self.retired = False
+
+    @classmethod
+    def build(cls, path: str, entries: list[tuple], meta: dict, order: int = BTREE_ORDER) -> "BPlusTree":
+        """Write a tree holding `entries`, sorted by key, to `path` and open it."""
+        meta_bytes = pickle.dumps(meta)
+        if struct.calcsize(HEADER_FORMAT) + len(meta_bytes) > HEADER_SIZE:
+            raise ValueError("Error: Index metadata is too large.")
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(b"\0" * HEADER_SIZE)
+
+            def write(node) -> int:
+                offset = f.tell()
+                data = pickle.dumps(node, protocol=pickle.HIGHEST_PROTOCOL)
+                f.write(NODE_HEADER.pack(len(data)) + data)
+                return offset
+
+            level = []
+            for start in range(0, max(len(entries), 1), order):
+                chunk = entries[start:start + order]
+                leaf = Leaf([key for key, _ in chunk], [value for _, value in chunk])
+                level.append((leaf.keys[0] if leaf.keys else None, write(leaf)))
+            while len(level) > 1:
+                parents = []
+                for start in range(0, len(level), order):
+                    chunk = level[start:start + order]
+                    node = Internal([key for key, _ in chunk[1:]], [offset for _, offset in chunk])
+                    parents.append((chunk[0][0], write(node)))
+                level = parents
+
+            f.seek(0)
+            f.write(struct.pack(HEADER_FORMAT, BTREE_MAGIC, level[0][1], len(entries), 0, len(meta_bytes)))
+            f.write(meta_bytes)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+        sync_directory(os.path.dirname(path) or ".")
+        return cls(path)
+
+    def pin(self):
+        with self.lock:
+            self.pins += 1
+
+    def release(self):
+        with self.lock:
+            self.pins -= 1
+            if self.retired and self.pins == 0:
+                os.close(self.fd)
+
+    def close(self):
+        """Close the file now, or when the last scan that pinned the tree releases it."""
+        with self.lock:
+            if self.retired:
+                return
+            self.retired = True
+            if self.pins == 0:
+                os.close(self.fd)
+
+    def needs_compaction(self) -> bool:
+        """Whether copy-on-write inserts have grown the file enough to rewrite it."""
+        return self.size > COMPACTION_FACTOR * max(self.opened_size, COMPACTION_MIN_SIZE)
+
+    def read_node(self, offset: int):
+        length, = NODE_HEADER.unpack(os.pread(self.fd, NODE_HEADER.size, offset))
+        return pickle.loads(os.pread(self.fd, length, offset + NODE_HEADER.size))
+
+    def write_node(self, node) -> int:
+        data = pickle.dumps(node, protocol=pickle.HIGHEST_PROTOCOL)
+        offset = self.size
+        os.pwrite(self.fd, NODE_HEADER.pack(len(data)) + data, offset)
+        self.size += NODE_HEADER.size + len(data)
+        return offset
+
+    def write_header(self):
+        """Write the header and sync it."""
+        os.pwrite(self.fd, struct.pack(
+            HEADER_FORMAT[:-1], BTREE_MAGIC, self.root, self.count, int(self.dirty)
+        ), 0)
+        os.fsync(self.fd)
+
+    def mark_dirty(self):
+        with self.lock:
+            if not self.dirty:
+                self.dirty = True
+                self.write_header()
+
+    def insert_many(self, entries: list[tuple], order: int = BTREE_ORDER):
+        with self.lock:
+            was_dirty, self.dirty = self.dirty, True
+            self.write_header()
+            for key, value in entries:
+                self.insert(key, value, order)
+            # The new nodes must be on disk before a header points at them
+            os.fsync(self.fd)
+            self.dirty = was_dirty
+            self.write_header()
+
+    def insert(self, key, value, order: int = BTREE_ORDER):
+        path = []
+        node = self.read_node(self.root)
+        while isinstance(node, Internal):
+            idx = bisect.bisect_right(node.keys, key)
+            path.append((node, idx))
+            node = self.read_node(node.children[idx])
+
+        idx = bisect.bisect_right(node.keys, key)
+        node.keys.insert(idx, key)
+        node.values.insert(idx, value)
+        if len(node.keys) > order:
+            middle = len(node.keys) // 2
+            right = Leaf(node.keys[middle:], node.values[middle:])
+            left = Leaf(node.keys[:middle], node.values[:middle])
+            offset, split = self.write_node(left), (right.keys[0], self.write_node(right))
+        else:
+            offset, split = self.write_node(node), None
+
+        for parent, idx in reversed(path):
+            parent.children[idx] = offset
+            if split is not None:
+                parent.keys.insert(idx, split[0])
+                parent.children.insert(idx + 1, split[1])
+            if len(parent.children) > order:
+                middle = len(parent.keys) // 2
+                right = Internal(parent.keys[middle + 1:], parent.children[middle + 1:])
+                left = Internal(parent.keys[:middle], parent.children[:middle + 1])
+                offset, split = self.write_node(left), (parent.keys[middle], self.write_node(right))
+            else:
+                offset, split = self.write_node(parent), None
+
+        if split is not None:
+            offset = self.write_node(Internal([split[0]], [offset, split[1]]))
+        self.root = offset
+        self.count += 1
+
+    def remove_where(self, predicate, low=None, high=None) -> list:
+        """
+        Remove the entries whose value satisfies `predicate` and return their
+        values. Only the leaves whose keys may lie between `low` and `high`
+        are read. Changed leaves and their ancestors are written copy-on-write
+        and synced before the header points at the new root, as inserts are.
+        A leaf left empty is dropped from its parent, but nodes are not merged:
+        the space is reclaimed when the tree is compacted.
+        """
+        with self.lock:
+            removed = []
+            root = self.prune(self.root, predicate, low, high, removed)
+            if removed:
+                self.root = root if root is not None else self.write_node(Leaf([], []))
+                self.count -= len(removed)
+                os.fsync(self.fd)
+                self.write_header()
+            return removed
+
+    def prune(self, offset: int, predicate, low, high, removed: list) -> int | None:
+        """The offset of the node at `offset` with the matching entries removed, or None if none are left."""
+        node = self.read_node(offset)
+        if isinstance(node, Internal):
+            first = 0 if low is None else bisect.bisect_left(node.keys, low)
+            last = len(node.keys) if high is None else bisect.bisect_right(node.keys, high)
+            keys, children = [], []
+            for idx, child in enumerate(node.children):
+                pruned = self.prune(child, predicate, low, high, removed) if first <= idx <= last else child
+                if pruned is None:
+                    continue
+                if children:
+                    keys.append(node.keys[idx - 1])
+                children.append(pruned)
+            if children == node.children:
+                return offset
+            return self.write_node(Internal(keys, children)) if children else None
+
+        start = 0 if low is None else bisect.bisect_left(node.keys, low)
+        end = len(node.keys) if high is None else bisect.bisect_right(node.keys, high)
+        kept = [idx for idx in range(len(node.keys)) if not (start <= idx < end and predicate(node.values[idx]))]
+        if len(kept) == len(node.keys):
+            return offset
+        kept_set = set(kept)
+        removed.extend(value for idx, value in enumerate(node.values) if idx not in kept_set)
+        if not kept:
+            return None
+        return self.write_node(Leaf([node.keys[idx] for idx in kept], [node.values[idx] for idx in kept]))
+
+    def range(self, low=None, high=None, low_inclusive: bool = True, high_inclusive: bool = True):
+        """Yield the values whose key lies between `low` and `high`, in key order. None means unbounded."""
+        def visit(offset):
+            node = self.read_node(offset)
+            if isinstance(node, Internal):
+                first = 0 if low is None else bisect.bisect_left(node.keys, low)
+                last = len(node.keys) if high is None else bisect.bisect_right(node.keys, high)
+                for child in node.children[first:last + 1]:
+                    yield from visit(child)
+                return
+            start = 0 if low is None else (
+                bisect.bisect_left(node.keys, low) if low_inclusive else bisect.bisect_right(node.keys, low)
+            )
+            end = len(node.keys) if high is None else (
+                bisect.bisect_right(node.keys, high) if high_inclusive else bisect.bisect_left(node.keys, high)
+            )
+            yield from node.values[start:end]
+
+        return visit(self.root)
+
+    def bounds(self) -> tuple:
+        """The smallest and largest key, or (None, None) for an empty tree."""
+        def edge(last: bool):
+            node = self.read_node(self.root)
+            while isinstance(node, Internal):
+                node = self.read_node(node.children[-1 if last else 0])
+            return node.keys[-1 if last else 0] if node.keys else None
+        return edge(False), edge(True)
+
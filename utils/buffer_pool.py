@@ -0,0 +1,334 @@
+# buffer_pool.py
+import os
+import threading
+from dataclasses import dataclass
+from typing import Iterator
+
+from utils.operators import schema_columns
+from utils.predicate import compile_condition
+from utils.table_file import PAGE_SIZE, TableFormatError, decode_chunks, table_path
+
+BUFFER_POOL_PAGES = 0
+# Pages a scan pins and reads at a time
+SCAN_WINDOW = 8
+
+
+@dataclass
+class BufferPoolStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    fallbacks: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class FileChangedError(OSError):
+    """A table file that was written while a scan was reading its pages."""
+
+
+class Frame:
+    """
+    A page of a table file. `loaded` is the latch of the frame: it is set
+    once the page has been read, so the pool lock is not held during the read.
+    """
+    def __init__(self, key: tuple[str, int]):
+        self.key = key
+        self.data: bytes | None = None
+        self.loaded = threading.Event()
+        self.pins = 0
+        self.referenced = True
+        self.dirty = False
+
+
+class BufferPool:
+    """
+    A fixed number of PAGE_SIZE frames caching the pages of table files,
+    shared by every session. A page is read into a free frame on its first
+    use; when no frame is free, the clock hand sweeps the frames, clearing
+    the reference bit of each recently used one and evicting the first
+    unpinned frame whose bit is already clear.
+
+    A scan pins at most SCAN_WINDOW pages at a time, or the whole pool if it
+    is smaller, so they cannot be evicted while it decodes them. Missing pages are reserved under the pool lock and read after
+    it is released; a session that needs a page another one is still reading
+    waits on the latch of its frame. The pool never writes table files: a write through the Storage
+    Manager marks the frames of its file dirty, and a dirty frame is dropped
+    as soon as it is unpinned and read again from the file the Storage
+    Manager wrote. Frames are also dropped when the size or modification
+    time of their file changes.
+    """
+    def __init__(self, capacity: int, page_size: int = PAGE_SIZE):
+        if capacity < 1:
+            raise ValueError("Error: A buffer pool needs at least one frame.")
+        self.capacity = capacity
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.frames: dict[tuple[str, int], Frame] = {}
+        self.clock: list[Frame] = []
+        self.hand = 0
+        self.versions: dict[str, tuple[int, int]] = {}
+        self.stats = BufferPoolStats()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def scan_file(self, path: str, version: tuple[int, int] | None = None) -> Iterator[bytes]:
+        """
+        Yield the pages of a file in order, pinning and reading a window of
+        them at a time. `version` is the (modification time, size) the caller
+        found the file at. Raises FileChangedError if the file is written
+        before the scan has read it all.
+        """
+        if version is None:
+            status = os.stat(path)
+            version = (status.st_mtime_ns, status.st_size)
+        page_count = -(-version[1] // self.page_size)
+        window = max(min(SCAN_WINDOW, self.capacity), 1)
+        for start in range(0, page_count, window):
+            frames = self.pin_pages(path, version, start, min(window, page_count - start))
+            try:
+                for frame in frames:
+                    yield frame.data
+            finally:
+                self.unpin(frames)
+
+    def pin_pages(self, path: str, version: tuple[int, int], start: int, count: int) -> list[Frame]:
+        """
+        Pin `count` pages of a file from page `start`, reading the ones that
+        are not resident. `version` is the (modification time, size) of the
+        file the caller is reading; frames of another version are dropped.
+        """
+        with self.lock:
+            if self.versions.get(path) != version:
+                if start > 0:
+                    raise FileChangedError(f"Error: '{path}' changed while it was being read.")
+                self.drop(path)
+                self.versions[path] = version
+            frames, missing = [], []
+            for page_no in range(start, start + count):
+                frame, reserved = self.pin(path, page_no)
+                frames.append(frame)
+                if reserved:
+                    missing.append(frame)
+        try:
+            self.load(missing, path)
+            for frame in frames:
+                frame.loaded.wait()
+                if frame.data is None:
+                    raise OSError(f"Error: Page {frame.key[1]} of '{path}' could not be read.")
+            if self.versions.get(path) != version:
+                raise FileChangedError(f"Error: '{path}' changed while it was being read.")
+        except BaseException:
+            self.unpin(frames)
+            raise
+        return frames
+
+    def pin(self, path: str, page_no: int) -> tuple[Frame, bool]:
+        """
+        Pin a page. A page that is not resident gets a new frame, reserved for
+        the caller to read it into. Returns the frame and whether it was reserved.
+        """
+        frame = self.frames.get((path, page_no))
+        if frame is not None and not frame.dirty:
+            self.stats.hits += 1
+            frame.referenced = True
+            frame.pins += 1
+            return frame, False
+        self.stats.misses += 1
+        frame = Frame((path, page_no))
+        frame.pins = 1
+        if (path, page_no) not in self.frames and (len(self.frames) < self.capacity or self.evict()):
+            self.frames[frame.key] = frame
+            self.clock.append(frame)
+        return frame, True
+
+    def load(self, frames: list[Frame], path: str):
+        """Read the pages of frames this session reserved, outside the pool lock."""
+        if not frames:
+            return
+        try:
+            with open(path, "rb") as f:
+                for frame in frames:
+                    f.seek(frame.key[1] * self.page_size)
+                    frame.data = f.read(self.page_size)
+                    frame.loaded.set()
+        finally:
+            failed = [frame for frame in frames if not frame.loaded.is_set()]
+            if failed:
+                with self.lock:
+                    for frame in failed:
+                        frame.dirty = True
+                        frame.loaded.set()
+
+    def unpin(self, frames: list[Frame]):
+        with self.lock:
+            for frame in frames:
+                frame.pins -= 1
+                if frame.dirty and frame.pins == 0 and self.frames.get(frame.key) is frame:
+                    self.remove(frame)
+
+    def evict(self) -> bool:
+        """Free one frame with the clock algorithm. Fails when every frame is pinned."""
+        for _ in range(2 * len(self.clock)):
+            self.hand %= len(self.clock)
+            frame = self.clock[self.hand]
+            if frame.pins == 0 and not frame.referenced:
+                self.remove(frame)
+                self.stats.evictions += 1
+                return True
+            frame.referenced = False
+            self.hand += 1
+        return False
+
+    def remove(self, frame: Frame):
+        del self.frames[frame.key]
+        position = self.clock.index(frame)
+        del self.clock[position]
+        if position < self.hand:
+            self.hand -= 1
+
+    def drop(self, path: str):
+        for frame in [frame for frame in self.clock if frame.key[0] == path]:
+            if frame.pins:
+                frame.dirty = True
+            else:
+                self.remove(frame)
+
+    def mark_dirty(self, path: str):
+        with self.lock:
+            self.stats.invalidations += 1
+            self.versions.pop(path, None)
+            self.drop(path)
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.stats.hits,
+                "misses": self.stats.misses,
+                "hit_ratio": self.stats.hit_ratio,
+                "evictions": self.stats.evictions,
+                "invalidations": self.stats.invalidations,
+                "fallbacks": self.stats.fallbacks,
+                "pages": len(self.frames),
+                "capacity": self.capacity,
+                "pinned": sum(1 for frame in self.frames.values() if frame.pins),
+            }
+
+
+class BufferedStorage:
+    """
+    The Storage Manager with table reads served from a buffer pool. Rows are
+    decoded from the pages of the table file while they are pinned, a window
+    of pages at a time, and a Condition is evaluated on them the same way a
+    WHERE term is. Table schemas are cached until their file changes. Writes
+    go to the Storage Manager and mark the pages of their table dirty. A
+    table file in a layout the decoder does not recognise, or one written
+    while it was being read, is read through the Storage Manager instead.
+    """
+    def __init__(self, storage_manager, base_path: str, pool: BufferPool):
+        self.storage_manager = storage_manager
+        self.base_path = base_path
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.schemas: dict[str, tuple[tuple[int, int], object]] = {}
+        self.unsupported: dict[str, tuple[int, int]] = {}
+
+    def __getattr__(self, name):
+        return getattr(self.storage_manager, name)
+
+    def file_version(self, path: str) -> tuple[int, int] | None:
+        try:
+            status = os.stat(path)
+        except OSError:
+            return None
+        return status.st_mtime_ns, status.st_size
+
+    def get_table_schema(self, table_name: str):
+        version = self.file_version(table_path(self.base_path, table_name))
+        with self.lock:
+            cached = self.schemas.get(table_name.lower())
+        if version is not None and cached is not None and cached[0] == version:
+            return cached[1]
+        schema = self.storage_manager.get_table_schema(table_name)
+        if version is not None:
+            with self.lock:
+                self.schemas[table_name.lower()] = (version, schema)
+        return schema
+
+    def get_table_data(self, table_name: str, condition=None):
+        predicate = None if condition is None else self.condition_predicate(table_name, condition)
+        rows = None if condition is not None and predicate is None else self.read_table(table_name, predicate)
+        if rows is not None:
+            return rows
+        self.pool.stats.fallbacks += 1
+        if condition is not None:
+            return self.storage_manager.get_table_data(table_name, condition)
+        return self.storage_manager.get_table_data(table_name)
+
+    def condition_predicate(self, table_name: str, condition):
+        return compile_condition(condition, schema_columns(self.get_table_schema(table_name), table_name.lower()))
+
+    def read_table(self, table_name: str, predicate=None) -> list[list] | None:
+        """
+        Decode the rows of a table that satisfy `predicate` from the buffer
+        pool, or None when its file cannot be decoded.
+        """
+        path = table_path(self.base_path, table_name)
+        version = self.file_version(path)
+        if version is None or self.unsupported.get(path) == version:
+            return None
+        try:
+            rows = [
+                row for row in decode_chunks(self.pool.scan_file(path, version))
+                if predicate is None or predicate(row)
+            ]
+        except FileChangedError:
+            return None
+        except TableFormatError as e:
+            if self.file_version(path) != version:
+                return None
+            print(f"Reading '{table_name}' through the Storage Manager: {e}")
+            self.unsupported[path] = version
+            return None
+        return rows if self.file_version(path) == version else None
+
+    def written(self, table_name: str):
+        path = table_path(self.base_path, table_name)
+        self.pool.mark_dirty(path)
+        with self.lock:
+            self.schemas.pop(table_name.lower(), None)
+
+    def create_table(self, table_name: str, schema):
+        try:
+            return self.storage_manager.create_table(table_name, schema)
+        finally:
+            self.written(table_name)
+
+    def delete_table(self, table_name: str):
+        try:
+            return self.storage_manager.delete_table(table_name)
+        finally:
+            self.written(table_name)
+
+    def insert_into_table(self, table_name: str, rows):
+        try:
+            return self.storage_manager.insert_into_table(table_name, rows)
+        finally:
+            self.written(table_name)
+
+    def update_table(self, table_name: str, *args):
+        try:
+            return self.storage_manager.update_table(table_name, *args)
+        finally:
+            self.written(table_name)
+
+    def delete_table_record(self, table_name: str, condition):
+        try:
+            return self.storage_manager.delete_table_record(table_name, condition)
+        finally:
+            self.written(table_name)
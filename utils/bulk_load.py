@@ -0,0 +1,147 @@
+# bulk_load.py
+import csv
+import itertools
+import re
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
+
+from utils.spill import SpillFile, estimate_row_size
+
+COPY_BATCH_SIZE = 5000
+COPY_MEMORY_BUDGET = 64 * 1024 * 1024
+
+COPY_PATTERN = re.compile(
+    r"^\s*COPY\s+(\w+)\s+FROM\s+'((?:[^']|'')+)'((?:\s+(?:WITH|CSV|HEADER))*)\s*;?\s*$",
+    re.IGNORECASE
+)
+
+
+def parse_copy(query: str) -> tuple[str, str, bool]:
+    """
+    Parse `COPY table FROM 'file.csv' [WITH] [CSV] [HEADER]` into the table
+    name, the file path and whether the first line is a header.
+    """
+    match = COPY_PATTERN.match(query)
+    if not match:
+        raise ValueError("Error: Invalid COPY statement. Expected COPY table FROM 'file.csv' [HEADER].")
+    options = match.group(3).upper().split()
+    return match.group(1), match.group(2).replace("''", "'"), 'HEADER' in options
+
+
+@contextmanager
+def open_csv(path: str, header: bool):
+    """A csv.reader over the file at `path`, past its header line if it has one."""
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        if header:
+            next(reader, None)
+        yield reader
+
+
+class PartialLoadError(ValueError):
+    """A bulk load that failed after `rows_loaded` rows were already inserted."""
+    def __init__(self, message: str, rows_loaded: int):
+        super().__init__(message)
+        self.rows_loaded = rows_loaded
+
+
+def make_converter(name: str, dtype: str, size: int | None) -> Callable[[str], object]:
+    """
+    A function turning one CSV field into the value stored for a column of
+    type `dtype`. Strings are stored in quotes, as INSERT ... VALUES stores
+    them, with any quote inside kept as is: that is the value a WHERE
+    literal such as 'O''Brien' compares equal to.
+    """
+    dtype = dtype.lower()
+    if dtype == 'int':
+        return int
+    if dtype == 'float':
+        return float
+    if dtype in ('char', 'varchar'):
+        def convert(value: str):
+            if size is not None and len(value) > size:
+                raise ValueError(f"value is longer than {dtype}({size})")
+            return "'" + value + "'"
+        return convert
+    raise ValueError(f"Error: Column '{name}' has unsupported type '{dtype}'.")
+
+
+def coerce_batches(rows: Iterable[list], attributes: list[tuple],
+                   batch_size: int = COPY_BATCH_SIZE, first_line: int = 1) -> Iterator[list]:
+    """
+    Convert rows of strings (e.g. from csv.reader) against a table schema,
+    given as (name, type, size) tuples, and yield them in batches.
+    """
+    converters = [make_converter(*attribute) for attribute in attributes]
+    rows = iter(rows)
+    line = first_line
+    while True:
+        chunk = list(itertools.islice(rows, batch_size))
+        if not chunk:
+            return
+        batch = []
+        for row in chunk:
+            if len(row) != len(converters):
+                raise ValueError(f"Error: Line {line} has {len(row)} fields, expected {len(converters)}.")
+            try:
+                batch.append([convert(value) for convert, value in zip(converters, row)])
+            except ValueError as e:
+                raise ValueError(f"Error: Invalid value on line {line}: {e}")
+            line += 1
+        yield batch
+
+
+class StagedBatches:
+    """
+    Converted batches kept until the whole input has been converted, so that
+    a bad row is found before anything is loaded and no row is converted
+    twice. Batches are held in memory up to `memory_budget` bytes and spilled
+    to a file in `directory` past it. Iterating yields them back in order.
+    """
+    def __init__(self, batches: Iterable[list], memory_budget: int, directory: str):
+        self.batches = []
+        self.batch_size = 0
+        self.spill_file = None
+        size = 0
+        try:
+            for batch in batches:
+                self.batch_size = max(self.batch_size, len(batch))
+                if self.spill_file is None:
+                    size += sum(estimate_row_size(row) for row in batch)
+                    if size <= memory_budget:
+                        self.batches.append(batch)
+                        continue
+                    self.spill_file = SpillFile(directory, prefix="copy_")
+                    for held in self.batches:
+                        self.spill_file.write_all(held)
+                    self.batches = []
+                self.spill_file.write_all(batch)
+        except BaseException:
+            self.close()
+            raise
+
+    @property
+    def spilled(self) -> bool:
+        return self.spill_file is not None
+
+    def __iter__(self) -> Iterator[list]:
+        if self.spill_file is None:
+            yield from self.batches
+            return
+        rows = iter(self.spill_file)
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def close(self):
+        self.batches = []
+        if self.spill_file is not None:
+            self.spill_file.close()
+
+    def __enter__(self) -> "StagedBatches":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,160 @@
+# checkpoint.py
+import json
+import os
+import shutil
+from dataclasses import dataclass
+from datetime import datetime
+
+CHECKPOINT_INTERVAL = 300.0
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+
+@dataclass
+class LogRecord:
+    """
+    A record of the write-ahead log as seen by this process. `offset` is the
+    size of the log file before the group holding the record was appended,
+    and `previous` points back to the previous record of the same transaction.
+    """
+    transaction_id: int
+    type: str
+    query: str
+    offset: int
+    previous: "LogRecord | None" = None
+
+
+@dataclass
+class CheckpointStats:
+    checkpoints: int = 0
+    bytes_archived: int = 0
+    fast_recoveries: int = 0
+    recoveries: int = 0
+    pinned_bytes: int = 0
+    pinning_transaction: int | None = None
+    pinned_checkpoints: int = 0
+    uncut_checkpoints: int = 0
+    failed_checkpoints: int = 0
+    last_checkpoint_error: str | None = None
+
+
+class TransactionTable:
+    """
+    The transactions that have records in the log and are neither committed
+    nor rolled back, each with a chain of back-pointers through its records.
+    """
+    def __init__(self):
+        self.last_records: dict[int, LogRecord] = {}
+        self.first_offsets: dict[int, int] = {}
+
+    def __contains__(self, transaction_id: int) -> bool:
+        return transaction_id in self.last_records
+
+    def log(self, record, offset: int):
+        transaction_id = record.transaction_id
+        self.last_records[transaction_id] = LogRecord(
+            transaction_id, record.type, record.query, offset, self.last_records.get(transaction_id)
+        )
+        self.first_offsets.setdefault(transaction_id, offset)
+
+    def end(self, transaction_id: int):
+        self.last_records.pop(transaction_id, None)
+        self.first_offsets.pop(transaction_id, None)
+
+    def records(self, transaction_id: int) -> list[LogRecord]:
+        """The records of one transaction, newest first, without scanning the log."""
+        records = []
+        record = self.last_records.get(transaction_id)
+        while record is not None:
+            records.append(record)
+            record = record.previous
+        return records
+
+    def oldest_offset(self) -> int | None:
+        return min(self.first_offsets.values(), default=None)
+
+    def oldest_transaction(self) -> int | None:
+        """The active transaction whose first record is the oldest in the log."""
+        return min(self.first_offsets, key=self.first_offsets.get, default=None)
+
+    def shift(self, cut: int):
+        """Rebase every offset after the first `cut` bytes of the log were removed."""
+        self.first_offsets = {txn: offset - cut for txn, offset in self.first_offsets.items()}
+        for record in self.last_records.values():
+            while record is not None:
+                record.offset -= cut
+                record = record.previous
+
+
+def checkpoint_path(log_path: str) -> str:
+    return log_path + CHECKPOINT_SUFFIX
+
+
+def read_checkpoint(log_path: str) -> dict | None:
+    try:
+        with open(checkpoint_path(log_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_checkpoint(log_path: str, checkpoint: dict):
+    """Replace the checkpoint file of a log atomically."""
+    path = checkpoint_path(log_path)
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+def cut_segment(log_path: str, cut: int, archive_dir: str | None, segment: int) -> int:
+    """
+    Remove the first `cut` bytes of the log, copying them to
+    `archive_dir/wal.<segment>.log` first when an archive directory is given.
+    The rest of the log is written to a new file that replaces the log once
+    it is synced, so a crash at any point leaves either the old log or the
+    new one, never a torn mix. Handles opened on the old log must be reopened
+    by the caller. Returns the number of bytes removed.
+    """
+    if cut <= 0:
+        return 0
+    temporary = log_path + ".tmp"
+    with open(log_path, "rb") as f:
+        head = f.read(cut)
+        if archive_dir is not None:
+            os.makedirs(archive_dir, exist_ok=True)
+            with open(os.path.join(archive_dir, f"wal.{segment}.log"), "wb") as archive:
+                archive.write(head)
+                archive.flush()
+                os.fsync(archive.fileno())
+        with open(temporary, "wb") as tail:
+            shutil.copyfileobj(f, tail)
+            tail.flush()
+            os.fsync(tail.fileno())
+    os.replace(temporary, log_path)
+    sync_directory(os.path.dirname(log_path) or ".")
+    return len(head)
+
+
+def sync_directory(path: str):
+    """Make a rename inside `path` durable."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def make_checkpoint(segment: int, active: dict[int, int], flushed: int) -> dict:
+    return {
+        "segment": segment,
+        "timestamp": datetime.now().isoformat(),
+        "active_transactions": {str(txn): offset for txn, offset in active.items()},
+        "flushed_offset": flushed,
+    }
@@ -0,0 +1,32 @@
+# cursor.py
+import itertools
+from typing import Callable, Iterable
+
+
+class Cursor:
+    """
+    The rows of a SELECT, pulled from the operator pipeline on demand instead
+    of being collected into a list first. Closing the cursor early releases
+    the pipeline (and any files it spilled to).
+    """
+    def __init__(self, rows: Iterable, on_close: Callable[[], None] = None):
+        self.rows = iter(rows)
+        self.on_close = on_close
+        self.rows_fetched = 0
+        self.done = False
+
+    def fetch(self, count: int) -> list:
+        """Up to `count` more rows; fewer means the result is exhausted."""
+        if self.done:
+            return []
+        batch = list(itertools.islice(self.rows, count))
+        self.rows_fetched += len(batch)
+        if len(batch) < count:
+            self.close()
+        return batch
+
+    def close(self):
+        if not self.done:
+            self.done = True
+            if self.on_close is not None:
+                self.on_close()
@@ -0,0 +1,281 @@
+# group_commit.py
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+
+from utils.checkpoint import (
+    CHECKPOINT_INTERVAL, CheckpointStats, TransactionTable, cut_segment, make_checkpoint,
+    read_checkpoint, write_checkpoint
+)
+
+GROUP_COMMIT_WINDOW = 0.0
+GROUP_COMMIT_MAX_BATCH = 256
+
+
+@dataclass
+class GroupCommitStats:
+    groups: int = 0
+    records: int = 0
+    fsyncs: int = 0
+    largest_group: int = 0
+    started: float = 0.0
+
+    @property
+    def average_group_size(self) -> float:
+        return self.records / self.groups if self.groups else 0.0
+
+    @property
+    def fsyncs_per_second(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.fsyncs / elapsed if elapsed > 0 else 0.0
+
+
+class PendingRecord:
+    def __init__(self, record):
+        self.record = record
+        self.error: Exception | None = None
+        self.done = threading.Event()
+
+
+class GroupCommitLog:
+    """
+    Write-ahead log writer shared by all sessions. `write_log` queues a record
+    and blocks until it is durable. A single writer thread takes every queued
+    record, up to `max_batch`, appends them through the Failure Recovery
+    Manager and syncs the log file once for the whole group, then releases all
+    of its committers together.
+
+    With a `window` above zero the writer waits up to that many seconds for a
+    group to fill before syncing, trading commit latency for fewer syncs. With
+    the default of zero, groups form from the records that queue up while the
+    previous sync is running.
+
+    Every `checkpoint_interval` seconds the writer takes a fuzzy checkpoint:
+    the part of the log older than the first record of every active
+    transaction is moved to `archive_dir` (or dropped when it is None), and
+    the active transactions are recorded next to the log in `<path>.checkpoint`.
+    The log therefore always starts at the last checkpoint, which bounds the
+    work of recovery. The log is only cut when the Failure Recovery Manager
+    can `reopen()` it. A transaction left open keeps its records, and every
+    record after them, in the log; get_metrics() reports it as
+    `pinning_transaction` with the `pinned_bytes` it holds back. The writer
+    thread reports through get_metrics() rather than printing.
+    """
+    def __init__(self, frm, path: str | None = None, window: float = GROUP_COMMIT_WINDOW,
+                 max_batch: int = GROUP_COMMIT_MAX_BATCH,
+                 checkpoint_interval: float | None = CHECKPOINT_INTERVAL, archive_dir: str | None = None):
+        if max_batch < 1:
+            raise ValueError("max_batch must be at least 1")
+        self.frm = frm
+        self.path = path
+        self.window = window
+        self.max_batch = max_batch
+        self.pending: list[PendingRecord] = []
+        self.closed = False
+        self.condition = threading.Condition()
+        self.log_lock = threading.Lock()
+        self.stats = GroupCommitStats(started=time.monotonic())
+        self.transactions = TransactionTable()
+        self.checkpoint_interval = checkpoint_interval
+        self.archive_dir = archive_dir
+        self.checkpoint_stats = CheckpointStats()
+        self.last_checkpoint = read_checkpoint(path) if path is not None else None
+        self.segment = self.last_checkpoint["segment"] + 1 if self.last_checkpoint else 1
+        self.next_checkpoint = time.monotonic() + (checkpoint_interval or 0)
+        self.writer = threading.Thread(target=self.run, name="wal-writer", daemon=True)
+        self.writer.start()
+
+    def write_log(self, record):
+        pending = PendingRecord(record)
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("The write-ahead log is closed")
+            self.pending.append(pending)
+            self.condition.notify_all()
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed and not self.checkpoint_due():
+                    self.condition.wait(self.until_checkpoint())
+                if self.closed and not self.pending:
+                    return
+                group = []
+                if self.pending:
+                    deadline = time.monotonic() + self.window
+                    while len(self.pending) < self.max_batch and not self.closed:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+                    group = self.pending[:self.max_batch]
+                    del self.pending[:self.max_batch]
+            if group:
+                self.commit(group)
+            if self.checkpoint_due():
+                try:
+                    self.checkpoint()
+                except Exception as e:
+                    self.checkpoint_stats.failed_checkpoints += 1
+                    self.checkpoint_stats.last_checkpoint_error = f"{type(e).__name__}: {e}"
+                    self.next_checkpoint = time.monotonic() + self.checkpoint_interval
+
+    def commit(self, group: list[PendingRecord]):
+        error = None
+        try:
+            with self.log_lock:
+                offset = self.log_size()
+                for pending in group:
+                    self.frm.write_log(pending.record)
+                self.sync()
+                with self.condition:
+                    for pending in group:
+                        record = pending.record
+                        if record.type == "COMMIT":
+                            self.transactions.end(record.transaction_id)
+                        else:
+                            self.transactions.log(record, offset)
+        except Exception as e:
+            error = e
+        finally:
+            self.stats.groups += 1
+            self.stats.records += len(group)
+            self.stats.largest_group = max(self.stats.largest_group, len(group))
+            for pending in group:
+                pending.error = error
+                pending.done.set()
+
+    def sync(self):
+        """Flush the log once for the current group."""
+        flush = getattr(self.frm, "flush", None)
+        if callable(flush):
+            flush()
+        if self.path is not None and os.path.exists(self.path):
+            fd = os.open(self.path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self.stats.fsyncs += 1
+
+    def log_size(self) -> int:
+        if self.path is None or not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path)
+
+    def checkpoint_due(self) -> bool:
+        return bool(self.checkpoint_interval) and time.monotonic() >= self.next_checkpoint
+
+    def until_checkpoint(self) -> float | None:
+        if not self.checkpoint_interval:
+            return None
+        return max(self.next_checkpoint - time.monotonic(), 0)
+
+    def checkpoint(self):
+        """
+        Take a fuzzy checkpoint. Commits wait for it, but transactions stay
+        active across it: the log is only cut before the oldest of their records.
+        A Failure Recovery Manager without `reopen()` would keep writing to the
+        file the cut replaced, so its log is not cut at all.
+        """
+        with self.log_lock:
+            if self.checkpoint_interval:
+                self.next_checkpoint = time.monotonic() + self.checkpoint_interval
+            if self.path is None or not os.path.exists(self.path):
+                return
+            flushed = self.log_size()
+            with self.condition:
+                oldest = self.transactions.oldest_offset()
+                pinning = self.transactions.oldest_transaction()
+            cut = flushed if oldest is None else oldest
+            if not self.can_reopen():
+                cut = 0
+                self.checkpoint_stats.uncut_checkpoints += 1
+            removed = cut_segment(self.path, cut, self.archive_dir, self.segment)
+            if removed:
+                self.reopen()
+            self.report_pinned(pinning, flushed - cut)
+            with self.condition:
+                self.transactions.shift(removed)
+                active = dict(self.transactions.first_offsets)
+            self.last_checkpoint = make_checkpoint(self.segment, active, flushed - removed)
+            write_checkpoint(self.path, self.last_checkpoint)
+            self.segment += 1
+            self.checkpoint_stats.checkpoints += 1
+            self.checkpoint_stats.bytes_archived += removed
+
+    def can_reopen(self) -> bool:
+        return callable(getattr(self.frm, "reopen", None))
+
+    def reopen(self):
+        """Let the Failure Recovery Manager reopen the log after a checkpoint replaced it."""
+        if not self.can_reopen():
+            raise RuntimeError("The Failure Recovery Manager cannot reopen the write-ahead log")
+        self.frm.reopen()
+
+    def report_pinned(self, transaction_id: int | None, pinned: int):
+        """
+        Record how much of the log an open transaction keeps from being cut,
+        and for how many checkpoints in a row the same transaction has held
+        it back: one still open at the next checkpoint holds the log back for
+        as long as it runs.
+        """
+        if transaction_id is None:
+            self.checkpoint_stats.pinned_checkpoints = 0
+        elif transaction_id == self.checkpoint_stats.pinning_transaction:
+            self.checkpoint_stats.pinned_checkpoints += 1
+        else:
+            self.checkpoint_stats.pinned_checkpoints = 1
+        self.checkpoint_stats.pinned_bytes = pinned
+        self.checkpoint_stats.pinning_transaction = transaction_id
+
+    def end_transaction(self, transaction_id: int):
+        with self.condition:
+            self.transactions.end(transaction_id)
+
+    def recover(self, transaction_id: int, related: list[int] = ()) -> list:
+        """
+        Roll back a transaction through the Failure Recovery Manager. A
+        session logs each statement of a transaction under its own ID, so the
+        statement `transaction_id` and the `related` IDs of the earlier
+        statements are all rolled back, newest first, and their rollback
+        queries returned in that order. The back-pointer chains tell without
+        reading the log which of them wrote anything; only those are recovered,
+        and when none did the log is not read at all.
+        """
+        transaction_ids = list(dict.fromkeys([transaction_id, *reversed(related)]))
+        with self.condition:
+            logged = [txn for txn in transaction_ids if self.transactions.records(txn)]
+            for txn in transaction_ids:
+                self.transactions.end(txn)
+        if not logged:
+            self.checkpoint_stats.fast_recoveries += 1
+            return []
+        self.checkpoint_stats.recoveries += 1
+        rollback = []
+        for txn in logged:
+            rollback.extend(self.frm.recover(txn) or [])
+        return rollback
+
+    def close(self):
+        """Write the records still queued and stop the writer thread."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.writer.join()
+
+    def get_metrics(self) -> dict:
+        return {
+            "groups": self.stats.groups,
+            "records": self.stats.records,
+            "fsyncs": self.stats.fsyncs,
+            "largest_group": self.stats.largest_group,
+            "average_group_size": self.stats.average_group_size,
+            "fsyncs_per_second": self.stats.fsyncs_per_second,
+            "active_transactions": len(self.transactions.first_offsets),
+            **asdict(self.checkpoint_stats),
+        }
@@ -0,0 +1,238 @@
+# hash_index.py
+import re
+import sys
+import threading
+from dataclasses import asdict, dataclass
+
+from utils.indexes import coerce_value, compile_where, literal_assignments
+from utils.operators import Operator, normalize_value, schema_columns
+from utils.spill import estimate_row_size
+
+
+def hash_key(value) -> tuple | None:
+    """Bucket key of a column value, in the form HashJoin uses for single-column keys."""
+    return None if value is None else (normalize_value(value),)
+
+
+@dataclass
+class HashIndexStats:
+    builds: int = 0
+    lookups: int = 0
+    join_builds: int = 0
+    invalidations: int = 0
+
+
+class HashIndex:
+    """
+    An in-memory hash table from the values of one column to the rows that
+    hold them. It is empty until `build` reads the table; from then on the
+    catalog keeps it in step with the writes made through the executor.
+    Buckets hold the rows they are given, not copies: indexed rows are never
+    changed in place, only replaced.
+    """
+    def __init__(self, table_name: str, column: str):
+        self.table_name = table_name
+        self.column = column
+        self.position = None
+        self.dtype = None
+        self.buckets: dict[tuple, list[list]] | None = None
+        self.rows = 0
+        self.row_bytes = 0
+
+    @property
+    def built(self) -> bool:
+        return self.buckets is not None
+
+    def build(self, storage_manager):
+        metadata = storage_manager.get_table_schema(self.table_name).get_metadata()
+        names = [attr[0].lower() for attr in metadata]
+        if self.column.lower() not in names:
+            raise ValueError(f"Error: Table '{self.table_name}' has no column '{self.column}'.")
+        self.position = names.index(self.column.lower())
+        self.dtype = metadata[self.position][1]
+        self.buckets, self.rows, self.row_bytes = {}, 0, 0
+        self.add(storage_manager.get_table_data(self.table_name) or [])
+
+    def reset(self):
+        self.buckets, self.rows, self.row_bytes = None, 0, 0
+
+    def add(self, rows: list[list]):
+        for row in rows:
+            key = hash_key(row[self.position])
+            if key is None:
+                continue
+            self.buckets.setdefault(key, []).append(row)
+            self.rows += 1
+            self.row_bytes += estimate_row_size(row)
+
+    def remove(self, predicate) -> list[list]:
+        """Take the rows matching `predicate` out of the index and return them."""
+        removed = []
+        for key in list(self.buckets):
+            kept = []
+            for row in self.buckets[key]:
+                (removed if predicate(row) else kept).append(row)
+            if len(kept) == len(self.buckets[key]):
+                continue
+            if kept:
+                self.buckets[key] = kept
+            else:
+                del self.buckets[key]
+        self.rows -= len(removed)
+        self.row_bytes -= sum(estimate_row_size(row) for row in removed)
+        return removed
+
+    def lookup(self, value) -> list[list]:
+        return list(self.buckets.get(hash_key(value), ()))
+
+    def memory_bytes(self) -> int:
+        if self.buckets is None:
+            return 0
+        return sys.getsizeof(self.buckets) + sum(sys.getsizeof(bucket) for bucket in self.buckets.values()) + self.row_bytes
+
+
+class HashIndexCatalog:
+    """
+    The hash indexes configured for a database, one per `table.column`. An
+    index is built from a full table scan the first time a query can use it,
+    and then maintained in memory: inserted rows are added, and the WHERE
+    clause of an UPDATE or DELETE is evaluated against the indexed rows to
+    change or remove the same rows the Storage Manager did. An UPDATE that
+    sets a column to anything but a literal, or a table that is dropped,
+    resets the index so it is rebuilt on its next use.
+    """
+    def __init__(self, storage_manager, columns=()):
+        self.storage_manager = storage_manager
+        self.lock = threading.RLock()
+        self.stats = HashIndexStats()
+        self.indexes: dict[tuple[str, str], HashIndex] = {}
+        for name in columns:
+            match = re.match(r"^\s*(\w+)\.(\w+)\s*$", name)
+            if not match:
+                raise ValueError(f"Error: Invalid hash index column '{name}'. Expected table.column.")
+            table_name, column = match.group(1).lower(), match.group(2)
+            self.indexes[(table_name, column.lower())] = HashIndex(table_name, column)
+
+    def on_table(self, table_name: str) -> list[HashIndex]:
+        return [index for (table, _), index in self.indexes.items() if table == table_name.lower()]
+
+    def find(self, table_name: str, column: str) -> HashIndex | None:
+        """The index on a column, built first if this is its first use."""
+        index = self.indexes.get((table_name.lower(), column.lower()))
+        if index is None:
+            return None
+        with self.lock:
+            if not index.built:
+                index.build(self.storage_manager)
+                self.stats.builds += 1
+        return index
+
+    def lookup(self, index: HashIndex, value) -> list[list]:
+        with self.lock:
+            self.stats.lookups += 1
+            return index.lookup(value)
+
+    def join_table(self, index: HashIndex) -> "JoinBuckets":
+        """The live buckets of an index, for a hash join to probe."""
+        with self.lock:
+            self.stats.join_builds += 1
+            return JoinBuckets(self.lock, index.buckets)
+
+    def built_on(self, table_name: str) -> list[HashIndex]:
+        return [index for index in self.on_table(table_name) if index.built]
+
+    def insert_rows(self, table_name: str, rows: list[list]):
+        with self.lock:
+            indexes = self.built_on(table_name)
+            if not indexes:
+                return
+            types = [attr[1] for attr in self.storage_manager.get_table_schema(table_name).get_metadata()]
+            rows = [[coerce_value(value, dtype) for value, dtype in zip(row, types)] for row in rows]
+            for index in indexes:
+                index.add(rows)
+
+    def delete_rows(self, table_name: str, where_clause: str):
+        with self.lock:
+            indexes = self.built_on(table_name)
+            if not indexes:
+                return
+            predicate = compile_where(self.storage_manager, table_name, where_clause)
+            for index in indexes:
+                if predicate is None:
+                    self.invalidate(index)
+                else:
+                    index.remove(predicate)
+
+    def update_rows(self, table_name: str, update_values: dict[str, str], where_clause: str | None):
+        with self.lock:
+            indexes = self.built_on(table_name)
+            if not indexes:
+                return
+            metadata = self.storage_manager.get_table_schema(table_name).get_metadata()
+            assignments = literal_assignments(metadata, update_values)
+            predicate = compile_where(self.storage_manager, table_name, where_clause) if where_clause else (lambda row: True)
+            for index in indexes:
+                if assignments is None or predicate is None:
+                    self.invalidate(index)
+                    continue
+                index.add([
+                    [assignments.get(position, value) for position, value in enumerate(row)]
+                    for row in index.remove(predicate)
+                ])
+
+    def invalidate(self, index: HashIndex):
+        index.reset()
+        self.stats.invalidations += 1
+
+    def drop_table(self, table_name: str):
+        with self.lock:
+            for index in self.built_on(table_name):
+                self.invalidate(index)
+
+    def get_stats(self) -> dict:
+        """Memory held by each built index, with the catalog counters."""
+        with self.lock:
+            indexes = {
+                f"{index.table_name}.{index.column}": {
+                    "rows": index.rows, "keys": len(index.buckets), "bytes": index.memory_bytes(),
+                }
+                for index in self.indexes.values() if index.built
+            }
+            return {
+                **asdict(self.stats),
+                "indexes": indexes,
+                "bytes": sum(stat["bytes"] for stat in indexes.values()),
+            }
+
+
+class JoinBuckets:
+    """
+    The buckets of a hash index as the build table of a hash join. Nothing is
+    copied up front: each probe reads its bucket under the catalog lock and
+    gets the matching rows as they are at that moment. A reset of the index
+    replaces its buckets, so a join that is running keeps the ones it started with.
+    """
+    def __init__(self, lock, buckets: dict[tuple, list[list]]):
+        self.lock = lock
+        self.buckets = buckets
+
+    def get(self, key: tuple) -> list[list] | None:
+        with self.lock:
+            rows = self.buckets.get(key)
+            return list(rows) if rows else None
+
+
+class HashLookup(Operator):
+    """Reads the rows of a table whose hash-indexed column equals a value."""
+    def __init__(self, storage_manager, catalog: HashIndexCatalog, index: HashIndex, value, alias: str = None):
+        self.catalog = catalog
+        self.index = index
+        self.table_name = index.table_name
+        self.value = value
+        schema = storage_manager.get_table_schema(index.table_name)
+        super().__init__(schema_columns(schema, alias or index.table_name))
+
+    def __iter__(self):
+        for row in self.catalog.lookup(self.index, self.value):
+            yield list(row)
+
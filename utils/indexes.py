@@ -0,0 +1,363 @@
+# indexes.py
+import itertools
+import os
+import re
+import threading
+
+from utils.btree import BPlusTree
+from utils.locks import LockError, SHARED
+from utils.operators import Operator, normalize_value, schema_columns
+from utils.predicate import column_comparison, compile_predicate, conjuncts, parse_predicate
+
+INDEX_SUFFIX = ".idx"
+# Largest estimated fraction of a table for which an index range scan beats a full scan
+INDEX_SELECTIVITY = 0.2
+DEFAULT_RANGE_SELECTIVITY = 1 / 3
+
+LITERAL_PATTERN = re.compile(r"""^\s*('[^']*'|"[^"]*"|[+-]?\d+(\.\d+)?)\s*$""")
+
+CREATE_INDEX_PATTERN = re.compile(
+    r"^\s*CREATE\s+INDEX\s+(\w+)\s+ON\s+(\w+)\s*\(\s*(\w+)\s*\)\s*;?\s*$", re.IGNORECASE
+)
+DROP_INDEX_PATTERN = re.compile(r"^\s*DROP\s+INDEX\s+(\w+)\s*;?\s*$", re.IGNORECASE)
+
+
+def parse_create_index(query: str) -> tuple[str, str, str]:
+    match = CREATE_INDEX_PATTERN.match(query)
+    if not match:
+        raise ValueError("Error: Invalid CREATE INDEX statement. Expected CREATE INDEX name ON table (column).")
+    return match.group(1).lower(), match.group(2).lower(), match.group(3)
+
+
+def parse_drop_index(query: str) -> str:
+    match = DROP_INDEX_PATTERN.match(query)
+    if not match:
+        raise ValueError("Error: Invalid DROP INDEX statement.")
+    return match.group(1).lower()
+
+
+def coerce_value(value, dtype: str):
+    """Convert a value written in an INSERT statement to the type it is stored as."""
+    if not isinstance(value, str):
+        return value
+    if dtype == "int":
+        return int(value)
+    if dtype == "float":
+        return float(value)
+    return value
+
+
+def literal_assignments(metadata: list[tuple], update_values: dict[str, str]) -> dict[int, object] | None:
+    """
+    The values an UPDATE sets, by column position, or None when one of them
+    is not a literal and the new rows cannot be computed without the table.
+    """
+    names = [attr[0].lower() for attr in metadata]
+    assignments = {}
+    for column, text in update_values.items():
+        if column.lower() not in names or not LITERAL_PATTERN.match(text):
+            return None
+        position = names.index(column.lower())
+        try:
+            assignments[position] = coerce_value(text.strip(), metadata[position][1])
+        except ValueError:
+            return None
+    return assignments
+
+
+def compile_where(storage_manager, table_name: str, where_clause: str):
+    """The WHERE clause of an UPDATE or DELETE as a row predicate, or None if it cannot be compiled."""
+    try:
+        schema = storage_manager.get_table_schema(table_name)
+        return compile_predicate(parse_predicate(where_clause), schema_columns(schema, table_name.lower()))
+    except ValueError:
+        return None
+
+
+def index_key(value):
+    return normalize_value(value)
+
+
+def accepts_key(dtype: str, value) -> bool:
+    """Whether a literal can be compared with the keys of an index on a column of type `dtype`."""
+    if dtype in ("int", "float"):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, str)
+
+
+def where_bounds(storage_manager, table_name: str, where_clause: str, position: int, dtype: str) -> dict:
+    """
+    Bounds on the key of an index on column `position` that every row the
+    WHERE clause matches lies within, from the first term comparing that
+    column with a literal. Empty when there is no such term.
+    """
+    try:
+        columns = schema_columns(storage_manager.get_table_schema(table_name), table_name.lower())
+        terms = conjuncts(parse_predicate(where_clause))
+    except ValueError:
+        return {}
+    for term in terms:
+        comparison = column_comparison(term, columns)
+        if comparison is None or comparison[0] != position or not accepts_key(dtype, comparison[2].value):
+            continue
+        _, comparator, literal = comparison
+        key = index_key(literal.value)
+        if comparator in ("=", "=="):
+            return {"low": key, "high": key}
+        if comparator in ("<", "<="):
+            return {"high": key}
+        if comparator in (">", ">="):
+            return {"low": key}
+    return {}
+
+
+class IndexCatalog:
+    """
+    The B+-tree indexes of a database, one `<name>.idx` file per index under
+    the database directory. Each leaf entry holds a whole row, so an index
+    range scan reads its rows from the index without going back to the table.
+
+    Indexes are maintained the way HashIndexCatalog maintains its own:
+    inserted rows are added, and the WHERE clause of an UPDATE or DELETE is
+    evaluated against the indexed rows, within the key range it implies, to
+    change or remove the same rows the Storage Manager did. An UPDATE that
+    sets a column to anything but a literal, or a WHERE clause that cannot be
+    compiled, marks the index dirty instead. A dirty index is not used:
+    queries scan the table while a background thread rebuilds the index under
+    a shared lock on the table, taken from `lock_manager` when one is given.
+    An index whose file copy-on-write writes have grown is rewritten from its
+    own entries.
+
+    `find` returns the tree pinned for the caller, who must release it once
+    done reading; a rebuilt or dropped tree keeps its file open until then.
+    """
+    def __init__(self, base_path: str, storage_manager, lock_manager=None):
+        self.base_path = base_path
+        self.storage_manager = storage_manager
+        self.lock_manager = lock_manager
+        self.lock = threading.RLock()
+        self.indexes: dict[str, BPlusTree] = {}
+        self.rebuilding: dict[str, threading.Thread] = {}
+        # Lock manager sessions of the rebuilds, apart from those of the executor
+        self.rebuild_sessions = itertools.count(-1, -1)
+        for file_name in sorted(os.listdir(base_path)) if os.path.isdir(base_path) else []:
+            if file_name.endswith(INDEX_SUFFIX):
+                try:
+                    tree = BPlusTree(os.path.join(base_path, file_name))
+                except (OSError, ValueError, EOFError) as e:
+                    print(f"Skipping index file {file_name}: {e}")
+                    continue
+                self.indexes[tree.meta["name"]] = tree
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.base_path, name + INDEX_SUFFIX)
+
+    def create(self, name: str, table_name: str, column: str) -> BPlusTree:
+        with self.lock:
+            if name in self.indexes:
+                raise ValueError(f"Error: Index '{name}' already exists.")
+            metadata = self.storage_manager.get_table_schema(table_name).get_metadata()
+            names = [attr[0].lower() for attr in metadata]
+            if column.lower() not in names:
+                raise ValueError(f"Error: Table '{table_name}' has no column '{column}'.")
+            position = names.index(column.lower())
+            meta = {
+                "name": name, "table": table_name, "column": metadata[position][0],
+                "position": position, "dtype": metadata[position][1],
+            }
+            tree = BPlusTree.build(self.path(name), self.entries(table_name, position), meta)
+            self.indexes[name] = tree
+            return tree
+
+    def entries(self, table_name: str, position: int) -> list[tuple]:
+        rows = self.storage_manager.get_table_data(table_name) or []
+        entries = [(index_key(row[position]), list(row)) for row in rows if row[position] is not None]
+        entries.sort(key=lambda entry: entry[0])
+        return entries
+
+    def drop(self, name: str):
+        with self.lock:
+            tree = self.indexes.pop(name, None)
+            if tree is None:
+                raise ValueError(f"Error: Index '{name}' does not exist.")
+            tree.close()
+            os.remove(tree.path)
+
+    def drop_table(self, table_name: str):
+        for name in [name for name, tree in self.indexes.items() if tree.meta["table"] == table_name.lower()]:
+            self.drop(name)
+
+    def on_table(self, table_name: str) -> list[BPlusTree]:
+        return [tree for tree in self.indexes.values() if tree.meta["table"] == table_name.lower()]
+
+    def find(self, table_name: str, column: str) -> BPlusTree | None:
+        """
+        A clean index on a column, pinned for the caller. A dirty index is
+        not returned; it is rebuilt in the background and the caller scans
+        the table meanwhile.
+        """
+        with self.lock:
+            for tree in self.on_table(table_name):
+                if tree.meta["column"].lower() == column.lower():
+                    if tree.dirty:
+                        self.rebuild_later(tree)
+                        return None
+                    tree.pin()
+                    return tree
+        return None
+
+    def rebuild_later(self, tree: BPlusTree):
+        name = tree.meta["name"]
+        if name not in self.rebuilding:
+            thread = threading.Thread(target=self.rebuild, args=(tree,), name=f"index-rebuild-{name}", daemon=True)
+            self.rebuilding[name] = thread
+            thread.start()
+
+    def rebuild(self, tree: BPlusTree):
+        """
+        Rebuild a dirty index from its table. The table is read under a shared
+        lock, so no write is in progress, and the new tree replaces the old
+        one before the lock is released. A rebuild that cannot get the lock
+        leaves the index dirty, to be tried again on its next use.
+        """
+        meta = tree.meta
+        session_id = next(self.rebuild_sessions)
+        try:
+            if self.lock_manager is not None:
+                self.lock_manager.acquire(session_id, meta["table"], SHARED)
+            entries = self.entries(meta["table"], meta["position"])
+            with self.lock:
+                if self.indexes.get(meta["name"]) is tree:
+                    self.replace(tree, BPlusTree.build(tree.path, entries, meta))
+        except (LockError, OSError, ValueError):
+            pass
+        finally:
+            if self.lock_manager is not None:
+                self.lock_manager.release_all(session_id)
+            with self.lock:
+                self.rebuilding.pop(meta["name"], None)
+
+    def compact(self, tree: BPlusTree) -> BPlusTree:
+        """Rewrite a tree from its own entries, which come out of it in key order."""
+        position = tree.meta["position"]
+        entries = [(index_key(row[position]), row) for row in tree.range()]
+        return self.replace(tree, BPlusTree.build(tree.path, entries, tree.meta))
+
+    def replace(self, tree: BPlusTree, rebuilt: BPlusTree) -> BPlusTree:
+        tree.close()
+        self.indexes[tree.meta["name"]] = rebuilt
+        return rebuilt
+
+    def insert_rows(self, table_name: str, rows: list[list]):
+        with self.lock:
+            trees = self.clean_on(table_name)
+            if not trees:
+                return
+            types = [attr[1] for attr in self.storage_manager.get_table_schema(table_name).get_metadata()]
+            rows = [[coerce_value(value, dtype) for value, dtype in zip(row, types)] for row in rows]
+            for tree in trees:
+                position = tree.meta["position"]
+                tree.insert_many([(index_key(row[position]), row) for row in rows if row[position] is not None])
+                self.compact_if_needed(tree)
+
+    def clean_on(self, table_name: str) -> list[BPlusTree]:
+        return [tree for tree in self.on_table(table_name) if not tree.dirty]
+
+    def delete_rows(self, table_name: str, where_clause: str | None):
+        with self.lock:
+            trees = self.clean_on(table_name)
+            if not trees:
+                return
+            predicate = self.where_predicate(table_name, where_clause)
+            for tree in trees:
+                if predicate is None:
+                    tree.mark_dirty()
+                    continue
+                tree.remove_where(predicate, **self.bounds(tree, where_clause))
+                self.compact_if_needed(tree)
+
+    def update_rows(self, table_name: str, update_values: dict[str, str], where_clause: str | None):
+        with self.lock:
+            trees = self.clean_on(table_name)
+            if not trees:
+                return
+            metadata = self.storage_manager.get_table_schema(table_name).get_metadata()
+            assignments = literal_assignments(metadata, update_values)
+            predicate = self.where_predicate(table_name, where_clause)
+            for tree in trees:
+                if assignments is None or predicate is None:
+                    tree.mark_dirty()
+                    continue
+                position = tree.meta["position"]
+                rows = [
+                    [assignments.get(column, value) for column, value in enumerate(row)]
+                    for row in tree.remove_where(predicate, **self.bounds(tree, where_clause))
+                ]
+                tree.insert_many([(index_key(row[position]), row) for row in rows if row[position] is not None])
+                self.compact_if_needed(tree)
+
+    def where_predicate(self, table_name: str, where_clause: str | None):
+        if not where_clause:
+            return lambda row: True
+        return compile_where(self.storage_manager, table_name, where_clause)
+
+    def bounds(self, tree: BPlusTree, where_clause: str | None) -> dict:
+        if not where_clause:
+            return {}
+        meta = tree.meta
+        return where_bounds(self.storage_manager, meta["table"], where_clause, meta["position"], meta["dtype"])
+
+    def compact_if_needed(self, tree: BPlusTree):
+        if tree.needs_compaction():
+            self.compact(tree)
+
+    def is_selective(self, tree: BPlusTree, comparator: str, value, row_count: int, distinct: int | None) -> bool:
+        """
+        Whether an index scan for `column comparator value` is expected to
+        return at most INDEX_SELECTIVITY of the table. Equality uses the
+        number of distinct values from the table statistics; ranges
+        interpolate between the smallest and largest key of a numeric index.
+        """
+        if row_count <= 0:
+            return False
+        if comparator in ("=", "=="):
+            return not distinct or 1 / distinct <= INDEX_SELECTIVITY
+        low, high = tree.bounds()
+        numeric = all(isinstance(key, (int, float)) for key in (low, high, value))
+        if not numeric or high == low:
+            return DEFAULT_RANGE_SELECTIVITY <= INDEX_SELECTIVITY
+        fraction = (value - low) / (high - low)
+        fraction = fraction if comparator in ("<", "<=") else 1 - fraction
+        return min(max(fraction, 0.0), 1.0) <= INDEX_SELECTIVITY
+
+
+class IndexScan(Operator):
+    """Reads the rows of a table whose indexed column satisfies one comparison."""
+    BOUNDS = {
+        "=": lambda value: dict(low=value, high=value),
+        "==": lambda value: dict(low=value, high=value),
+        "<": lambda value: dict(high=value, high_inclusive=False),
+        "<=": lambda value: dict(high=value),
+        ">": lambda value: dict(low=value, low_inclusive=False),
+        ">=": lambda value: dict(low=value),
+    }
+
+    def __init__(self, storage_manager, tree: BPlusTree, table_name: str, comparator: str, value, alias: str = None):
+        """Takes over the pin on `tree` that IndexCatalog.find returned it with."""
+        self.tree = tree
+        self.pinned = True
+        self.table_name = table_name
+        self.comparator = comparator
+        self.value = value
+        schema = storage_manager.get_table_schema(table_name)
+        super().__init__(schema_columns(schema, alias or table_name))
+
+    def __iter__(self):
+        for row in self.tree.range(**self.BOUNDS[self.comparator](self.value)):
+            yield list(row)
+
+    def close(self):
+        if self.pinned:
+            self.pinned = False
+            self.tree.release()
+        super().close()
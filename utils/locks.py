@@ -0,0 +1,106 @@
+# locks.py
+import threading
+import time
+from dataclasses import dataclass
+
+SHARED = "S"
+EXCLUSIVE = "X"
+LOCK_TIMEOUT = 30.0
+
+
+class LockError(RuntimeError):
+    pass
+
+
+class DeadlockError(LockError):
+    pass
+
+
+@dataclass
+class LockStats:
+    acquired: int = 0
+    waits: int = 0
+    deadlocks: int = 0
+    timeouts: int = 0
+
+
+class LockManager:
+    """
+    Table-level shared/exclusive locks held by sessions. Any number of
+    sessions may hold a shared lock on a table, an exclusive lock excludes
+    every other session. Locks are reentrant, and a session that is the only
+    holder of a shared lock can upgrade it to exclusive.
+
+    A session that has to wait is added to the wait-for graph. If waiting
+    would close a cycle, the request fails with a DeadlockError instead, and
+    a request that is still waiting after `timeout` seconds fails with a
+    LockError.
+    """
+    def __init__(self, timeout: float = LOCK_TIMEOUT):
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.holders: dict[str, dict[int, str]] = {}
+        self.waiting: dict[int, tuple[str, str]] = {}
+        self.stats = LockStats()
+
+    def acquire(self, session_id: int, table: str, mode: str):
+        with self.condition:
+            held = self.holders.get(table, {}).get(session_id)
+            if held == EXCLUSIVE or held == mode:
+                return
+            deadline = time.monotonic() + self.timeout
+            waited = False
+            try:
+                while not self.is_compatible(self.holders.get(table, {}), session_id, mode):
+                    self.waiting[session_id] = (table, mode)
+                    if self.closes_cycle(session_id):
+                        self.stats.deadlocks += 1
+                        raise DeadlockError(f"Error: Deadlock detected while locking table '{table}'.")
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats.timeouts += 1
+                        raise LockError(f"Error: Timed out waiting for a lock on table '{table}'.")
+                    waited = True
+                    self.condition.wait(remaining)
+            finally:
+                self.waiting.pop(session_id, None)
+            self.holders.setdefault(table, {})[session_id] = mode
+            self.stats.acquired += 1
+            self.stats.waits += waited
+
+    def release_all(self, session_id: int):
+        with self.condition:
+            for table in [table for table, holders in self.holders.items() if session_id in holders]:
+                del self.holders[table][session_id]
+                if not self.holders[table]:
+                    del self.holders[table]
+            self.condition.notify_all()
+
+    def held_by(self, session_id: int) -> dict[str, str]:
+        with self.condition:
+            return {table: holders[session_id] for table, holders in self.holders.items() if session_id in holders}
+
+    def is_compatible(self, holders: dict[int, str], session_id: int, mode: str) -> bool:
+        others = [held for holder, held in holders.items() if holder != session_id]
+        return not others or (mode == SHARED and EXCLUSIVE not in others)
+
+    def blockers(self, session_id: int) -> list[int]:
+        table, mode = self.waiting[session_id]
+        return [
+            holder for holder, held in self.holders.get(table, {}).items()
+            if holder != session_id and (mode == EXCLUSIVE or held == EXCLUSIVE)
+        ]
+
+    def closes_cycle(self, session_id: int) -> bool:
+        """Whether the wait-for graph has a path from the sessions blocking `session_id` back to it."""
+        visited = set()
+        stack = self.blockers(session_id)
+        while stack:
+            blocker = stack.pop()
+            if blocker == session_id:
+                return True
+            if blocker in visited or blocker not in self.waiting:
+                continue
+            visited.add(blocker)
+            stack.extend(self.blockers(blocker))
+        return False
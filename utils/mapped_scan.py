@@ -0,0 +1,99 @@
+# mapped_scan.py
+import mmap
+from dataclasses import dataclass
+
+from utils.operators import TableScan
+from utils.predicate import column_references, compile_predicate
+from utils.table_file import STRING_TYPES, TableFormatError, iter_rows, read_header, table_path
+
+
+@dataclass
+class MappedScanStats:
+    scans: int = 0
+    rows: int = 0
+    filtered: int = 0
+    fallbacks: int = 0
+
+
+class MappedScan(TableScan):
+    """
+    Reads a table by mapping its file into memory and walking the row blocks
+    over a memoryview of the mapping, so no page is copied into a bytes
+    object. Only the columns kept by `project` are decoded.
+
+    A WHERE condition given to `filter` is evaluated while the file is
+    walked. String columns it does not read are decoded only for the rows
+    that pass, so a wide varchar column costs nothing for filtered-out rows.
+
+    When the file is missing or its header is not in the expected layout, or
+    a Storage Manager Condition was pushed into the scan, the rows are read
+    through the Storage Manager as by a TableScan. A damaged row block
+    further into the file raises a TableFormatError.
+    """
+    def __init__(self, storage_manager, base_path: str, table_name: str, alias: str = None,
+                 stats: MappedScanStats = None):
+        super().__init__(storage_manager, table_name, alias)
+        self.path = table_path(base_path, table_name)
+        self.predicate = None
+        self.late = []
+        self.stats = stats if stats is not None else MappedScanStats()
+
+    def filter(self, expression):
+        """Evaluate a predicate over the current columns inside the scan."""
+        self.predicate = compile_predicate(expression, self.columns)
+        used = {self.column_index(name) for name in column_references(expression)}
+        self.late = [
+            slot for slot, column in enumerate(self.columns)
+            if column.dtype in STRING_TYPES and slot not in used
+        ]
+
+    def is_full_scan(self) -> bool:
+        return super().is_full_scan() and self.predicate is None
+
+    def __iter__(self):
+        self.stats.scans += 1
+        if self.condition is not None:
+            yield from self.fallback()
+            return
+        try:
+            f = open(self.path, "rb")
+        except OSError:
+            yield from self.fallback()
+            return
+        with f:
+            try:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                yield from self.fallback()
+                return
+            try:
+                with memoryview(mapping) as view:
+                    yield from self.scan(view)
+            finally:
+                mapping.close()
+
+    def scan(self, view):
+        try:
+            header = read_header(view)
+        except TableFormatError:
+            header = None
+        if header is None or len(header.metadata) != len(self.table_columns):
+            yield from self.fallback()
+            return
+
+        produced = 0
+        try:
+            for row in iter_rows(view, header, self.positions, self.predicate, self.late):
+                produced += 1
+                yield row
+        finally:
+            self.stats.rows += produced
+        if self.predicate is not None:
+            self.stats.filtered += header.row_count - produced
+
+    def fallback(self):
+        self.stats.fallbacks += 1
+        predicate = self.predicate
+        for row in super().__iter__():
+            if predicate is None or predicate(row):
+                yield row
@@ -2,6 +2,8 @@ from datetime import datetime
 from typing import Generic, List, TypeVar, Union, Dict, Optional
 from dataclasses import dataclass
 
+from utils.cursor import Cursor
+
 T = TypeVar('T')
 
 @dataclass
@@ -19,4 +21,5 @@ class ExecutionResult:
     status: str
     query: str
     previous_data: Union[Rows, int, None]
-    new_data: Union[Rows, int, None]
\ No newline at end of file
+    new_data: Union[Rows, int, None]
+    cursor: Optional[Cursor] = None
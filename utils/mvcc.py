@@ -0,0 +1,190 @@
+# mvcc.py
+import math
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable
+
+from utils.operators import Operator, schema_columns
+
+GC_INTERVAL = 10.0
+
+
+@dataclass
+class RowVersion:
+    row: list
+    begin: int
+    end: float = math.inf
+
+    def visible_at(self, timestamp: int) -> bool:
+        return self.begin <= timestamp < self.end
+
+
+@dataclass
+class RowChange:
+    """
+    One write to publish. The current versions matching `predicate` are
+    ended; with `assignments` (column position to value) each of them gets a
+    new version with those columns set, as an UPDATE does. `rows` are added.
+    """
+    predicate: Callable[[list], bool] | None = None
+    assignments: dict[int, object] | None = None
+    rows: list[list] = field(default_factory=list)
+
+
+@dataclass
+class VersionStoreStats:
+    snapshots: int = 0
+    refreshes: int = 0
+    versions: int = 0
+    collected: int = 0
+
+
+class VersionStore:
+    """
+    Committed versions of the rows of every table read under snapshot
+    isolation. Each version is stamped with the commit timestamp that created
+    it and the one that replaced or deleted it, so a reader holding snapshot
+    timestamp T sees exactly the rows committed at or before T.
+
+    A table is loaded the first time it is read. When a session commits,
+    `publish` applies the writes it made to loaded tables and stamps them all
+    with one new commit timestamp. A background thread drops the versions
+    that ended before the oldest active snapshot every `gc_interval` seconds.
+    """
+    def __init__(self, gc_interval: float | None = GC_INTERVAL):
+        self.lock = threading.Lock()
+        self.versions: dict[str, list[RowVersion]] = {}
+        self.timestamp = 0
+        self.snapshots: Counter[int] = Counter()
+        self.stats = VersionStoreStats()
+        self.gc_interval = gc_interval
+        self.stopped = threading.Event()
+        self.gc_thread = None
+        if gc_interval:
+            self.gc_thread = threading.Thread(target=self.run_gc, name="mvcc-gc", daemon=True)
+            self.gc_thread.start()
+
+    def __contains__(self, table_name: str) -> bool:
+        with self.lock:
+            return table_name in self.versions
+
+    def load(self, table_name: str, rows: list[list]):
+        """Add a table whose rows are all committed, as of the current timestamp."""
+        with self.lock:
+            if table_name in self.versions:
+                return
+            self.versions[table_name] = [RowVersion(list(row), self.timestamp) for row in rows]
+            self.stats.versions += len(rows)
+
+    def begin_snapshot(self) -> int:
+        with self.lock:
+            self.snapshots[self.timestamp] += 1
+            self.stats.snapshots += 1
+            return self.timestamp
+
+    def end_snapshot(self, timestamp: int):
+        with self.lock:
+            self.snapshots[timestamp] -= 1
+            if self.snapshots[timestamp] <= 0:
+                del self.snapshots[timestamp]
+
+    def read(self, table_name: str, timestamp: int) -> list[list]:
+        with self.lock:
+            versions = self.versions[table_name]
+            return [list(version.row) for version in versions if version.visible_at(timestamp)]
+
+    def publish(self, changes: dict[str, list[RowChange]], reloads: dict[str, list[list]] = None):
+        """
+        Publish the writes of one commit at a single new timestamp. `changes`
+        holds the writes to each table as its statements made them. A table
+        whose writes could not be described that way is given in `reloads`
+        with all of its committed rows, which are compared with its versions.
+        """
+        with self.lock:
+            timestamp = self.timestamp + 1
+            for table_name, table_changes in changes.items():
+                versions = self.versions.get(table_name)
+                if versions is None:
+                    continue
+                for change in table_changes:
+                    self.apply(versions, change, timestamp)
+            for table_name, rows in (reloads or {}).items():
+                versions = self.versions.get(table_name)
+                if versions is not None:
+                    self.compare(versions, rows, timestamp)
+            self.timestamp = timestamp
+            self.stats.refreshes += 1
+
+    def apply(self, versions: list[RowVersion], change: RowChange, timestamp: int):
+        added = [list(row) for row in change.rows]
+        if change.predicate is not None:
+            for version in versions:
+                if version.end != math.inf or not change.predicate(version.row):
+                    continue
+                version.end = timestamp
+                if change.assignments is not None:
+                    added.append([change.assignments.get(position, value) for position, value in enumerate(version.row)])
+        versions.extend(RowVersion(row, timestamp) for row in added)
+        self.stats.versions += len(added)
+
+    def compare(self, versions: list[RowVersion], rows: list[list], timestamp: int):
+        """End the versions whose row is gone and add a version for each new row."""
+        remaining = Counter(tuple(row) for row in rows)
+        for version in versions:
+            if version.end != math.inf:
+                continue
+            key = tuple(version.row)
+            if remaining[key] > 0:
+                remaining[key] -= 1
+            else:
+                version.end = timestamp
+        for row in rows:
+            key = tuple(row)
+            if remaining[key] > 0:
+                remaining[key] -= 1
+                versions.append(RowVersion(list(row), timestamp))
+                self.stats.versions += 1
+
+    def drop(self, table_name: str):
+        with self.lock:
+            versions = self.versions.pop(table_name, None)
+            if versions is not None:
+                self.stats.versions -= len(versions)
+
+    def collect(self) -> int:
+        """Remove the versions no active or future snapshot can see."""
+        with self.lock:
+            horizon = min(self.snapshots, default=self.timestamp)
+            collected = 0
+            for table_name, versions in self.versions.items():
+                live = [version for version in versions if version.end > horizon]
+                collected += len(versions) - len(live)
+                self.versions[table_name] = live
+            self.stats.versions -= collected
+            self.stats.collected += collected
+            return collected
+
+    def run_gc(self):
+        while not self.stopped.wait(self.gc_interval):
+            self.collect()
+
+    def close(self):
+        """Stop the garbage collection thread."""
+        self.stopped.set()
+        if self.gc_thread is not None:
+            self.gc_thread.join()
+
+
+class SnapshotScan(Operator):
+    """Reads the rows of a table visible at a snapshot timestamp."""
+    def __init__(self, storage_manager, version_store: VersionStore, table_name: str,
+                 timestamp: int, alias: str = None):
+        self.version_store = version_store
+        self.table_name = table_name
+        self.timestamp = timestamp
+        schema = storage_manager.get_table_schema(table_name)
+        super().__init__(schema_columns(schema, alias or table_name))
+
+    def __iter__(self):
+        yield from self.version_store.read(self.table_name, self.timestamp)
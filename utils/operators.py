@@ -0,0 +1,630 @@
+# operators.py
+import heapq
+import itertools
+import re
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from utils.spill import SpillFile, estimate_row_size
+
+
+@dataclass(frozen=True)
+class Column:
+    table: Optional[str]
+    name: str
+    dtype: Optional[str] = None
+    size: Optional[int] = None
+    alias: Optional[str] = None
+
+
+def resolve_column(columns: List[Column], name: str) -> int:
+    """Find the index of a (possibly table-qualified) column name."""
+    name = name.strip()
+    qualified = re.match(r"^(\w+)\.(\w+)$", name)
+    table, column = qualified.groups() if qualified else ('', name)
+    matches = [
+        idx for idx, col in enumerate(columns)
+        if col.name == column and (not table or col.table == table)
+    ] or [
+        idx for idx, col in enumerate(columns)
+        if not table and col.alias == name
+    ]
+    if not matches:
+        raise ValueError(f"Error: Column '{name}' does not exist.")
+    if len(matches) > 1:
+        raise ValueError(f"Error: Column '{name}' is ambiguous.")
+    return matches[0]
+
+
+def output_names(columns: List[Column]) -> List[str]:
+    """Column names for the result, qualified only where a bare name would clash."""
+    counts = {}
+    for col in columns:
+        counts[col.name] = counts.get(col.name, 0) + 1
+    return [
+        f"{col.table}.{col.name}" if counts[col.name] > 1 and col.table else col.name
+        for col in columns
+    ]
+
+
+def parse_literal(text: str):
+    """Convert a literal from a query string into a Python value."""
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in ("'", '"'):
+        return text
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def normalize_value(value):
+    """Strip the quotes strings are stored with so values compare by content."""
+    if isinstance(value, str) and len(value) >= 2 and value[0] == value[-1] and value[0] in ("'", '"'):
+        return value[1:-1]
+    return value
+
+
+class Operator:
+    """
+    Base class of the pull-based execution engine. An operator is an iterable of
+    rows that pulls from its children only as its own rows are requested.
+    """
+    def __init__(self, columns: List[Column], children: List['Operator'] = None):
+        self.columns = columns
+        self.children = children or []
+
+    def __iter__(self) -> Iterator[list]:
+        raise NotImplementedError
+
+    def close(self):
+        """Release resources held by this operator and its children."""
+        for child in self.children:
+            child.close()
+
+    def column_index(self, name: str) -> int:
+        return resolve_column(self.columns, name)
+
+
+def schema_columns(schema, qualifier: str) -> List[Column]:
+    """Columns of a Storage Manager schema, qualified by a table name or alias."""
+    return [
+        Column(qualifier, attr[0], attr[1] if len(attr) > 1 else None, attr[2] if len(attr) > 2 else None)
+        for attr in schema.get_metadata()
+    ]
+
+
+class TableScan(Operator):
+    """
+    Reads the rows of a table, optionally with a condition pushed into storage.
+    After `project`, rows carry only the kept columns, in table order.
+    """
+    def __init__(self, storage_manager, table_name: str, alias: str = None, condition=None):
+        self.storage_manager = storage_manager
+        self.table_name = table_name
+        self.condition = condition
+        schema = storage_manager.get_table_schema(table_name)
+        super().__init__(schema_columns(schema, alias or table_name))
+        self.table_columns = self.columns
+        self.positions = None
+
+    def project(self, positions: List[int]):
+        """Keep only the columns at `positions` (indexes into the current columns)."""
+        current = self.positions if self.positions is not None else list(range(len(self.columns)))
+        keep = sorted(set(positions))
+        self.positions = [current[idx] for idx in keep]
+        self.columns = [self.columns[idx] for idx in keep]
+
+    def is_full_scan(self) -> bool:
+        """Whether the scan yields every row of the table with every column."""
+        return self.condition is None and self.positions is None
+
+    def __iter__(self):
+        if self.condition is not None:
+            table_data = self.storage_manager.get_table_data(self.table_name, self.condition)
+        else:
+            table_data = self.storage_manager.get_table_data(self.table_name)
+        if self.positions is None:
+            yield from table_data or []
+            return
+        positions = self.positions
+        for row in table_data or []:
+            yield [row[idx] for idx in positions]
+
+
+class Filter(Operator):
+    """Passes through the rows of its child that satisfy a predicate."""
+    def __init__(self, child: Operator, predicate: Callable[[list], bool]):
+        super().__init__(child.columns, [child])
+        self.predicate = predicate
+
+    def __iter__(self):
+        yield from filter(self.predicate, self.children[0])
+
+
+class Project(Operator):
+    """Keeps the selected columns of every row, in the selected order."""
+    def __init__(self, child: Operator, items: List[Tuple[str, Optional[str]]]):
+        self.indices = [child.column_index(name) for name, _ in items]
+        columns = [
+            Column(
+                child.columns[idx].table, child.columns[idx].name,
+                child.columns[idx].dtype, child.columns[idx].size, alias
+            )
+            for idx, (_, alias) in zip(self.indices, items)
+        ]
+        super().__init__(columns, [child])
+
+    def __iter__(self):
+        indices = self.indices
+        for row in self.children[0]:
+            yield [row[idx] for idx in indices]
+
+
+class Descending:
+    """Wraps a sort key value so that it orders in reverse."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def make_sort_key(columns: List[Column], keys: List[Tuple[str, bool]]) -> Callable[[list], tuple]:
+    """
+    Build a key function for `sorted`/`heapq` from (column, descending) pairs.
+    Descending keys are wrapped so one ascending pass handles mixed orders.
+    """
+    resolved = [(resolve_column(columns, name), descending) for name, descending in keys]
+    if all(not descending for _, descending in resolved):
+        indices = [idx for idx, _ in resolved]
+        if len(indices) == 1:
+            index = indices[0]
+            return lambda row: row[index]
+        return lambda row: tuple(row[idx] for idx in indices)
+    return lambda row: tuple(
+        Descending(row[idx]) if descending else row[idx] for idx, descending in resolved
+    )
+
+
+@dataclass
+class SortStats:
+    sorts: int = 0
+    runs_spilled: int = 0
+    bytes_written: int = 0
+    merge_passes: int = 0
+
+
+class Sort(Operator):
+    """
+    External merge sort. Rows are sorted in memory until `memory_budget` bytes
+    are buffered, then the sorted run is spilled to a temp file in `spill_dir`.
+    Spilled runs are k-way merged back into a single stream. Without a budget
+    the whole input is sorted in memory.
+    """
+    def __init__(self, child: Operator, keys: List[Tuple[str, bool]], memory_budget: int = None,
+                 spill_dir: str = None, stats: SortStats = None, max_fan_in: int = 64):
+        super().__init__(child.columns, [child])
+        self.keys = keys
+        self.sort_key = make_sort_key(child.columns, keys)
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.stats = stats if stats is not None else SortStats()
+        self.max_fan_in = max(2, max_fan_in)
+        self.runs = []
+
+    def __iter__(self):
+        self.stats.sorts += 1
+        if self.memory_budget is None or self.spill_dir is None:
+            yield from sorted(self.children[0], key=self.sort_key)
+            return
+
+        buffer = []
+        buffered_bytes = 0
+        for row in self.children[0]:
+            buffer.append(row)
+            buffered_bytes += estimate_row_size(row)
+            if buffered_bytes >= self.memory_budget:
+                buffer.sort(key=self.sort_key)
+                self.spill_run(buffer)
+                buffer = []
+                buffered_bytes = 0
+        buffer.sort(key=self.sort_key)
+
+        if not self.runs:
+            yield from buffer
+            return
+
+        if buffer:
+            self.spill_run(buffer)
+            buffer = []
+        while len(self.runs) > self.max_fan_in:
+            self.merge_runs()
+        self.stats.merge_passes += 1
+        yield from heapq.merge(*self.runs, key=self.sort_key)
+        self.close_runs()
+
+    def spill_run(self, rows: Iterable[list]):
+        run = SpillFile(self.spill_dir, "sort_run_")
+        run.write_all(rows)
+        self.runs.append(run)
+        self.stats.runs_spilled += 1
+        self.stats.bytes_written += run.bytes_written
+
+    def merge_runs(self):
+        """
+        One merge pass: each group of `max_fan_in` consecutive runs is merged
+        into a single run. Runs stay in input order so equal keys keep their
+        order, and every pass divides the number of runs by the fan-in.
+        """
+        runs, self.runs = self.runs, []
+        self.stats.merge_passes += 1
+        for start in range(0, len(runs), self.max_fan_in):
+            merging = runs[start:start + self.max_fan_in]
+            if len(merging) == 1:
+                self.runs.append(merging[0])
+                continue
+            self.spill_run(heapq.merge(*merging, key=self.sort_key))
+            for run in merging:
+                run.close()
+
+    def close_runs(self):
+        for run in self.runs:
+            run.close()
+        self.runs = []
+
+    def close(self):
+        self.close_runs()
+        super().close()
+
+
+class TopN(Operator):
+    """
+    ORDER BY ... LIMIT k in one pass: keeps only the best `count` rows in a
+    bounded heap, so it costs O(n log k) time and O(k) memory.
+    """
+    def __init__(self, child: Operator, keys: List[Tuple[str, bool]], count: int):
+        super().__init__(child.columns, [child])
+        self.keys = keys
+        self.count = count
+        self.sort_key = make_sort_key(child.columns, keys)
+
+    def __iter__(self):
+        yield from heapq.nsmallest(self.count, self.children[0], key=self.sort_key)
+
+
+class Limit(Operator):
+    """Stops pulling from its child once `count` rows have been produced."""
+    def __init__(self, child: Operator, count: int):
+        super().__init__(child.columns, [child])
+        self.count = count
+
+    def __iter__(self):
+        yield from itertools.islice(self.children[0], self.count)
+
+
+class NestedLoopJoin(Operator):
+    """
+    Joins two inputs by testing every pair of rows. The right input is read once
+    and kept in memory; the left input is streamed.
+    """
+    def __init__(self, left: Operator, right: Operator, predicate: Callable[[list], bool] = None):
+        super().__init__(left.columns + right.columns, [left, right])
+        self.predicate = predicate
+
+    def __iter__(self):
+        left, right = self.children
+        inner = list(right)
+        predicate = self.predicate
+        for left_row in left:
+            for right_row in inner:
+                row = left_row + right_row
+                if predicate is None or predicate(row):
+                    yield row
+
+
+@dataclass
+class JoinStats:
+    hash_joins: int = 0
+    merge_joins: int = 0
+    prebuilt_joins: int = 0
+    partitions_spilled: int = 0
+    bytes_written: int = 0
+
+
+def make_join_key(indices: List[int], normalize: bool = True) -> Callable[[list], Optional[tuple]]:
+    """Key function for equi-joins. Rows with a NULL key never match, so they map to None."""
+    def join_key(row):
+        if normalize:
+            key = tuple(normalize_value(row[idx]) for idx in indices)
+        else:
+            key = tuple(row[idx] for idx in indices)
+        return None if None in key else key
+    return join_key
+
+
+class HashJoin(Operator):
+    """
+    Equi-join that builds a hash table on one input and probes it with the other.
+    When the build side outgrows `memory_budget`, both inputs are split into
+    partitions on disk by key hash and each pair of partitions is joined in turn.
+    Output rows are always the left columns followed by the right columns.
+
+    A `build_table` that already maps the keys of the build side to its rows,
+    such as the buckets of a hash index, is probed directly through its `get`
+    and the build input is not read.
+    """
+    def __init__(self, left: Operator, right: Operator, left_keys: List[int], right_keys: List[int],
+                 build_left: bool = False, memory_budget: int = None, spill_dir: str = None,
+                 stats: JoinStats = None, partitions: int = 16, build_table: dict = None):
+        super().__init__(left.columns + right.columns, [left, right])
+        self.left_key = make_join_key(left_keys)
+        self.right_key = make_join_key(right_keys)
+        self.build_left = build_left
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.stats = stats if stats is not None else JoinStats()
+        self.partitions = partitions
+        self.build_table = build_table
+        self.spill_files = []
+
+    def __iter__(self):
+        self.stats.hash_joins += 1
+        left, right = self.children
+        if self.build_left:
+            build, build_key, probe, probe_key = left, self.left_key, right, self.right_key
+        else:
+            build, build_key, probe, probe_key = right, self.right_key, left, self.left_key
+
+        if self.build_table is not None:
+            self.stats.prebuilt_joins += 1
+            yield from self.probe(self.build_table, probe, probe_key)
+            return
+
+        table = {}
+        used_bytes = 0
+        build_rows = iter(build)
+        for row in build_rows:
+            key = build_key(row)
+            if key is None:
+                continue
+            table.setdefault(key, []).append(row)
+            if self.memory_budget is not None and self.spill_dir is not None:
+                used_bytes += estimate_row_size(row)
+                if used_bytes >= self.memory_budget:
+                    yield from self.partitioned_join(table, build_rows, build_key, probe, probe_key)
+                    return
+
+        yield from self.probe(table, probe, probe_key)
+
+    def probe(self, table: dict, probe: Iterable[list], probe_key: Callable) -> Iterator[list]:
+        build_left = self.build_left
+        for row in probe:
+            matches = table.get(probe_key(row))
+            if matches:
+                if build_left:
+                    for match in matches:
+                        yield match + row
+                else:
+                    for match in matches:
+                        yield row + match
+
+    def partitioned_join(self, table: dict, build_rows: Iterator[list], build_key: Callable,
+                         probe: Iterable[list], probe_key: Callable) -> Iterator[list]:
+        build_parts = self.partition(
+            itertools.chain((row for rows in table.values() for row in rows), build_rows), build_key
+        )
+        table.clear()
+        probe_parts = self.partition(probe, probe_key)
+        for build_part, probe_part in zip(build_parts, probe_parts):
+            part_table = {}
+            for row in build_part:
+                part_table.setdefault(build_key(row), []).append(row)
+            yield from self.probe(part_table, probe_part, probe_key)
+            build_part.close()
+            probe_part.close()
+
+    def partition(self, rows: Iterable[list], key: Callable) -> List[SpillFile]:
+        parts = [SpillFile(self.spill_dir, "join_part_") for _ in range(self.partitions)]
+        self.spill_files.extend(parts)
+        for row in rows:
+            row_key = key(row)
+            if row_key is not None:
+                parts[hash(row_key) % self.partitions].write(row)
+        for part in parts:
+            part.flush()
+            self.stats.partitions_spilled += 1
+            self.stats.bytes_written += part.bytes_written
+        return parts
+
+    def close(self):
+        for spill_file in self.spill_files:
+            spill_file.close()
+        self.spill_files = []
+        super().close()
+
+
+class SortMergeJoin(Operator):
+    """
+    Equi-join of two inputs that are both already sorted ascending on their join
+    keys. Rows sharing a key on the right are buffered so duplicates on both
+    sides produce every pair.
+    """
+    def __init__(self, left: Operator, right: Operator, left_keys: List[int], right_keys: List[int],
+                 stats: JoinStats = None):
+        super().__init__(left.columns + right.columns, [left, right])
+        self.left_key = make_join_key(left_keys, normalize=False)
+        self.right_key = make_join_key(right_keys, normalize=False)
+        self.stats = stats if stats is not None else JoinStats()
+
+    def __iter__(self):
+        self.stats.merge_joins += 1
+        left, right = self.children
+        left_key, right_key = self.left_key, self.right_key
+        right_rows = iter(right)
+
+        def next_right():
+            for row in right_rows:
+                key = right_key(row)
+                if key is not None:
+                    return key, row
+            return None, None
+
+        group_key, group = None, []
+        pending_key, pending_row = next_right()
+        for row in left:
+            key = left_key(row)
+            if key is None:
+                continue
+            if key != group_key:
+                while pending_row is not None and pending_key < key:
+                    pending_key, pending_row = next_right()
+                group_key, group = key, []
+                while pending_row is not None and pending_key == key:
+                    group.append(pending_row)
+                    pending_key, pending_row = next_right()
+            for match in group:
+                yield row + match
+
+
+class Accumulator:
+    """Running state of one aggregate function for one group."""
+    __slots__ = ('function', 'distinct', 'seen', 'count', 'value')
+
+    def __init__(self, function: str, distinct: bool = False):
+        self.function = function
+        self.distinct = distinct
+        self.seen = set() if distinct else None
+        self.count = 0
+        self.value = None
+
+    def add(self, value):
+        if value is None:
+            return
+        if self.seen is not None:
+            if value in self.seen:
+                return
+            self.seen.add(value)
+        self.count += 1
+        function = self.function
+        if function in ('SUM', 'AVG'):
+            self.value = value if self.value is None else self.value + value
+        elif function == 'MIN':
+            if self.value is None or value < self.value:
+                self.value = value
+        elif function == 'MAX':
+            if self.value is None or value > self.value:
+                self.value = value
+
+    def result(self):
+        if self.function == 'COUNT':
+            return self.count
+        if self.function == 'AVG':
+            return self.value / self.count if self.count else None
+        return self.value
+
+
+@dataclass
+class AggregateStats:
+    aggregations: int = 0
+    groups: int = 0
+    partitions_spilled: int = 0
+    bytes_written: int = 0
+
+
+class HashAggregate(Operator):
+    """
+    Groups the rows of its child by `group_indices` in a hash table and computes
+    the aggregate `calls` for every group. Each call is (function, argument index
+    or None for COUNT(*), distinct). Once the groups held in memory reach
+    `memory_budget` bytes, rows of groups not seen yet are written to partitions
+    on disk by key hash and aggregated one partition at a time afterwards.
+    Output rows are the group columns followed by the aggregate results.
+    """
+    def __init__(self, child: Operator, group_indices: List[int], calls: List[Tuple[str, Optional[int], bool]],
+                 names: List[str], memory_budget: int = None, spill_dir: str = None,
+                 stats: AggregateStats = None, partitions: int = 16, max_depth: int = 4):
+        columns = [child.columns[idx] for idx in group_indices]
+        for (function, argument, _), name in zip(calls, names):
+            if function == 'COUNT':
+                dtype, size = 'int', 4
+            elif function == 'AVG':
+                dtype, size = 'float', 4
+            else:
+                dtype, size = child.columns[argument].dtype, child.columns[argument].size
+            columns.append(Column(None, name, dtype, size))
+        super().__init__(columns, [child])
+        self.group_indices = group_indices
+        self.calls = calls
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.stats = stats if stats is not None else AggregateStats()
+        self.partitions = partitions
+        self.max_depth = max_depth
+        self.spill_files = []
+
+    def __iter__(self):
+        self.stats.aggregations += 1
+        empty = True
+        for row in self.aggregate_groups(self.children[0], 0):
+            empty = False
+            yield row
+        if empty and not self.group_indices:
+            # Aggregating without GROUP BY gives one row even for an empty input
+            yield [acc.result() for acc in self.new_accumulators()]
+
+    def new_accumulators(self) -> List[Accumulator]:
+        return [Accumulator(function, distinct) for function, _, distinct in self.calls]
+
+    def aggregate_groups(self, rows: Iterable[list], depth: int) -> Iterator[list]:
+        group_indices = self.group_indices
+        arguments = [argument for _, argument, _ in self.calls]
+        can_spill = self.memory_budget is not None and self.spill_dir is not None and depth < self.max_depth
+        groups = {}
+        used_bytes = 0
+        parts = None
+
+        for row in rows:
+            key = tuple(row[idx] for idx in group_indices)
+            group = groups.get(key)
+            if group is None:
+                if parts is not None:
+                    parts[hash((depth, key)) % self.partitions].write(row)
+                    continue
+                group = groups[key] = self.new_accumulators()
+                if can_spill:
+                    used_bytes += estimate_row_size(key) + 128 * len(group)
+                    if used_bytes >= self.memory_budget:
+                        parts = [SpillFile(self.spill_dir, "aggregate_part_") for _ in range(self.partitions)]
+                        self.spill_files.extend(parts)
+            for accumulator, argument in zip(group, arguments):
+                accumulator.add(1 if argument is None else row[argument])
+
+        self.stats.groups += len(groups)
+        for key, group in groups.items():
+            yield list(key) + [acc.result() for acc in group]
+        groups.clear()
+
+        if parts is not None:
+            for part in parts:
+                part.flush()
+                self.stats.partitions_spilled += 1
+                self.stats.bytes_written += part.bytes_written
+            for part in parts:
+                yield from self.aggregate_groups(part, depth + 1)
+                part.close()
+
+    def close(self):
+        for spill_file in self.spill_files:
+            spill_file.close()
+        self.spill_files = []
+        super().close()
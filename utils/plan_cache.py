@@ -0,0 +1,221 @@
+# plan_cache.py
+import copy
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable
+
+PLAN_CACHE_SIZE = 256
+# Relative change in a table's row count after which plans over it are re-optimized
+STATS_TOLERANCE = 0.5
+# Tables smaller than this are treated as having this many rows when checking the tolerance
+MIN_STATS_ROWS = 100
+
+LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'|(?<![\w.])\d+(?:\.\d+)?(?![\w.])")
+WORD_PATTERN = re.compile(r"[A-Za-z_]\w*")
+
+SQL_KEYWORDS = {
+    'SELECT', 'DISTINCT', 'FROM', 'WHERE', 'AND', 'OR', 'NOT', 'IN', 'BETWEEN', 'LIKE', 'IS', 'NULL',
+    'AS', 'JOIN', 'NATURAL', 'CROSS', 'ON', 'ORDER', 'GROUP', 'BY', 'ASC', 'DESC', 'LIMIT',
+    'COUNT', 'SUM', 'AVG', 'MIN', 'MAX',
+}
+
+
+def normalize_query(query: str) -> tuple[str, tuple]:
+    """
+    Split a query into a template and its literals. Strings and numbers become
+    `?`, whitespace is collapsed and keywords are upper-cased, so statements
+    that differ only in their constants share one template.
+    """
+    literals = tuple(LITERAL_PATTERN.findall(query))
+    template = LITERAL_PATTERN.sub('?', query)
+    template = WORD_PATTERN.sub(
+        lambda match: match.group(0).upper() if match.group(0).upper() in SQL_KEYWORDS else match.group(0),
+        template
+    )
+    template = re.sub(r"\s+", " ", template).strip().rstrip(';').strip()
+    return template, literals
+
+
+SLOT_PATTERN = re.compile(LITERAL_PATTERN.pattern + r"|\?")
+
+# Placeholder literals of a prepared SELECT are numbered from here, far away from any real constant
+PLACEHOLDER_BASE = 10 ** 15
+
+
+def normalize_prepared(query: str) -> tuple[str, tuple]:
+    """
+    Template of a query with `?` parameters and its literals in order, with
+    None in the slot of each parameter. The template is the one
+    `normalize_query` gives for the query with any literals in those slots.
+    """
+    template, _ = normalize_query(query)
+    slots = tuple(None if match.group(0) == '?' else match.group(0) for match in SLOT_PATTERN.finditer(query))
+    return template, slots
+
+
+def placeholder_literals(literals: tuple) -> tuple:
+    """
+    A distinct literal for every slot of a template, a number where the
+    literal is a number and a string otherwise, to plan a prepared SELECT
+    with. A plan made with them binds to any literals without ambiguity,
+    including strings the optimizer could not parse.
+    """
+    return tuple(
+        str(PLACEHOLDER_BASE + slot) if literal[:1].isdigit() else f"'?{slot}'"
+        for slot, literal in enumerate(literals)
+    )
+
+
+def fill_template(template: str, literals: tuple) -> str:
+    """The query text of a template with its literals written back in."""
+    literals = iter(literals)
+    return re.sub(r"\?", lambda match: next(literals), template) + ";"
+
+
+def bind_literals(query_tree, old: tuple, new: tuple):
+    """
+    Copy of a cached Query Tree with the literals it was planned with replaced
+    by the literals of the new query. Returns None when that is ambiguous (one
+    old literal standing for two new ones) or when a changed literal cannot be
+    found in the tree, in which case the query has to be planned again.
+    """
+    if old == new:
+        return query_tree
+
+    mapping = {}
+    for old_literal, new_literal in zip(old, new):
+        if mapping.setdefault(old_literal, new_literal) != new_literal:
+            return None
+    changed = {literal for literal, value in mapping.items() if literal != value}
+    found = set()
+
+    def replace(match):
+        literal = match.group(0)
+        if literal in changed:
+            found.add(literal)
+        return mapping.get(literal, literal)
+
+    def bind(value):
+        if isinstance(value, str):
+            return LITERAL_PATTERN.sub(replace, value)
+        if isinstance(value, int) and not isinstance(value, bool) and str(value) in changed:
+            found.add(str(value))
+            return int(mapping[str(value)])
+        return value
+
+    def bind_node(node, parent=None):
+        bound = copy.copy(node)
+        bound.val = bind(node.val)
+        bound.condition = bind(node.condition)
+        if hasattr(bound, 'parent'):
+            bound.parent = parent
+        bound.child = [bind_node(child, bound) for child in node.child]
+        return bound
+
+    try:
+        bound_tree = bind_node(query_tree)
+    except ValueError:
+        return None
+    return bound_tree if found == changed else None
+
+
+@dataclass
+class PlanCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    drift_checks: int = 0
+
+
+@dataclass
+class CachedPlan:
+    query_tree: object
+    literals: tuple
+    row_counts: dict = field(default_factory=dict)
+    generations: dict = field(default_factory=dict)
+
+
+class PlanCache:
+    """
+    LRU cache of optimized Query Trees keyed by normalized query text. An entry
+    is dropped when one of its tables is created or dropped, or when the row
+    count of one of its tables has drifted by more than `stats_tolerance`.
+
+    Row counts can only drift through writes, so every write bumps a
+    generation number of its table (`note_write`). A hit only asks for row
+    counts when a table of the plan was written since the last check.
+    """
+    def __init__(self, capacity: int = PLAN_CACHE_SIZE, stats_tolerance: float = STATS_TOLERANCE):
+        self.capacity = capacity
+        self.stats_tolerance = stats_tolerance
+        self.entries: OrderedDict[str, CachedPlan] = OrderedDict()
+        self.generations: dict[str, int] = {}
+        self.stats = PlanCacheStats()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, template: str, literals: tuple, row_count: Callable[[str], int]):
+        with self.lock:
+            entry = self.entries.get(template)
+            if entry is not None and self.was_written(entry):
+                self.stats.drift_checks += 1
+                if self.is_stale(entry, row_count):
+                    del self.entries[template]
+                    self.stats.invalidations += 1
+                    entry = None
+                else:
+                    entry.generations = self.current_generations(entry.row_counts)
+            query_tree = None if entry is None else bind_literals(entry.query_tree, entry.literals, literals)
+            if query_tree is None:
+                self.stats.misses += 1
+                return None
+            self.entries.move_to_end(template)
+            self.stats.hits += 1
+            return query_tree
+
+    def put(self, template: str, literals: tuple, query_tree, tables: list[str], row_count: Callable[[str], int]):
+        with self.lock:
+            if self.capacity <= 0:
+                return
+            self.entries[template] = CachedPlan(
+                query_tree, literals, {table: row_count(table) for table in tables}, self.current_generations(tables)
+            )
+            self.entries.move_to_end(template)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def note_write(self, table_name: str):
+        """Record a write to `table_name`, so plans over it check their row counts again."""
+        with self.lock:
+            table_name = table_name.lower()
+            self.generations[table_name] = self.generations.get(table_name, 0) + 1
+
+    def current_generations(self, tables) -> dict:
+        return {table: self.generations.get(table, 0) for table in tables}
+
+    def was_written(self, entry: CachedPlan) -> bool:
+        return any(self.generations.get(table, 0) != generation for table, generation in entry.generations.items())
+
+    def invalidate(self, table_name: str = None):
+        """Drop the plans that read `table_name`, or every plan when no table is given."""
+        with self.lock:
+            if table_name is None:
+                stale = list(self.entries)
+            else:
+                table_name = table_name.lower()
+                stale = [template for template, entry in self.entries.items() if table_name in entry.row_counts]
+            for template in stale:
+                del self.entries[template]
+            self.stats.invalidations += len(stale)
+
+    def is_stale(self, entry: CachedPlan, row_count: Callable[[str], int]) -> bool:
+        for table, planned in entry.row_counts.items():
+            if abs(row_count(table) - planned) > self.stats_tolerance * max(planned, MIN_STATS_ROWS):
+                return True
+        return False
@@ -0,0 +1,499 @@
+# predicate.py
+import operator as op
+import re
+from dataclasses import dataclass, fields, is_dataclass, replace
+from typing import Callable, List, Optional
+
+from utils.operators import Column, resolve_column, parse_literal, normalize_value
+
+COMPARATORS = {
+    '=': op.eq,
+    '==': op.eq,
+    '!=': op.ne,
+    '<>': op.ne,
+    '<': op.lt,
+    '<=': op.le,
+    '>': op.gt,
+    '>=': op.ge,
+}
+
+# Comparator to use when the operands of a comparison are swapped
+MIRRORED = {'=': '=', '==': '==', '!=': '!=', '<>': '<>', '<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+KEYWORDS = {'AND', 'OR', 'NOT', 'IN', 'BETWEEN', 'LIKE', 'IS', 'NULL'}
+
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<string>'(?:[^']|'')*'|"(?:[^"]|"")*")
+      | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+      | (?P<name>[A-Za-z_][\w.]*)
+      | (?P<op><=|>=|!=|<>|==|=|<|>)
+      | (?P<punct>[(),])
+      | (?P<parameter>\?)
+    )""", re.VERBOSE)
+
+
+@dataclass(frozen=True)
+class ColumnRef:
+    name: str
+
+
+@dataclass(frozen=True)
+class Literal:
+    value: object
+    text: str
+
+
+@dataclass(frozen=True)
+class Parameter:
+    """The `?` placeholder of a prepared statement, numbered from 0 in the statement."""
+    index: int
+
+
+@dataclass(frozen=True)
+class Compare:
+    operator: str
+    left: object
+    right: object
+
+
+@dataclass(frozen=True)
+class And:
+    items: tuple
+
+
+@dataclass(frozen=True)
+class Or:
+    items: tuple
+
+
+@dataclass(frozen=True)
+class Not:
+    item: object
+
+
+@dataclass(frozen=True)
+class In:
+    operand: object
+    values: tuple
+    negated: bool = False
+
+
+@dataclass(frozen=True)
+class Between:
+    operand: object
+    low: object
+    high: object
+    negated: bool = False
+
+
+@dataclass(frozen=True)
+class Like:
+    operand: object
+    pattern: object
+    negated: bool = False
+
+
+@dataclass(frozen=True)
+class IsNull:
+    operand: object
+    negated: bool = False
+
+
+def tokenize(text: str) -> List[tuple]:
+    tokens = []
+    position = 0
+    text = text.rstrip().rstrip(';')
+    while position < len(text):
+        if text[position:].strip() == "":
+            break
+        match = TOKEN_PATTERN.match(text, position)
+        if not match:
+            raise ValueError(f"Error: Invalid WHERE clause near '{text[position:].strip()}'.")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'name' and value.upper() in KEYWORDS:
+            kind, value = 'keyword', value.upper()
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+class Parser:
+    """
+    Recursive-descent parser for WHERE conditions:
+
+        expression := conjunction (OR conjunction)*
+        conjunction := negation (AND negation)*
+        negation := NOT negation | '(' expression ')' | predicate
+        predicate := operand ( comparator operand
+                             | [NOT] IN '(' operand (',' operand)* ')'
+                             | [NOT] BETWEEN operand AND operand
+                             | [NOT] LIKE operand
+                             | IS [NOT] NULL )
+    """
+    def __init__(self, text: str, first_parameter: int = 0):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.position = 0
+        self.parameters = first_parameter
+
+    def peek(self, offset: int = 0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def accept(self, kind: str, value: str = None) -> bool:
+        token_kind, token_value = self.peek()
+        if token_kind == kind and (value is None or token_value == value):
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, kind: str, value: str = None):
+        token = self.peek()
+        if not self.accept(kind, value):
+            raise ValueError(f"Error: Invalid WHERE clause '{self.text}', expected {value or kind} but found {token[1]}.")
+        return token[1]
+
+    def parse(self):
+        expression = self.expression()
+        if self.position != len(self.tokens):
+            raise ValueError(f"Error: Invalid WHERE clause '{self.text}', unexpected '{self.peek()[1]}'.")
+        return expression
+
+    def expression(self):
+        items = [self.conjunction()]
+        while self.accept('keyword', 'OR'):
+            items.append(self.conjunction())
+        return items[0] if len(items) == 1 else Or(tuple(items))
+
+    def conjunction(self):
+        items = [self.negation()]
+        while self.accept('keyword', 'AND'):
+            items.append(self.negation())
+        return items[0] if len(items) == 1 else And(tuple(items))
+
+    def negation(self):
+        if self.accept('keyword', 'NOT'):
+            return Not(self.negation())
+        if self.peek() == ('punct', '('):
+            self.position += 1
+            expression = self.expression()
+            self.expect('punct', ')')
+            return expression
+        return self.predicate()
+
+    def operand(self):
+        kind, value = self.peek()
+        self.position += 1
+        if kind == 'name':
+            return ColumnRef(value)
+        if kind in ('number', 'string'):
+            if kind == 'string' and value[0] == "'":
+                value = "'" + value[1:-1].replace("''", "'") + "'"
+            return Literal(normalize_value(parse_literal(value)), value)
+        if kind == 'keyword' and value == 'NULL':
+            return Literal(None, 'NULL')
+        if kind == 'parameter':
+            self.parameters += 1
+            return Parameter(self.parameters - 1)
+        raise ValueError(f"Error: Invalid WHERE clause '{self.text}', unexpected '{value}'.")
+
+    def predicate(self):
+        operand = self.operand()
+        kind, value = self.peek()
+        if kind == 'op':
+            self.position += 1
+            return Compare(value, operand, self.operand())
+
+        if self.accept('keyword', 'IS'):
+            negated = self.accept('keyword', 'NOT')
+            self.expect('keyword', 'NULL')
+            return IsNull(operand, negated)
+
+        negated = self.accept('keyword', 'NOT')
+        if self.accept('keyword', 'IN'):
+            self.expect('punct', '(')
+            values = [self.operand()]
+            while self.accept('punct', ','):
+                values.append(self.operand())
+            self.expect('punct', ')')
+            return In(operand, tuple(values), negated)
+        if self.accept('keyword', 'BETWEEN'):
+            low = self.operand()
+            self.expect('keyword', 'AND')
+            return Between(operand, low, self.operand(), negated)
+        if self.accept('keyword', 'LIKE'):
+            return Like(operand, self.operand(), negated)
+        raise ValueError(f"Error: Invalid WHERE clause '{self.text}'.")
+
+
+def parse_predicate(condition, first_parameter: int = 0):
+    """
+    Parse a WHERE condition into an expression tree. `?` placeholders become
+    Parameters numbered from `first_parameter`. A condition that is already
+    an expression tree, such as the bound WHERE clause of a prepared
+    statement, is returned as it is.
+    """
+    if not isinstance(condition, str):
+        return condition
+    return Parser(condition, first_parameter).parse()
+
+
+def parameter_literal(value) -> Literal:
+    """
+    The Literal a parameter value stands for, as the parser would have read
+    it from the query. Strings keep the quotes they are stored with.
+    """
+    if value is None:
+        return Literal(None, 'NULL')
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, str):
+        return Literal(value, "'" + value + "'")
+    return Literal(value, repr(value))
+
+
+def bind_parameters(expression, values: list):
+    """Copy of an expression tree with each Parameter replaced by the Literal of its value."""
+    if isinstance(expression, Parameter):
+        return parameter_literal(values[expression.index])
+    if isinstance(expression, tuple):
+        return tuple(bind_parameters(item, values) for item in expression)
+    if is_dataclass(expression) and not isinstance(expression, Literal):
+        return replace(expression, **{
+            field.name: bind_parameters(getattr(expression, field.name), values) for field in fields(expression)
+        })
+    return expression
+
+
+def conjuncts(expression) -> list:
+    """The top-level AND terms of an expression."""
+    if expression is None:
+        return []
+    if isinstance(expression, And):
+        return list(expression.items)
+    return [expression]
+
+
+def disjuncts(expression) -> list:
+    """The top-level OR terms of an expression."""
+    if isinstance(expression, Or):
+        return list(expression.items)
+    return [expression]
+
+
+def combine_conjuncts(items: list):
+    """The inverse of `conjuncts`."""
+    if not items:
+        return None
+    return items[0] if len(items) == 1 else And(tuple(items))
+
+
+def column_references(expression) -> List[str]:
+    """The names of every column an expression reads, in order of appearance."""
+    if isinstance(expression, ColumnRef):
+        return [expression.name]
+    if isinstance(expression, tuple):
+        return [name for item in expression for name in column_references(item)]
+    if is_dataclass(expression) and not isinstance(expression, Literal):
+        return [name for field in fields(expression) for name in column_references(getattr(expression, field.name))]
+    return []
+
+
+def column_comparison(expression, columns: List[Column]):
+    """
+    If the expression compares one column of `columns` with a literal, return
+    (column index, comparator, literal) with the column on the left.
+    """
+    if not isinstance(expression, Compare):
+        return None
+    left, right, comparator = expression.left, expression.right, expression.operator
+    if isinstance(left, Literal) and isinstance(right, ColumnRef):
+        left, right, comparator = right, left, MIRRORED[comparator]
+    if not (isinstance(left, ColumnRef) and isinstance(right, Literal)) or right.value is None:
+        return None
+    try:
+        return resolve_column(columns, left.name), comparator, right
+    except ValueError:
+        return None
+
+
+def like_pattern(pattern: str) -> re.Pattern:
+    """Translate a LIKE pattern (% and _) into a regular expression."""
+    regex = ''.join(
+        '.*' if char == '%' else '.' if char == '_' else re.escape(char)
+        for char in pattern
+    )
+    return re.compile(regex, re.DOTALL)
+
+
+def compile_operand(operand, columns: List[Column]) -> Callable[[list], object]:
+    if isinstance(operand, Parameter):
+        raise ValueError("Error: Parameters must be bound before the condition is evaluated.")
+    if isinstance(operand, Literal):
+        value = operand.value
+        return lambda row: value
+    idx = resolve_column(columns, operand.name)
+    if columns[idx].dtype in ('int', 'float'):
+        return op.itemgetter(idx)
+    return lambda row: normalize_value(row[idx])
+
+
+def compile_predicate(expression, columns: List[Column]) -> Callable[[list], bool]:
+    """
+    Turn an expression tree into a closure over a row. Column references are
+    resolved to indexes once, here, so evaluating a row does no parsing or
+    name lookups. Comparisons with NULL are unknown, and only rows for which
+    the whole expression is true pass.
+    """
+    evaluate = compile_node(expression, columns)
+    return lambda row: evaluate(row) is True
+
+
+def compile_condition(condition, columns: List[Column]) -> Optional[Callable[[list], bool]]:
+    """
+    Compile a Storage Manager Condition into a row predicate with the same
+    semantics as the WHERE term it came from, or None if it cannot be read.
+    """
+    try:
+        return compile_predicate(
+            parse_predicate(f"{condition.column} {condition.operation} {condition.operand}"), columns
+        )
+    except (AttributeError, ValueError):
+        return None
+
+
+def compile_node(expression, columns: List[Column]) -> Callable[[list], Optional[bool]]:
+    """Compile one node to a closure returning True, False or None (unknown)."""
+    if isinstance(expression, Compare):
+        compare = COMPARATORS[expression.operator]
+        comparison = column_comparison(expression, columns)
+        if comparison is not None:
+            idx, comparator, literal = comparison
+            compare = COMPARATORS[comparator]
+            value = literal.value
+            if columns[idx].dtype in ('int', 'float'):
+                def node(row):
+                    item = row[idx]
+                    if item is None:
+                        return None
+                    try:
+                        return compare(item, value)
+                    except TypeError:
+                        return False
+            else:
+                def node(row):
+                    item = row[idx]
+                    if item is None:
+                        return None
+                    try:
+                        return compare(normalize_value(item), value)
+                    except TypeError:
+                        return False
+            return node
+
+        left = compile_operand(expression.left, columns)
+        right = compile_operand(expression.right, columns)
+
+        def node(row):
+            a, b = left(row), right(row)
+            if a is None or b is None:
+                return None
+            try:
+                return compare(a, b)
+            except TypeError:
+                return False
+        return node
+
+    if isinstance(expression, And):
+        items = [compile_node(item, columns) for item in expression.items]
+
+        def node(row):
+            result = True
+            for item in items:
+                value = item(row)
+                if value is False:
+                    return False
+                if value is None:
+                    result = None
+            return result
+        return node
+
+    if isinstance(expression, Or):
+        items = [compile_node(item, columns) for item in expression.items]
+
+        def node(row):
+            result = False
+            for item in items:
+                value = item(row)
+                if value is True:
+                    return True
+                if value is None:
+                    result = None
+            return result
+        return node
+
+    if isinstance(expression, Not):
+        item = compile_node(expression.item, columns)
+
+        def node(row):
+            value = item(row)
+            return None if value is None else not value
+        return node
+
+    if isinstance(expression, In):
+        operand = compile_operand(expression.operand, columns)
+        values = frozenset(value.value for value in expression.values if isinstance(value, Literal) and value.value is not None)
+        others = [compile_operand(value, columns) for value in expression.values if not isinstance(value, Literal)]
+        has_null = any(isinstance(value, Literal) and value.value is None for value in expression.values)
+        negated = expression.negated
+
+        def node(row):
+            item = operand(row)
+            if item is None:
+                return None
+            found = item in values or any(item == other(row) for other in others)
+            if not found and has_null:
+                return None
+            return found != negated
+        return node
+
+    if isinstance(expression, Between):
+        operand = compile_operand(expression.operand, columns)
+        low = compile_operand(expression.low, columns)
+        high = compile_operand(expression.high, columns)
+        negated = expression.negated
+
+        def node(row):
+            item, lower, upper = operand(row), low(row), high(row)
+            if item is None or lower is None or upper is None:
+                return None
+            try:
+                return (lower <= item <= upper) != negated
+            except TypeError:
+                return False
+        return node
+
+    if isinstance(expression, Like):
+        operand = compile_operand(expression.operand, columns)
+        if not isinstance(expression.pattern, Literal) or not isinstance(expression.pattern.value, str):
+            raise ValueError("Error: LIKE needs a string pattern.")
+        pattern = like_pattern(expression.pattern.value)
+        negated = expression.negated
+
+        def node(row):
+            item = operand(row)
+            if item is None:
+                return None
+            return (pattern.fullmatch(str(item)) is not None) != negated
+        return node
+
+    if isinstance(expression, IsNull):
+        operand = compile_operand(expression.operand, columns)
+        negated = expression.negated
+        return lambda row: (operand(row) is None) != negated
+
+    if isinstance(expression, (ColumnRef, Literal)):
+        raise ValueError("Error: A WHERE condition must be a comparison.")
+    raise ValueError(f"Error: Unsupported WHERE condition {expression}.")
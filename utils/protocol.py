@@ -0,0 +1,272 @@
+# protocol.py
+import struct
+from dataclasses import dataclass
+
+# Frame header: payload length and request ID, both big-endian u32
+HEADER_SIZE = 8
+
+# A frame whose payload starts with this byte is a protocol message instead of SQL text
+MESSAGE_MARKER = 0
+
+# Message kinds
+PREPARE = 1    # client: SQL text with `?` placeholders
+EXECUTE = 2    # client: statement handle and parameter values
+PREPARED = 3   # server: statement handle and parameter count
+ERROR = 4      # server: error message
+OPEN = 5       # client: SELECT to run as a cursor
+FETCH = 6      # client: maximum number of rows to send
+CLOSE = 7      # client: close the cursor
+SCHEMA = 8     # server: (name, type, size) of each result column
+ROWS = 9       # server: a batch of rows
+DONE = 10      # server: the cursor is exhausted or closed, with the number of rows sent
+HELLO = 11     # both: requested / accepted result format
+RESULT = 12    # server: execution result in the binary format
+BATCH = 13     # client: statements to execute in order
+RESULTS = 14   # server: the binary results of a batch
+PING = 15      # both: liveness check, answered with an empty PING
+
+# Result formats
+TEXT_FORMAT = 0
+BINARY_FORMAT = 1
+
+# Value tags
+NULL = 0
+INT = 1
+FLOAT = 2
+TEXT = 3
+BIGINT = 4     # an int outside the 64-bit range, as its decimal digits
+
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def encode_message(kind: int, body: bytes = b'') -> bytes:
+    return struct.pack('>BB', MESSAGE_MARKER, kind) + body
+
+
+def decode_message(payload: bytes) -> tuple[int, bytes] | None:
+    """
+    Split a frame payload into (kind, body), or return None when the payload is plain SQL text.
+    """
+    if len(payload) < 2 or payload[0] != MESSAGE_MARKER:
+        return None
+    return payload[1], payload[2:]
+
+
+def encode_values(values: list) -> bytes:
+    parts = [struct.pack('>H', len(values))]
+    for value in values:
+        if value is None:
+            parts.append(struct.pack('>B', NULL))
+        elif isinstance(value, int) and not INT64_MIN <= value <= INT64_MAX:
+            data = str(int(value)).encode()
+            parts.append(struct.pack('>BI', BIGINT, len(data)) + data)
+        elif isinstance(value, int):
+            parts.append(struct.pack('>Bq', INT, int(value)))
+        elif isinstance(value, float):
+            parts.append(struct.pack('>Bd', FLOAT, value))
+        elif isinstance(value, str):
+            data = value.encode()
+            parts.append(struct.pack('>BI', TEXT, len(data)) + data)
+        else:
+            raise ValueError(f"Error: Unsupported parameter type {type(value).__name__}.")
+    return b''.join(parts)
+
+
+def decode_values(data: bytes, offset: int = 0) -> tuple[list, int]:
+    """
+    Decode values written by encode_values starting at `offset`, returning them and the offset after them.
+    """
+    (count,) = struct.unpack_from('>H', data, offset)
+    offset += 2
+    values = []
+    for _ in range(count):
+        tag = data[offset]
+        offset += 1
+        if tag == NULL:
+            values.append(None)
+        elif tag == INT:
+            values.append(struct.unpack_from('>q', data, offset)[0])
+            offset += 8
+        elif tag == FLOAT:
+            values.append(struct.unpack_from('>d', data, offset)[0])
+            offset += 8
+        elif tag in (TEXT, BIGINT):
+            (length,) = struct.unpack_from('>I', data, offset)
+            offset += 4
+            text = data[offset:offset + length].decode()
+            values.append(int(text) if tag == BIGINT else text)
+            offset += length
+        else:
+            raise ValueError(f"Error: Unknown value tag {tag}.")
+    return values, offset
+
+
+def encode_execute(handle: int, parameters: list) -> bytes:
+    return encode_message(EXECUTE, struct.pack('>I', handle) + encode_values(parameters))
+
+
+def decode_execute(body: bytes) -> tuple[int, list]:
+    (handle,) = struct.unpack_from('>I', body, 0)
+    parameters, _ = decode_values(body, 4)
+    return handle, parameters
+
+
+def encode_prepared(handle: int, parameter_count: int) -> bytes:
+    return encode_message(PREPARED, struct.pack('>IH', handle, parameter_count))
+
+
+def decode_prepared(body: bytes) -> tuple[int, int]:
+    return struct.unpack_from('>IH', body, 0)
+
+
+def encode_schema(columns: list[tuple]) -> bytes:
+    return encode_message(SCHEMA, encode_values([value for column in columns for value in column]))
+
+
+def decode_schema(body: bytes) -> list[tuple]:
+    values, _ = decode_values(body)
+    return [tuple(values[i:i + 3]) for i in range(0, len(values), 3)]
+
+
+def encode_rows(rows: list) -> bytes:
+    return encode_message(ROWS, struct.pack('>I', len(rows)) + b''.join(encode_values(row) for row in rows))
+
+
+def decode_rows(body: bytes) -> list:
+    (count,) = struct.unpack_from('>I', body, 0)
+    offset = 4
+    rows = []
+    for _ in range(count):
+        row, offset = decode_values(body, offset)
+        rows.append(row)
+    return rows
+
+
+def encode_count(kind: int, count: int) -> bytes:
+    return encode_message(kind, struct.pack('>I', count))
+
+
+def decode_count(body: bytes) -> int:
+    return struct.unpack_from('>I', body, 0)[0]
+
+
+@dataclass
+class QueryResult:
+    status: str
+    type: str
+    transaction_id: int
+    rows_count: int
+    columns: list
+    rows: list
+
+
+def encode_column(values: list) -> bytes:
+    """
+    Encode one column as a value tag, a null bitmap and the values: packed
+    64-bit ints or doubles when every value fits, length-prefixed UTF-8
+    otherwise. Ints past 64 bits are sent as their digits under BIGINT.
+    """
+    nulls = bytearray((len(values) + 7) // 8)
+    for i, value in enumerate(values):
+        if value is None:
+            nulls[i >> 3] |= 1 << (i & 7)
+    present = [value for value in values if value is not None]
+
+    has_float = any(isinstance(value, float) for value in present)
+    for tag, types, code in ((INT, int, 'q'), (FLOAT, (int, float), 'd')):
+        if (tag == FLOAT) == has_float and all(isinstance(value, types) for value in present):
+            try:
+                data = struct.pack(f'>{len(values)}{code}', *(0 if value is None else value for value in values))
+            except struct.error:
+                continue
+            break
+    else:
+        if present and all(isinstance(value, int) for value in present):
+            tag, encoded = BIGINT, [str(int(value)).encode() for value in present]
+        else:
+            tag, encoded = TEXT, [str(value).encode() for value in present]
+        data = b''.join(struct.pack('>I', len(item)) + item for item in encoded)
+
+    body = bytes(nulls) + data
+    return struct.pack('>BI', tag, len(body)) + body
+
+
+def decode_column(data: bytes, offset: int, count: int) -> tuple[list, int]:
+    tag, length = struct.unpack_from('>BI', data, offset)
+    offset += 5
+    end = offset + length
+    nulls = data[offset:offset + (count + 7) // 8]
+    offset += len(nulls)
+    is_null = [bool(nulls[i >> 3] & (1 << (i & 7))) for i in range(count)]
+
+    if tag in (INT, FLOAT):
+        values = list(struct.unpack_from(f">{count}{'q' if tag == INT else 'd'}", data, offset))
+        values = [None if null else value for value, null in zip(values, is_null)]
+    elif tag in (TEXT, BIGINT):
+        values = []
+        for null in is_null:
+            if null:
+                values.append(None)
+                continue
+            (size,) = struct.unpack_from('>I', data, offset)
+            offset += 4
+            text = data[offset:offset + size].decode()
+            values.append(int(text) if tag == BIGINT else text)
+            offset += size
+    else:
+        raise ValueError(f"Error: Unknown value tag {tag}.")
+    return values, end
+
+
+def encode_result(status: str, type: str, transaction_id: int, rows_count: int,
+                  columns: list[tuple], rows: list) -> bytes:
+    """
+    Binary execution result: status fields, the (name, type, size) of each
+    column, the number of rows, then the values column by column.
+    """
+    return encode_message(RESULT, encode_result_body(status, type, transaction_id, rows_count, columns, rows))
+
+
+def encode_result_body(status: str, type: str, transaction_id: int, rows_count: int,
+                       columns: list[tuple], rows: list) -> bytes:
+    parts = [
+        encode_values([status, type, transaction_id, rows_count]),
+        encode_values([value for column in columns for value in column]),
+        struct.pack('>I', len(rows)),
+    ]
+    for i in range(len(columns)):
+        parts.append(encode_column([row[i] for row in rows]))
+    return b''.join(parts)
+
+
+def decode_result(body: bytes) -> QueryResult:
+    (status, type, transaction_id, rows_count), offset = decode_values(body)
+    schema, offset = decode_values(body, offset)
+    columns = [tuple(schema[i:i + 3]) for i in range(0, len(schema), 3)]
+    (count,) = struct.unpack_from('>I', body, offset)
+    offset += 4
+    values = []
+    for _ in columns:
+        column, offset = decode_column(body, offset, count)
+        values.append(column)
+    rows = [list(row) for row in zip(*values)] if values else [[] for _ in range(count)]
+    return QueryResult(status, type, transaction_id, rows_count, columns, rows)
+
+
+def encode_results(bodies: list[bytes]) -> bytes:
+    """Combine the result bodies of a batch into one RESULTS message."""
+    return encode_message(RESULTS, struct.pack('>H', len(bodies)) + b''.join(
+        struct.pack('>I', len(body)) + body for body in bodies
+    ))
+
+
+def decode_results(body: bytes) -> list[QueryResult]:
+    (count,) = struct.unpack_from('>H', body, 0)
+    offset = 2
+    results = []
+    for _ in range(count):
+        (length,) = struct.unpack_from('>I', body, offset)
+        offset += 4
+        results.append(decode_result(body[offset:offset + length]))
+        offset += length
+    return results
@@ -1,3 +1,9 @@
+import itertools
+import re
+from dataclasses import dataclass
+
+from utils.predicate import Parameter, Parser, bind_parameters, parameter_literal
+
 def get_query_type(query: str):
     """
     Determine the type of SQL query (e.g., SELECT, INSERT, CREATE).
@@ -8,14 +14,20 @@ def get_query_type(query: str):
         return "SELECT"
     elif query.startswith("INSERT"):
         return "INSERT"
+    elif re.match(r"CREATE\s+INDEX\b", query):
+        return "CREATE INDEX"
     elif query.startswith("CREATE"):
         return "CREATE"
     elif query.startswith("UPDATE"):
         return "UPDATE"
     elif query.startswith("DELETE"):
         return "DELETE"
+    elif re.match(r"DROP\s+INDEX\b", query):
+        return "DROP INDEX"
     elif query.startswith("DROP"):
         return "DROP"
+    elif query.startswith("COPY"):
+        return "COPY"
     elif query.startswith("BEGIN TRANSACTION"):
         return "BEGIN TRANSACTION"
     elif query.startswith("COMMIT"):
@@ -30,4 +42,359 @@ def print_tree(tree, level=0):
     if tree is not None:
         print("    " * level + f"Type: {tree.type}, Value: {tree.val}, Condition: {tree.condition}")
         for child in tree.child:
-            print_tree(child, level + 1)
\ No newline at end of file
+            print_tree(child, level + 1)
+
+def parse_table_reference(reference: str):
+    """
+    Split a table reference such as `student`, `student s` or `student AS s`
+    into its table name and alias.
+    """
+    match = re.match(r"^\s*(\w+)(?:\s+(?:AS\s+)?(\w+))?\s*$", reference, re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Error: Invalid table reference '{reference}'.")
+    return match.group(1), match.group(2)
+
+def parse_projection(condition: str):
+    """
+    Parse a projection list into (column, alias) pairs. `*` yields an empty list,
+    meaning every column is kept.
+    """
+    items = []
+    for col in condition.split(','):
+        col = col.strip()
+        if col == "*":
+            continue
+        match = re.match(r'^(\S+)\s+AS\s+(\S+)$', col, re.IGNORECASE)
+        if match:
+            items.append((match.group(1), match.group(2)))
+        else:
+            items.append((col, None))
+    return items
+
+def parse_sort_keys(condition: str):
+    """
+    Parse an ORDER BY condition such as `total_cred DESC, name` into a list of
+    (column, descending) pairs, one per sort key.
+    """
+    keys = []
+    for key in condition.split(','):
+        sort_condition = key.split()
+        if not sort_condition:
+            raise ValueError(f"Error: Invalid ORDER BY clause '{condition}'.")
+        sort_column = sort_condition[0]
+        sort_order = sort_condition[1].lower() if len(sort_condition) > 1 else "asc"
+        if sort_order not in ("asc", "desc") or len(sort_condition) > 2:
+            raise ValueError(f"Error: Invalid ORDER BY clause '{condition}'.")
+        keys.append((sort_column, sort_order == "desc"))
+    return keys
+
+AGGREGATE_FUNCTIONS = ("COUNT", "SUM", "AVG", "MIN", "MAX")
+
+@dataclass
+class AggregateCall:
+    function: str
+    argument: str | None
+    distinct: bool = False
+
+    @property
+    def name(self) -> str:
+        distinct = "DISTINCT " if self.distinct else ""
+        return f"{self.function}({distinct}{self.argument or '*'})"
+
+@dataclass
+class Aggregation:
+    items: list
+    group_by: list
+    distinct: bool = False
+    order_by: list | None = None
+    limit: int | None = None
+
+def split_top_level(text: str, separator: str = ','):
+    """
+    Split on a separator that is not inside parentheses or quotes.
+    """
+    parts, depth, quote, current = [], 0, None, []
+    for char in text:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(''.join(current))
+            current = []
+            continue
+        current.append(char)
+    parts.append(''.join(current))
+    return [part.strip() for part in parts]
+
+def parse_select_item(item: str):
+    """
+    Parse one item of a select list into (column or AggregateCall, alias).
+    """
+    match = re.match(r"^(.+?)(?:\s+AS\s+(\w+))?$", item.strip(), re.IGNORECASE | re.DOTALL)
+    expression, alias = match.group(1).strip(), match.group(2)
+    call = re.match(r"^(\w+)\s*\(\s*(DISTINCT\s+)?(.+?)\s*\)$", expression, re.IGNORECASE)
+    if call and call.group(1).upper() in AGGREGATE_FUNCTIONS:
+        function = call.group(1).upper()
+        argument = call.group(3).strip()
+        if argument == "*":
+            if function != "COUNT" or call.group(2):
+                raise ValueError(f"Error: Invalid aggregate '{expression}'.")
+            argument = None
+        return AggregateCall(function, argument, bool(call.group(2))), alias
+    return expression, alias
+
+def mask_literals(text: str, fill: str = '_'):
+    """
+    The text with the contents of every quoted literal replaced by `fill`, so
+    keywords inside a string are not matched. Offsets are kept, so a match on
+    the masked text can be sliced out of the original.
+    """
+    masked, quote = [], None
+    for char in text:
+        if quote:
+            if char == quote:
+                quote = None
+            else:
+                masked.append(fill)
+                continue
+        elif char in ("'", '"'):
+            quote = char
+        masked.append(char)
+    return ''.join(masked)
+
+def extract_aggregation(query: str):
+    """
+    Take GROUP BY, DISTINCT and aggregate functions out of a SELECT query.
+    Returns the query the optimizer should plan (selecting every column of the
+    filtered input) and the Aggregation to apply on top, or the query unchanged
+    and None when there is nothing to aggregate. ORDER BY and LIMIT are moved
+    into the Aggregation since they refer to aggregated columns.
+    """
+    match = re.match(
+        r"^\s*SELECT\s+(DISTINCT\s+)?(.+?)\s+FROM\s+(.+?)"
+        r"(?:\s+GROUP\s+BY\s+(.+?))?(?:\s+ORDER\s+BY\s+(.+?))?(?:\s+LIMIT\s+(\d+))?\s*;?\s*$",
+        mask_literals(query), re.IGNORECASE | re.DOTALL
+    )
+    if not match:
+        return query, None
+
+    distinct, select_list, source, group_by, order_by, limit = (
+        query[match.start(group):match.end(group)] if match.start(group) != -1 else None for group in range(1, 7)
+    )
+    items = [] if select_list.strip() == "*" else [parse_select_item(item) for item in split_top_level(select_list)]
+    has_aggregate = any(isinstance(expression, AggregateCall) for expression, _ in items)
+    if not (distinct or group_by or has_aggregate):
+        return query, None
+
+    aggregation = Aggregation(
+        items=items,
+        group_by=split_top_level(group_by) if group_by else [],
+        distinct=bool(distinct),
+        order_by=parse_sort_keys(order_by) if order_by else None,
+        limit=int(limit) if limit is not None else None,
+    )
+    return f"SELECT * FROM {source.strip()};", aggregation
+
+PLACEHOLDER_PATTERN = re.compile(r"'(?:[^']|'')*'|\?")
+
+def parse_insert(query: str) -> tuple[str, list[list[str]]]:
+    """
+    The table name and the rows of value texts of an INSERT query.
+    """
+    insert_match = re.match(r"INSERT INTO\s+(\w+)\s+VALUES\s*(.+)", query, re.IGNORECASE | re.DOTALL)
+    if not insert_match:
+        raise ValueError("Error: Invalid INSERT query.")
+
+    table_name = insert_match.group(1)
+    values_str = insert_match.group(2).strip().rstrip(';').strip()
+
+    values_list = []
+    for row in split_top_level(values_str):
+        if not (row.startswith('(') and row.endswith(')')):
+            raise ValueError(f"Error: Invalid row '{row}' in INSERT query.")
+        values_list.append(split_top_level(row[1:-1]))
+
+    if not values_list:
+        raise ValueError(f"Error: No valid data to insert into '{table_name}'.")
+    return table_name, values_list
+
+def parse_update(query: str) -> tuple[str, dict[str, str], str]:
+    """
+    The table name, the value text set for each column and the WHERE clause
+    of an UPDATE query. Keywords and commas inside string literals are not
+    taken for clause or assignment boundaries.
+    """
+    update_match = re.match(
+        r"UPDATE\s+(\w+)\s+SET\s+(.+)\s+WHERE\s+(.+)", mask_literals(query), re.IGNORECASE | re.DOTALL
+    )
+    if not update_match:
+        raise ValueError("Error: Invalid UPDATE query.")
+
+    table_name, set_clause, where_clause = (
+        query[update_match.start(group):update_match.end(group)] for group in (1, 2, 3)
+    )
+    update_values = {}
+    for set_part in split_top_level(set_clause):
+        match = re.match(r"(\w+)\s*=\s*(.+)", set_part, re.DOTALL)
+        if not match:
+            raise ValueError("Error: Invalid SET clause. Ensure it follows the correct format 'column = value'.")
+        update_values[match.group(1)] = match.group(2).strip()
+    return table_name, update_values, where_clause
+
+def parse_delete(query: str) -> tuple[str, str]:
+    """
+    The table name and the WHERE clause of a DELETE query.
+    """
+    delete_match = re.match(r"DELETE FROM\s+(\w+)\s+WHERE\s+(.+)", mask_literals(query), re.IGNORECASE | re.DOTALL)
+    if not delete_match:
+        raise ValueError("Error: Invalid DELETE query.")
+    return delete_match.group(1).strip().lower(), query[delete_match.start(2):delete_match.end(2)].strip()
+
+def format_literal(value) -> str:
+    """
+    Render a parameter value as a SQL literal, doubling the quotes of a
+    string. Used to show a bound statement in results and logs, and to bind a
+    value into a cached plan, whose conditions are read by the WHERE parser.
+    """
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    raise ValueError(f"Error: Unsupported parameter type {type(value).__name__}.")
+
+def stored_text(value) -> str:
+    """
+    The text a parameter value is written to a table as, the same text an
+    INSERT or UPDATE passes on for a literal: strings keep their quotes and
+    nothing in them is escaped.
+    """
+    if value is not None and not isinstance(value, (int, float, str)):
+        raise ValueError(f"Error: Unsupported parameter type {type(value).__name__}.")
+    return parameter_literal(value).text
+
+@dataclass
+class PreparedSelect:
+    """
+    What executing a prepared SELECT needs besides its parameters: the
+    aggregation taken out of it, and the templates of the plan cache and the
+    result cache with a None among their literals for each parameter.
+    """
+    aggregation: Aggregation | None
+    use_cache: bool
+    plan_template: str
+    plan_slots: tuple
+    cache_template: str
+    cache_slots: tuple
+
+    def bind(self, parameters: list) -> tuple[tuple, tuple]:
+        """The (template, literals) keys of the plan cache and the result cache."""
+        literals = [format_literal(value) for value in parameters]
+        return (
+            (self.plan_template, fill_slots(self.plan_slots, literals)),
+            (self.cache_template, fill_slots(self.cache_slots, literals)),
+        )
+
+def fill_slots(slots: tuple, literals: list) -> tuple:
+    literals = iter(literals)
+    return tuple(next(literals) if slot is None else slot for slot in slots)
+
+@dataclass
+class PreparedStatement:
+    """
+    A statement parsed once. Each `?` placeholder (outside string literals) is
+    kept as a Parameter in the parsed parts: the INSERT rows, the UPDATE
+    assignments and the WHERE clause. Executing the statement binds the
+    parameter values into those parts, so a value is never written into SQL
+    text and parsed again, and any string can be bound.
+    """
+    query: str
+    query_type: str
+    parameter_count: int
+    table_name: str | None = None
+    rows: list | None = None
+    assignments: dict | None = None
+    where: object = None
+    select: PreparedSelect | None = None
+
+    def check_parameters(self, parameters: list):
+        if len(parameters) != self.parameter_count:
+            raise ValueError(f"Error: Expected {self.parameter_count} parameters, got {len(parameters)}.")
+
+    def render(self, parameters: list) -> str:
+        """
+        The query with the parameters written in as literals, for results and logs.
+        """
+        values = iter(parameters)
+        return PLACEHOLDER_PATTERN.sub(
+            lambda match: format_literal(next(values)) if match.group(0) == '?' else match.group(0), self.query
+        )
+
+    def bind_rows(self, parameters: list) -> list[list[str]]:
+        return [[bind_value(value, parameters) for value in row] for row in self.rows]
+
+    def bind_assignments(self, parameters: list) -> dict[str, str]:
+        return {column: bind_value(value, parameters) for column, value in self.assignments.items()}
+
+    def bind_where(self, parameters: list):
+        return bind_parameters(self.where, parameters)
+
+def bind_value(value, parameters: list) -> str:
+    return stored_text(parameters[value.index]) if isinstance(value, Parameter) else value
+
+def parameter_value(text: str, parameters) -> "str | Parameter":
+    """
+    A value of an INSERT row or an UPDATE assignment: a Parameter for `?`,
+    otherwise the text as it is.
+    """
+    if text == '?':
+        return Parameter(next(parameters))
+    if any(match.group(0) == '?' for match in PLACEHOLDER_PATTERN.finditer(text)):
+        raise ValueError(f"Error: A parameter must stand for a whole value, not part of '{text}'.")
+    return text
+
+def prepare_statement(query: str) -> PreparedStatement:
+    """
+    Parse an INSERT, UPDATE or DELETE with `?` placeholders once. A SELECT is
+    prepared further by the executor, which owns the plan cache; statements of
+    other types cannot take parameters.
+    """
+    query_type = get_query_type(query)
+    if query_type == "UNKNOWN":
+        raise ValueError(f"Error: Cannot prepare query '{query}'.")
+    parameter_count = sum(1 for match in PLACEHOLDER_PATTERN.finditer(query) if match.group(0) == '?')
+    statement = PreparedStatement(query, query_type, parameter_count)
+    parameters = itertools.count()
+
+    if query_type == "INSERT":
+        statement.table_name, rows = parse_insert(query)
+        statement.rows = [[parameter_value(value, parameters) for value in row] for row in rows]
+        used = next(parameters)
+    elif query_type == "UPDATE":
+        statement.table_name, update_values, where_clause = parse_update(query)
+        statement.assignments = {
+            column: parameter_value(value, parameters) for column, value in update_values.items()
+        }
+        parser = Parser(where_clause, next(parameters))
+        statement.where = parser.parse()
+        used = parser.parameters
+    elif query_type == "DELETE":
+        statement.table_name, where_clause = parse_delete(query)
+        parser = Parser(where_clause)
+        statement.where = parser.parse()
+        used = parser.parameters
+    else:
+        used = 0
+
+    if query_type != "SELECT" and used != parameter_count:
+        raise ValueError(f"Error: Parameters of a {query_type} can only stand for values.")
+    return statement
@@ -20,7 +20,7 @@ def print_table(data, column_names, aliases):
     print(row_format.format(*aliases))
     print(separator)
     for row in data:
-        print(row_format.format(*row))
+        print(row_format.format(*map(str, row)))
 
 def format_table(data, column_names, aliases):
     """Helper function to format a table and return it as a string."""
@@ -42,7 +42,7 @@ def format_table(data, column_names, aliases):
     output.append(separator)  # Add separator line
     
     for row in data:
-        output.append(row_format.format(*row))  # Add data rows
+        output.append(row_format.format(*map(str, row)))  # Add data rows
     
     # Join the list into a single string and return
     return "\n".join(output)
@@ -70,6 +70,10 @@ def process_columns_and_data(schema, columns, data):
     else:
         raise ValueError("Error: `columns` must be a list or a dictionary.")
     
+    # Rows from the executor already hold exactly these columns, in this order
+    if column_indices == list(range(len(column_names))):
+        return aliases, data
+
     # Project data based on column indices
     projected_data = [[row[idx] for idx in column_indices] for row in data]
     return aliases, projected_data
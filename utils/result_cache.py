@@ -0,0 +1,117 @@
+# result_cache.py
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from utils.query import parse_table_reference
+from utils.spill import estimate_row_size
+
+RESULT_CACHE_BYTES = 0
+
+NO_CACHE_PATTERN = re.compile(r"^(\s*SELECT)\s+SQL_NO_CACHE\b", re.IGNORECASE)
+
+
+def strip_cache_hint(query: str) -> tuple[str, bool]:
+    """
+    Remove a `SELECT SQL_NO_CACHE` hint from a query. Returns the query and
+    whether its result may be cached.
+    """
+    stripped = NO_CACHE_PATTERN.sub(r"\1", query, count=1)
+    return stripped, stripped == query
+
+
+@dataclass
+class ResultCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    bytes_cached: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+@dataclass
+class CachedResult:
+    rows: list
+    schema: object
+    columns: object
+    table_names: list
+    tables: set
+    size: int
+
+
+class ResultCache:
+    """
+    LRU cache of SELECT results keyed by normalized query text, bounded by the
+    estimated size of the cached rows. Every entry records the tables it read,
+    and a write to one of them drops the entry.
+
+    Each invalidation also bumps a generation number of the table. A query
+    takes the generations of its tables before it runs and passes them to
+    `put`, which drops the result if a table was invalidated in the meantime.
+    """
+    def __init__(self, capacity: int = RESULT_CACHE_BYTES):
+        self.capacity = capacity
+        self.entries: OrderedDict[tuple, CachedResult] = OrderedDict()
+        self.generations: dict[str, int] = {}
+        self.stats = ResultCacheStats()
+        self.lock = threading.RLock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key: tuple) -> CachedResult | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats.hits += 1
+            return entry
+
+    def generation(self, table_names: list[str]) -> tuple:
+        tables = sorted({parse_table_reference(name)[0].lower() for name in table_names})
+        with self.lock:
+            return tuple(self.generations.get(table, 0) for table in tables)
+
+    def put(self, key: tuple, rows: list, schema, columns, table_names: list[str], generation: tuple = None):
+        with self.lock:
+            if generation is not None and generation != self.generation(table_names):
+                return
+            size = sum(estimate_row_size(row) for row in rows)
+            if size > self.capacity:
+                return
+            tables = {parse_table_reference(name)[0].lower() for name in table_names}
+            self.discard(key)
+            self.entries[key] = CachedResult(rows, schema, columns, table_names, tables, size)
+            self.stats.bytes_cached += size
+            while self.stats.bytes_cached > self.capacity:
+                _, evicted = self.entries.popitem(last=False)
+                self.stats.bytes_cached -= evicted.size
+                self.stats.evictions += 1
+
+    def discard(self, key: tuple):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.stats.bytes_cached -= entry.size
+
+    def invalidate(self, table_name: str):
+        """Drop every result that read `table_name`."""
+        with self.lock:
+            table_name = table_name.lower()
+            self.generations[table_name] = self.generations.get(table_name, 0) + 1
+            stale = [key for key, entry in self.entries.items() if table_name in entry.tables]
+            for key in stale:
+                self.discard(key)
+            self.stats.invalidations += len(stale)
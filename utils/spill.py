@@ -0,0 +1,65 @@
+# spill.py
+import os
+import pickle
+import sys
+import tempfile
+from typing import Iterable, Iterator
+
+SPILL_BATCH_SIZE = 1024
+
+
+def estimate_row_size(row) -> int:
+    """Rough in-memory size of a row in bytes, used to enforce memory budgets."""
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+
+
+class SpillFile:
+    """
+    A temporary file of rows written in pickled batches and read back as a stream.
+    The file is removed when it is closed.
+    """
+    def __init__(self, directory: str, prefix: str = "spill_"):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix=f".{prefix}", suffix=".tmp", dir=directory)
+        self.file = os.fdopen(fd, "wb")
+        self.bytes_written = 0
+        self.rows_written = 0
+        self.batch = []
+
+    def write(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= SPILL_BATCH_SIZE:
+            self.flush()
+
+    def write_all(self, rows: Iterable):
+        for row in rows:
+            self.write(row)
+        self.flush()
+
+    def flush(self):
+        if self.batch:
+            data = pickle.dumps(self.batch, pickle.HIGHEST_PROTOCOL)
+            self.file.write(data)
+            self.bytes_written += len(data)
+            self.rows_written += len(self.batch)
+            self.batch = []
+
+    def __iter__(self) -> Iterator:
+        self.flush()
+        if not self.file.closed:
+            self.file.close()
+        with open(self.path, "rb") as f:
+            while True:
+                try:
+                    batch = pickle.load(f)
+                except EOFError:
+                    return
+                yield from batch
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,195 @@
+# table_file.py
+import os
+import struct
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator
+
+PAGE_SIZE = 4096
+TABLE_FILE_SUFFIX = "_table.bin"
+
+# Layout of a Storage Manager table file, little-endian:
+#   u32 first page, u32 block count, u32 length of the data after byte 12,
+#   "HEAD", u32 header length, u32 row count, u16 version, u16 length of the
+#   attribute list, u16 attribute count, the attributes, 0xCC,
+#   then one block per row: "RC", the values, 0xCC.
+# An attribute is u16 length + name, u16 length + type, u16 size. Values are
+# i32 (int), f32 (float) or u16 length + bytes (char, varchar).
+FILE_HEADER = struct.Struct("<III4sII")
+ATTRIBUTE_HEADER = struct.Struct("<HHH")
+HEAD_MAGIC = b"HEAD"
+RECORD_MAGIC = b"RC"
+BLOCK_END = 0xCC
+U16 = struct.Struct("<H")
+FIXED_TYPES = {"int": struct.Struct("<i"), "float": struct.Struct("<f")}
+STRING_TYPES = ("char", "varchar")
+
+
+class TableFormatError(ValueError):
+    pass
+
+
+@dataclass
+class TableHeader:
+    metadata: list[tuple]
+    row_count: int
+    data_start: int
+    data_end: int
+
+
+def table_path(base_path: str, table_name: str) -> str:
+    return os.path.join(base_path, table_name.lower() + TABLE_FILE_SUFFIX)
+
+
+def read_header(buffer, complete: bool = True) -> TableHeader:
+    """
+    Decode the header of a table file held in any object supporting the
+    buffer protocol. Unless `complete`, the buffer only needs to hold the
+    header, not the row blocks after it.
+    """
+    try:
+        _, _, data_length, magic, header_length, row_count = FILE_HEADER.unpack_from(buffer, 0)
+        offset = FILE_HEADER.size
+        if magic != HEAD_MAGIC:
+            raise TableFormatError("Error: Table file has no header block.")
+        _, _, attribute_count = ATTRIBUTE_HEADER.unpack_from(buffer, offset)
+        offset += ATTRIBUTE_HEADER.size
+        metadata = []
+        for _ in range(attribute_count):
+            fields = []
+            for _ in range(2):
+                length, = U16.unpack_from(buffer, offset)
+                fields.append(bytes(buffer[offset + 2:offset + 2 + length]).decode())
+                offset += 2 + length
+            size, = U16.unpack_from(buffer, offset)
+            offset += 2
+            metadata.append((fields[0], fields[1].lower(), size))
+    except struct.error as e:
+        raise TableFormatError(f"Error: Truncated table file header: {e}") from None
+    data_start = 12 + header_length
+    data_end = 12 + data_length
+    if offset + 1 != data_start or buffer[offset] != BLOCK_END or (complete and data_end > len(buffer)):
+        raise TableFormatError("Error: Unexpected table file header.")
+    for _, dtype, _ in metadata:
+        if dtype not in FIXED_TYPES and dtype not in STRING_TYPES:
+            raise TableFormatError(f"Error: Unsupported column type '{dtype}' in table file.")
+    return TableHeader(metadata, row_count, data_start, data_end)
+
+
+def decode_rows(buffer, header: TableHeader) -> list[list]:
+    """Decode every row block of a table file."""
+    return list(iter_rows(buffer, header))
+
+
+def iter_rows(buffer, header: TableHeader, positions: list[int] | None = None,
+              predicate: Callable[[list], bool] | None = None, late: Iterable[int] = ()) -> Iterator[list]:
+    """
+    Walk the row blocks of a table file in any buffer (bytes, a memoryview of
+    an mmap, ...) with struct.unpack_from, decoding only the columns at the
+    distinct `positions`, in that order. The other values are stepped over
+    without creating Python objects for them.
+
+    Rows failing `predicate` are skipped. The string columns at the output
+    slots in `late`, which the predicate must not read, are only located
+    while walking a row and decoded once the row has passed.
+    """
+    count = len(header.metadata)
+    slots = [None] * count
+    for slot, position in enumerate(range(count) if positions is None else positions):
+        slots[position] = slot
+    width = count if positions is None else len(positions)
+    late = set(late)
+    columns = [
+        (FIXED_TYPES.get(dtype), slot, slot in late)
+        for (_, dtype, _), slot in zip(header.metadata, slots)
+    ]
+    unpack_length = U16.unpack_from
+    offset = header.data_start
+    rows = 0
+    try:
+        while offset < header.data_end:
+            if buffer[offset] != RECORD_MAGIC[0] or buffer[offset + 1] != RECORD_MAGIC[1]:
+                raise TableFormatError(f"Error: Expected a row block at byte {offset}.")
+            offset += 2
+            row = [None] * width
+            deferred = []
+            for decoder, slot, is_late in columns:
+                if decoder is not None:
+                    if slot is not None:
+                        row[slot] = decoder.unpack_from(buffer, offset)[0]
+                    offset += decoder.size
+                else:
+                    length, = unpack_length(buffer, offset)
+                    if is_late:
+                        deferred.append((slot, offset + 2, length))
+                    elif slot is not None:
+                        row[slot] = str(buffer[offset + 2:offset + 2 + length], "utf-8")
+                    offset += 2 + length
+            if buffer[offset] != BLOCK_END:
+                raise TableFormatError(f"Error: Unterminated row block at byte {offset}.")
+            offset += 1
+            rows += 1
+            if predicate is not None and not predicate(row):
+                continue
+            for slot, start, length in deferred:
+                row[slot] = str(buffer[start:start + length], "utf-8")
+            yield row
+    except (struct.error, IndexError) as e:
+        raise TableFormatError(f"Error: Truncated row block: {e}") from None
+    if rows != header.row_count:
+        raise TableFormatError("Error: Table file row count does not match its header.")
+
+
+def block_end(buffer, offset: int, metadata: list[tuple]) -> int | None:
+    """The offset just past the row block at `offset`, or None if the buffer ends inside it."""
+    offset += 2
+    for _, dtype, _ in metadata:
+        decoder = FIXED_TYPES.get(dtype)
+        if decoder is not None:
+            offset += decoder.size
+        else:
+            if offset + 2 > len(buffer):
+                return None
+            length, = U16.unpack_from(buffer, offset)
+            offset += 2 + length
+    return offset + 1 if offset < len(buffer) else None
+
+
+def decode_chunks(chunks: Iterable[bytes]) -> Iterator[list]:
+    """
+    Decode the rows of a table file that arrives as consecutive chunks, such
+    as its pages, in order. Only the current chunk and the part of a row
+    block it ends in are held, never the whole file.
+    """
+    buffer = bytearray()
+    header = None
+    position = 0  # File offset of buffer[0]
+    rows = 0
+    for chunk in chunks:
+        buffer += chunk
+        if header is None:
+            if len(buffer) < FILE_HEADER.size:
+                continue
+            header_length = FILE_HEADER.unpack_from(buffer, 0)[4]
+            if len(buffer) < 12 + header_length:
+                continue
+            header = read_header(buffer, complete=False)
+            offset = header.data_start
+        else:
+            offset = 0
+        end = header.data_end - position
+        stop, count = offset, 0
+        while stop < min(end, len(buffer)):
+            following = block_end(buffer, stop, header.metadata)
+            if following is None or following > end:
+                break
+            stop, count = following, count + 1
+        yield from iter_rows(buffer, TableHeader(header.metadata, count, offset, stop))
+        rows += count
+        del buffer[:stop]
+        position += stop
+        if position >= header.data_end:
+            break
+    if header is None or position < header.data_end:
+        raise TableFormatError("Error: Truncated table file.")
+    if rows != header.row_count:
+        raise TableFormatError("Error: Table file row count does not match its header.")
@@ -0,0 +1,318 @@
+# vectorized.py
+import itertools
+import operator as op
+from typing import Callable, Iterator, List
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from utils.operators import Column, Operator, TableScan, resolve_column, normalize_value
+from utils.predicate import (
+    COMPARATORS, Literal, Compare, And, Or, Not, In, Between, Like, IsNull, like_pattern
+)
+
+BATCH_SIZE = 4096
+
+NUMPY_DTYPES = {
+    'int': 'int64',
+    'float': 'float64',
+}
+
+def is_available() -> bool:
+    return np is not None
+
+
+class Batch:
+    """A slice of up to BATCH_SIZE rows stored as one NumPy array per column."""
+    __slots__ = ('arrays', 'length')
+
+    def __init__(self, arrays: list, length: int):
+        self.arrays = arrays
+        self.length = length
+
+
+def to_array(values: list, column: Column):
+    """
+    Convert the values of one column to a typed array, or an object array if
+    they do not fit. A column holding NULLs stays an object array, since
+    NumPy would turn None into NaN in a float array.
+    """
+    dtype = NUMPY_DTYPES.get(column.dtype)
+    if dtype is not None and not any(value is None for value in values):
+        try:
+            return np.array(values, dtype=dtype)
+        except (TypeError, ValueError, OverflowError):
+            pass
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+class VectorOperator:
+    """
+    Base class of the vectorized engine. Instead of rows, a vector operator
+    produces Batches, so work is done once per column array instead of per row.
+    """
+    def __init__(self, columns: List[Column], children: List['VectorOperator'] = None):
+        self.columns = columns
+        self.children = children or []
+
+    def batches(self) -> Iterator[Batch]:
+        raise NotImplementedError
+
+    def close(self):
+        for child in self.children:
+            child.close()
+
+    def column_index(self, name: str) -> int:
+        return resolve_column(self.columns, name)
+
+
+class VectorScan(VectorOperator):
+    """Cuts the rows of a table scan into column batches."""
+    def __init__(self, scan: TableScan, batch_size: int = BATCH_SIZE):
+        super().__init__(scan.columns)
+        self.scan = scan
+        self.batch_size = batch_size
+
+    def batches(self):
+        rows = iter(self.scan)
+        columns = self.columns
+        while True:
+            chunk = list(itertools.islice(rows, self.batch_size))
+            if not chunk:
+                return
+            yield Batch([to_array(values, col) for values, col in zip(zip(*chunk), columns)], len(chunk))
+
+    def close(self):
+        self.scan.close()
+
+
+def normalized_array(array):
+    """Object arrays hold quoted strings; strip the quotes so they compare by content."""
+    if array.dtype == object:
+        return np.frompyfunc(normalize_value, 1, 1)(array)
+    return array
+
+
+def is_object(value) -> bool:
+    return not isinstance(value, np.ndarray) or value.dtype == object
+
+
+def null_mask(value, length: int):
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            return np.frompyfunc(lambda item: item is None, 1, 1)(value).astype(bool)
+        return np.zeros(length, dtype=bool)
+    return np.full(length, value is None)
+
+
+def safe_apply(function, *operands):
+    """Apply a Python function elementwise; values that cannot be compared give False."""
+    def apply(*items):
+        if any(item is None for item in items):
+            return False
+        try:
+            return bool(function(*items))
+        except TypeError:
+            return False
+    return np.asarray(np.frompyfunc(apply, len(operands), 1)(*operands), dtype=bool)
+
+
+def compare_arrays(compare, left, right, length: int):
+    """Compare two operands (arrays or scalars). Only typed arrays get the NumPy fast path."""
+    if is_object(left) and is_object(right) or any(
+        isinstance(value, np.ndarray) and value.dtype == object for value in (left, right)
+    ):
+        result = safe_apply(compare, left, right)
+    else:
+        try:
+            result = np.asarray(compare(left, right), dtype=bool)
+        except TypeError:
+            result = np.zeros(length, dtype=bool)
+    if np.ndim(result) == 0:
+        return np.full(length, bool(result))
+    return result
+
+
+def compile_mask(expression, columns: List[Column]) -> Callable[[Batch], 'np.ndarray']:
+    """
+    Compile a WHERE expression tree into a function that evaluates it over a
+    whole batch and returns a boolean mask with one entry per row. NULLs follow
+    the same three-valued logic as the row engine.
+    """
+    node = compile_mask_node(expression, columns)
+    return lambda batch: node(batch)[0]
+
+
+def compile_mask_operand(operand, columns: List[Column]):
+    if isinstance(operand, Literal):
+        value = operand.value
+        return lambda batch: value
+    idx = resolve_column(columns, operand.name)
+    return lambda batch: normalized_array(batch.arrays[idx])
+
+
+def compile_mask_node(expression, columns: List[Column]):
+    """Compile one node to a function returning (true mask, unknown mask)."""
+    if isinstance(expression, Compare):
+        compare = COMPARATORS[expression.operator]
+        left = compile_mask_operand(expression.left, columns)
+        right = compile_mask_operand(expression.right, columns)
+
+        def node(batch):
+            a, b = left(batch), right(batch)
+            unknown = null_mask(a, batch.length) | null_mask(b, batch.length)
+            return compare_arrays(compare, a, b, batch.length) & ~unknown, unknown
+        return node
+
+    if isinstance(expression, (And, Or)):
+        items = [compile_mask_node(item, columns) for item in expression.items]
+        is_and = isinstance(expression, And)
+
+        def node(batch):
+            results = [item(batch) for item in items]
+            trues = [true for true, _ in results]
+            falses = [~true & ~unknown for true, unknown in results]
+            if is_and:
+                true, false = np.logical_and.reduce(trues), np.logical_or.reduce(falses)
+            else:
+                true, false = np.logical_or.reduce(trues), np.logical_and.reduce(falses)
+            return true, ~true & ~false
+        return node
+
+    if isinstance(expression, Not):
+        item = compile_mask_node(expression.item, columns)
+
+        def node(batch):
+            true, unknown = item(batch)
+            return ~true & ~unknown, unknown
+        return node
+
+    if isinstance(expression, In):
+        operand = compile_mask_operand(expression.operand, columns)
+        if not all(isinstance(value, Literal) for value in expression.values):
+            raise ValueError("Error: Vectorized IN needs a list of literals.")
+        values = [value.value for value in expression.values if value.value is not None]
+        has_null = len(values) != len(expression.values)
+        negated = expression.negated
+
+        def node(batch):
+            a = operand(batch)
+            unknown = null_mask(a, batch.length)
+            if is_object(a):
+                lookup = frozenset(values)
+                found = safe_apply(lambda item: item in lookup, a)
+            else:
+                found = np.isin(a, [value for value in values if isinstance(value, (int, float))])
+            if has_null:
+                unknown = unknown | ~found
+            return (found != negated) & ~unknown, unknown
+        return node
+
+    if isinstance(expression, Between):
+        operand = compile_mask_operand(expression.operand, columns)
+        low = compile_mask_operand(expression.low, columns)
+        high = compile_mask_operand(expression.high, columns)
+        negated = expression.negated
+
+        def node(batch):
+            a, lower, upper = operand(batch), low(batch), high(batch)
+            unknown = null_mask(a, batch.length) | null_mask(lower, batch.length) | null_mask(upper, batch.length)
+            inside = compare_arrays(op.ge, a, lower, batch.length) & compare_arrays(op.le, a, upper, batch.length)
+            return (inside != negated) & ~unknown, unknown
+        return node
+
+    if isinstance(expression, Like):
+        operand = compile_mask_operand(expression.operand, columns)
+        if not isinstance(expression.pattern, Literal) or not isinstance(expression.pattern.value, str):
+            raise ValueError("Error: LIKE needs a string pattern.")
+        pattern = like_pattern(expression.pattern.value)
+        negated = expression.negated
+
+        def node(batch):
+            a = operand(batch)
+            unknown = null_mask(a, batch.length)
+            found = safe_apply(lambda item: pattern.fullmatch(str(item)) is not None, a) if isinstance(a, np.ndarray) \
+                else np.full(batch.length, a is not None and pattern.fullmatch(str(a)) is not None)
+            return (found != negated) & ~unknown, unknown
+        return node
+
+    if isinstance(expression, IsNull):
+        operand = compile_mask_operand(expression.operand, columns)
+        negated = expression.negated
+
+        def node(batch):
+            return null_mask(operand(batch), batch.length) != negated, np.zeros(batch.length, dtype=bool)
+        return node
+
+    raise ValueError(f"Error: Unsupported WHERE condition {expression}.")
+
+
+class VectorFilter(VectorOperator):
+    """Keeps the rows of each batch selected by a boolean mask."""
+    def __init__(self, child: VectorOperator, mask: Callable[[Batch], 'np.ndarray']):
+        super().__init__(child.columns, [child])
+        self.mask = mask
+
+    def batches(self):
+        for batch in self.children[0].batches():
+            mask = self.mask(batch)
+            count = int(np.count_nonzero(mask))
+            if count == batch.length:
+                yield batch
+            elif count:
+                yield Batch([array[mask] for array in batch.arrays], count)
+
+
+class VectorProject(VectorOperator):
+    """Selects column arrays; the arrays themselves are shared, not copied."""
+    def __init__(self, child: VectorOperator, items: list):
+        self.indices = [child.column_index(name) for name, _ in items]
+        columns = [
+            Column(
+                child.columns[idx].table, child.columns[idx].name,
+                child.columns[idx].dtype, child.columns[idx].size, alias
+            )
+            for idx, (_, alias) in zip(self.indices, items)
+        ]
+        super().__init__(columns, [child])
+
+    def batches(self):
+        indices = self.indices
+        for batch in self.children[0].batches():
+            yield Batch([batch.arrays[idx] for idx in indices], batch.length)
+
+
+class VectorLimit(VectorOperator):
+    """Stops pulling batches once `count` rows have been produced; the last batch is a view."""
+    def __init__(self, child: VectorOperator, count: int):
+        super().__init__(child.columns, [child])
+        self.count = count
+
+    def batches(self):
+        remaining = self.count
+        if remaining <= 0:
+            return
+        for batch in self.children[0].batches():
+            if batch.length >= remaining:
+                yield Batch([array[:remaining] for array in batch.arrays], remaining)
+                return
+            remaining -= batch.length
+            yield batch
+
+
+class BatchToRows(Operator):
+    """The boundary back to the row engine: turns column batches into row lists."""
+    def __init__(self, child: VectorOperator):
+        super().__init__(child.columns)
+        self.child = child
+
+    def __iter__(self):
+        for batch in self.child.batches():
+            yield from map(list, zip(*[array.tolist() for array in batch.arrays]))
+
+    def close(self):
+        self.child.close()